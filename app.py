@@ -1,54 +1,273 @@
-import sqlite3
-from flask import Flask, render_template
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import Flask, Response, render_template, request
 import json
+import pandas as pd
+import ideapod_availability
+import ideapod_db
+import ideapod_hll
+import ideapod_json
+import ideapod_store
+import ideapod_catering
+import ideapod_space
+import ideapod_group
+import ideapod_worker
 
 app = Flask(__name__)
 
-def get_db_connection():
-    conn = sqlite3.connect('db/ideapod.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+# 页面: (预计算结果文件, 分析函数, 模板, 数据缺失提示)
+PAGES = {
+    'catering': ('static/catering_results.json', ideapod_catering.analyze, 'catering.html', "餐饮分析数据文件未找到，请先运行预计算脚本"),
+    'space': ('static/space_results.json', ideapod_space.analyze, 'space.html', "空间分析数据文件未找到，请先运行预计算脚本"),
+    'group': ('static/group_results.json', ideapod_group.analyze, 'group.html', "集团数据文件未找到，请先运行预计算脚本")
+}
+
+# 按需计算结果缓存的总大小上限（JSON 字节数）
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class ResultCache:
+    """按 JSON 字节数限制总大小的 LRU 缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, text: str) -> None:
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.total_bytes -= self._items.pop(key)[1]
+            self._items[key] = (text, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+
+@app.before_request
+def start_worker():
+    """
+    在处理请求的进程中启动后台重算任务（重复调用无效）：python app.py、flask run 和 gunicorn 等方式都适用，
+    debug 模式下 reloader 的父进程不处理请求，不会启动；多个进程时只有一个监视增量文件，任务经文件锁依次执行
+    """
+    ideapod_worker.start()
+
+def parse_query_params(args):
+    """解析 from / to（YYYY-MM-DD）和 line（逗号分隔）参数，格式错误时抛出 ValueError"""
+    start_date = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else None
+    end_date = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else None
+    if start_date and end_date and start_date > end_date:
+        raise ValueError("开始日期不能晚于结束日期")
+    lines = tuple(sorted({x.strip() for x in args.get('line', '').split(',') if x.strip()})) or None
+    return start_date, end_date, lines
+
+# 当前的 (数据版本, 门店列表)，数据库更新后重新查询
+_stores = (None, [])
+
+def list_stores():
+    global _stores
+    version = ideapod_db.data_version()
+    if _stores[0] != version:
+        conn = ideapod_db.get_db_connection()
+        try:
+            _stores = (version, ideapod_store.list_stores(conn))
+        finally:
+            conn.close()
+    return _stores[1]
+
+def parse_stores(args):
+    """store 参数（逗号分隔的门店），未指定时为全部门店合并；有未知门店时抛出 ValueError"""
+    stores = tuple(sorted({x.strip() for x in args.get('store', '').split(',') if x.strip()})) or None
+    unknown = set(stores) - set(list_stores()) if stores else None
+    if unknown:
+        raise ValueError(f"未知门店: {', '.join(sorted(unknown))}")
+    return stores
+
+def load_results_json(page: str, start_date=None, end_date=None, lines=None, stores=None) -> str:
+    """
+    无查询参数时直接读取预计算的结果文件，只指定一个门店时读取该门店预计算的结果文件（没有时按需计算）；
+    否则从数据库按需计算，结果按 (页面, 参数, 数据版本) 缓存，数据更新后旧结果自然失效
+    """
+    results_file, analyze, _, _ = PAGES[page]
+    if start_date is None and end_date is None and lines is None:
+        if stores is None:
+            with open(results_file, 'r', encoding='utf-8') as f:
+                return f.read()
+        if len(stores) == 1:
+            try:
+                with open(ideapod_store.results_file(page, stores[0]), 'r', encoding='utf-8') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+
+    # 集团页面还读取外部收入文件，其修改时间同样计入缓存键
+    key = (page, start_date, end_date, lines, stores, ideapod_db.data_version(),
+           ideapod_db.data_version(ideapod_group.EXTERNAL_DATA_FILE) if page == 'group' else None)
+    text = result_cache.get(key)
+    if text is None:
+        conn = ideapod_db.get_db_connection()
+        try:
+            results = analyze(conn, start_date, end_date, lines, stores)
+        finally:
+            conn.close()
+        text = ideapod_json.dumps_results(results)
+        if 'error' not in results:
+            result_cache.put(key, text)
+    return text
+
+def render_page(page: str):
+    _, _, template, missing_message = PAGES[page]
+    try:
+        params = parse_query_params(request.args) + (parse_stores(request.args),)
+    except ValueError as e:
+        return render_template('error.html', error=f"查询参数错误: {e}")
+    try:
+        results = json.loads(load_results_json(page, *params))
+    except FileNotFoundError:
+        if ideapod_worker.is_busy():
+            missing_message = "分析结果正在后台计算中，请稍后刷新（进度见 /jobs）"
+        return render_template('error.html', error=missing_message)
+    if 'error' in results:
+        return render_template('error.html', error=results['error'])
+    return render_template(template, results=results, params=request.args)
 
 # 首页
 @app.route('/')
 def home():
     return render_template('index.html')
 
-# 餐饮分析路由 - 从 JSON 文件读取
+# 餐饮分析路由 - 默认读取预计算 JSON，带 from/to/line/store 参数时按需计算
 @app.route('/catering')
 def catering():
-    try:
-        with open('static/catering_results.json', 'r', encoding='utf-8') as f:
-            results = json.load(f)
-        if 'error' in results:
-            return render_template('error.html', error=results['error'])
-        return render_template('catering.html', results=results)
-    except FileNotFoundError:
-        return render_template('error.html', error="餐饮分析数据文件未找到，请先运行预计算脚本")
+    return render_page('catering')
 
-# 空间分析路由 - 从 JSON 文件读取
+# 空间分析路由
 @app.route('/space')
 def space():
-    try:
-        with open('static/space_results.json', 'r', encoding='utf-8') as f:
-            results = json.load(f)
-        if 'error' in results:
-            return render_template('space.html', error=results['error'])
-        return render_template('space.html', results=results)
-    except FileNotFoundError:
-        return render_template('error.html', error="空间分析数据文件未找到，请先运行预计算脚本")
+    return render_page('space')
 
-# 元数据分析路由
+# 集团分析路由
 @app.route('/group')
 def group():
+    return render_page('group')
+
+def json_response(data, status=200):
+    return Response(json.dumps(data, ensure_ascii=False), status=status, mimetype='application/json')
+
+# 门店列表，页面和接口的 store 参数取其中的值
+@app.route('/api/stores')
+def api_stores():
+    return json_response({'门店': list_stores()})
+
+# 分析结果 JSON 接口，参数与页面路由相同
+@app.route('/api/<page>')
+def api_results(page):
+    if page not in PAGES:
+        return json_response({'error': f"未知页面: {page}"}, 404)
+    try:
+        params = parse_query_params(request.args) + (parse_stores(request.args),)
+    except ValueError as e:
+        return json_response({'error': f"查询参数错误: {e}"}, 400)
     try:
-        with open('static/group_results.json', 'r', encoding='utf-8') as f:
-            results = json.load(f)
-        if 'error' in results:
-            return render_template('group.html', error=results['error'])
-        return render_template('group.html', results=results)
+        text = load_results_json(page, *params)
     except FileNotFoundError:
-        return render_template('error.html', error="集团数据文件未找到，请先运行预计算脚本")
+        return json_response({'error': PAGES[page][3]}, 404)
+    return Response(text, mimetype='application/json')
+
+def parse_pods(args):
+    """pod 参数（逗号分隔的订单商品名），未指定时为全部空间"""
+    return [x.strip() for x in args.get('pod', '').split(',') if x.strip()] or None
+
+# 空间空闲查询：from / to 为时间（如 2025-03-01 14:00），pod、store 可选
+@app.route('/api/availability')
+def api_availability():
+    try:
+        start, end = pd.Timestamp(request.args['from']), pd.Timestamp(request.args['to'])
+    except (KeyError, ValueError) as e:
+        return json_response({'error': f"查询参数错误: 需要有效的 from 和 to 时间 ({e})"}, 400)
+    if start >= end:
+        return json_response({'error': "查询参数错误: 开始时间必须早于结束时间"}, 400)
+    try:
+        stores = parse_stores(request.args)
+    except ValueError as e:
+        return json_response({'error': f"查询参数错误: {e}"}, 400)
+    return json_response({
+        'from': str(start),
+        'to': str(end),
+        '各空间': ideapod_availability.availability(start, end, parse_pods(request.args), stores)
+    })
+
+# 实时占用查询：at 为时间，默认当前时间；pod、store 可选
+@app.route('/api/occupancy')
+def api_occupancy():
+    try:
+        moment = pd.Timestamp(request.args['at']) if request.args.get('at') else pd.Timestamp.now().floor('s')
+        stores = parse_stores(request.args)
+    except ValueError as e:
+        return json_response({'error': f"查询参数错误: {e}"}, 400)
+    return json_response(ideapod_availability.occupancy(moment, parse_pods(request.args), stores))
+
+# 去重活跃客户数：from / to / line 与页面参数相同，freq 为汇总周期（W-MON、M、Q 等，默认整个范围），
+# level 为逗号分隔的会员等级，by_level=1 时按等级分列；由每日草图合并估计，返回标准误差
+@app.route('/api/distinct')
+def api_distinct():
+    try:
+        start_date, end_date, lines = parse_query_params(request.args)
+        if lines and not set(lines) <= set(ideapod_hll.LINES):
+            raise ValueError(f"未知业务线: {', '.join(sorted(set(lines) - set(ideapod_hll.LINES)))}")
+        levels = [x.strip() for x in request.args.get('level', '').split(',') if x.strip()] or None
+        conn = ideapod_db.get_db_connection()
+        try:
+            sketches = ideapod_hll.read_sketches(conn, start_date, end_date, lines, levels)
+        finally:
+            conn.close()
+        counts = ideapod_hll.distinct_counts(sketches, request.args.get('freq') or None, request.args.get('by_level') == '1')
+    except ValueError as e:
+        return json_response({'error': f"查询参数错误: {e}"}, 400)
+    except RuntimeError as e:
+        # 草图表只在导入 / 更新时建立，不存在或过期时提示重建
+        return json_response({'error': str(e)}, 503)
+    return json_response({
+        '相对标准误差(%)': ideapod_hll.RELATIVE_ERROR * 100,
+        '结果': counts.to_dict(orient='records')
+    })
+
+# 后台重算任务状态
+@app.route('/jobs', methods=['GET'])
+def jobs_status():
+    return json_response(ideapod_worker.status())
+
+# 手动提交重算任务：modules=space,catering,group（默认全部），update=1 时先导入增量文件
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    values = request.values.get('modules', '')
+    modules = [m.strip() for m in values.split(',') if m.strip()] or list(ideapod_worker.ANALYSES)
+    unknown = [m for m in modules if m not in ideapod_worker.ANALYSES]
+    if unknown:
+        return json_response({'error': f"未知分析模块: {', '.join(unknown)}"}, 400)
+    update_files = list(ideapod_worker.WATCHED_FILES) if request.values.get('update') == '1' else []
+    job = ideapod_worker.submit(modules, update_files=update_files, reason='手动提交')
+    return json_response(job, 202)
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = ideapod_worker.get_job(job_id)
+    if job is None:
+        return json_response({'error': f"任务 {job_id} 不存在"}, 404)
+    return json_response(job)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
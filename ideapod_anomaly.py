@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+# 逐期检测的状态：各账本已检测各期的摘要和已发现的异常，新增的期只需与之前的同期基准比较
+STATE_FILE = 'db/anomaly_state.json'
+
+# 检测参数：每期与之前同一季节位置（相隔 season 期）的最近 window 期比较，
+# 稳健 z 分数绝对值超过 threshold 记为异常，基准不足 min_history 期时不检测
+LEDGER_PARAMS = {
+    'daily': {'freq': 'D', 'season': 7, 'window': 8, 'threshold': 3.5, 'min_history': 4},
+    'weekly': {'freq': '7D', 'season': 1, 'window': 12, 'threshold': 3.5, 'min_history': 6}
+}
+WEEKDAY_NAMES = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+ANOMALY_COLUMNS = ['日期', '星期', '指标', '实际值', '基准中位数', '稳健z分数', '类型']
+
+def robust_scores(values: np.ndarray, history: np.ndarray, params: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    values: (n, m) 待检测的 n 期、m 个指标；history: (h, m) 之前连续的各期，缺失的期为 NaN
+    基准为之前同一季节位置的最近 window 期（跳过缺失），z = 0.6745 * (x - 中位数) / MAD，
+    MAD 为 0 时改用平均绝对偏差 * 1.2533；基准全部相同时与之不同即为无穷大
+    返回 (z 分数, 基准中位数)，基准不足时为 NaN
+    """
+    season, window = params['season'], params['window']
+    full = np.vstack([history, values]).astype(float)
+    h = len(history)
+    lags = h + np.arange(len(values))[:, None] - season * np.arange(1, window + 1)[None, :]
+    base = full[np.maximum(lags, 0)]
+    base[lags < 0] = np.nan
+
+    enough = (~np.isnan(base)).sum(axis=1) >= params['min_history']
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        # 全部为 NaN 的基准会触发 All-NaN slice 警告，这些位置随后置为 NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(base, axis=1)
+        deviation = np.abs(base - median[:, None, :])
+        scale = np.nanmedian(deviation, axis=1) / 0.6745
+        scale = np.where(scale > 0, scale, np.nanmean(deviation, axis=1) * 1.2533)
+        z = (values - median) / scale
+        z = np.where(scale > 0, z, np.where(values == median, 0.0, np.sign(values - median) * np.inf))
+    z[~enough] = np.nan
+    median[~enough] = np.nan
+    return z, median
+
+def _calendar(ledger: pd.DataFrame, date_col: str, freq: str) -> pd.DataFrame:
+    """按日期补齐为连续的各期，账本中没有的期各指标为 NaN"""
+    ledger = ledger.assign(**{date_col: pd.to_datetime(ledger[date_col])}).set_index(date_col).sort_index()
+    if ledger.empty:
+        return ledger
+    return ledger.reindex(pd.date_range(ledger.index.min(), ledger.index.max(), freq=freq))
+
+def _flags(scores: np.ndarray, medians: np.ndarray, values: pd.DataFrame, threshold: float) -> pd.DataFrame:
+    """超过阈值的 (期, 指标) 和整期缺失的期"""
+    missing_rows = values.isna().all(axis=1).to_numpy()
+    row, col = np.nonzero(np.abs(np.nan_to_num(scores, nan=0.0)) > threshold)
+    keep = ~missing_rows[row]
+    row, col = row[keep], col[keep]
+    dates = values.index
+    flagged = pd.DataFrame({
+        '日期': dates[row],
+        '指标': values.columns[col],
+        '实际值': values.to_numpy()[row, col],
+        '基准中位数': medians[row, col],
+        '稳健z分数': scores[row, col],
+        '类型': np.where(scores[row, col] > 0, '偏高', '偏低')
+    })
+    missing = pd.DataFrame({'日期': dates[missing_rows], '指标': '全部', '类型': '缺失'})
+    flagged = pd.concat([flagged, missing], ignore_index=True) if len(missing) else flagged
+    flagged = flagged.sort_values(['日期', '指标'], kind='stable').reset_index(drop=True)
+    flagged.insert(1, '星期', [WEEKDAY_NAMES[day] for day in pd.DatetimeIndex(flagged['日期']).dayofweek])
+    flagged['日期'] = pd.DatetimeIndex(flagged['日期']).strftime('%Y-%m-%d')
+    return flagged[ANOMALY_COLUMNS]
+
+def _digest(values: pd.DataFrame) -> str:
+    """账本各期数值的摘要，用于判断上次检测过的各期是否被补录或修改"""
+    hashed = pd.util.hash_pandas_object(values.reset_index(), index=False).to_numpy()
+    return format(int(np.bitwise_xor.reduce(hashed * np.arange(1, len(hashed) + 1, dtype=np.uint64), initial=0)), 'x')
+
+def complete_periods(values: pd.DataFrame, freq: str, as_of: pd.Timestamp = None) -> pd.DataFrame:
+    """
+    只保留已结束的各期：数据截止时间 as_of（最晚的下单时间）所在的一天尚未结束，
+    结束晚于这天开始的期（当天、当周）数据不完整，as_of 为 None 时不截取
+    """
+    if as_of is None or pd.isna(as_of):
+        return values
+    ends = values.index + pd.tseries.frequencies.to_offset(freq)
+    return values[ends <= pd.Timestamp(as_of).normalize()]
+
+def detect(ledger: pd.DataFrame, date_col: str, params: Dict, state: Dict = None,
+           as_of: pd.Timestamp = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    检测账本（每期一行、各列为收入指标）中的异常，返回 (全部异常, 新状态)
+    state 为上次检测后的状态：参数、指标相同且已检测的各期未被修改时只检测新增的期，
+    之前的异常直接沿用（结果与从头检测相同）；否则从头检测
+    as_of: 数据截止时间，尚未结束的最后一期不检测、不计入状态，下次结束后作为新增的期检测
+    """
+    values = _calendar(ledger, date_col, params['freq'])
+    values = complete_periods(values.select_dtypes('number'), params['freq'], as_of)
+    lookback = params['season'] * params['window']
+    incremental = (state and state.get('last_date') and state.get('params') == params and state.get('columns') == list(values.columns)
+                   and _digest(values[values.index <= state['last_date']]) == state['digest'])
+    if incremental:
+        new_values = values[values.index > state['last_date']]
+        history = values[values.index <= state['last_date']].iloc[-lookback:]
+        previous = pd.DataFrame(state['flags'], columns=ANOMALY_COLUMNS)
+    else:
+        new_values, history, previous = values, values.iloc[:0], pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+    scores, medians = robust_scores(new_values.to_numpy(dtype=float), history.to_numpy(dtype=float), params)
+    flags = _flags(scores, medians, new_values, params['threshold'])
+    flags = pd.concat([previous, flags], ignore_index=True) if len(previous) else flags
+
+    new_state = {
+        'params': params,
+        'columns': list(values.columns),
+        'last_date': values.index.max().strftime('%Y-%m-%d') if len(values) else None,
+        'digest': _digest(values),
+        'flags': flags.astype(object).where(flags.notna(), None).values.tolist(),
+        'scored': int(len(new_values))
+    }
+    return flags, new_state
+
+def load_state(path: str = STATE_FILE) -> Dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_state(state: Dict, path: str = STATE_FILE) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def detect_ledgers(ledgers: Dict[str, Tuple[pd.DataFrame, str]], state_file: str = STATE_FILE,
+                   as_of: pd.Timestamp = None) -> Dict[str, pd.DataFrame]:
+    """
+    ledgers: 账本名（LEDGER_PARAMS 中的键） -> (账本, 日期列)
+    state_file 为 None 时不读写状态（例如按日期范围临时计算）
+    as_of: 数据截止时间，各账本只检测已结束的期
+    """
+    states = load_state(state_file) if state_file else {}
+    results = {}
+    for name, (ledger, date_col) in ledgers.items():
+        results[name], states[name] = detect(ledger, date_col, LEDGER_PARAMS[name], states.get(name), as_of)
+        logging.info(f"[Anomaly] {name} 检测 {states[name]['scored']} 期，共 {len(results[name])} 条异常")
+    if state_file:
+        save_state(states, state_file)
+    return results
@@ -0,0 +1,142 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+import ideapod_db
+
+class PodIndex:
+    """
+    单个门店中单个空间（订单商品名）的预订区间索引，全部为排序后的数组，每次查询为几次二分查找：
+    starts / ends 分别排序，用于统计与某段时间重叠的预订数；
+    busy_starts / busy_ends 为合并重叠预订后的占用区间，busy_total 为其累计时长（秒），用于求占用时长
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray):
+        self.starts = np.sort(starts)
+        self.ends = np.sort(ends)
+        # 按开始时间排序后，开始时间晚于之前最晚结束时间的预订开启新的占用区间
+        order = np.argsort(starts, kind='stable')
+        starts, ends = starts[order], ends[order]
+        cover_end = np.maximum.accumulate(ends) if len(ends) else ends
+        new_block = np.ones(len(starts), dtype=bool)
+        new_block[1:] = starts[1:] > cover_end[:-1]
+        self.busy_starts = starts[new_block]
+        self.busy_ends = np.maximum.reduceat(ends, np.flatnonzero(new_block)) if len(ends) else ends
+        durations = (self.busy_ends - self.busy_starts).astype(np.int64)
+        self.busy_total = np.concatenate([[0], np.cumsum(durations)])
+
+    def overlapping(self, start: np.int64, end: np.int64) -> int:
+        """与 [start, end) 重叠的预订数：开始早于 end 的预订减去在 start 之前（含）已结束的预订"""
+        return int(np.searchsorted(self.starts, end, 'left') - np.searchsorted(self.ends, start, 'right'))
+
+    def active(self, moment: np.int64) -> int:
+        """moment 时刻正在使用的预订数"""
+        return int(np.searchsorted(self.starts, moment, 'right') - np.searchsorted(self.ends, moment, 'right'))
+
+    def busy_seconds(self, start: np.int64, end: np.int64) -> int:
+        """[start, end) 内被占用的秒数：完整包含的占用区间用累计时长，两端的区间单独截取"""
+        first = np.searchsorted(self.busy_ends, start, 'right')
+        last = np.searchsorted(self.busy_starts, end, 'left')
+        if first >= last:
+            return 0
+        total = self.busy_total[last] - self.busy_total[first]
+        total -= max(start - self.busy_starts[first], 0)
+        total -= max(self.busy_ends[last - 1] - end, 0)
+        return int(total)
+
+    def next_free(self, moment: np.int64) -> np.int64:
+        """moment 之后（含）第一个空闲时刻"""
+        i = np.searchsorted(self.busy_ends, moment, 'right')
+        if i < len(self.busy_starts) and self.busy_starts[i] <= moment:
+            return self.busy_ends[i]
+        return moment
+
+def _seconds(values) -> np.ndarray:
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+def build_index(space_df: pd.DataFrame) -> Dict[Tuple[str, str], PodIndex]:
+    """由已支付的预订建立各门店各空间的索引，键为 (门店, 订单商品名)；没有开始或结束时间的预订不计入"""
+    bookings = space_df[space_df['支付时间'].notna()].dropna(
+        subset=[ideapod_db.STORE_COLUMN, '订单商品名', '预定开始时间', '预定结束时间'])
+    starts, ends = _seconds(bookings['预定开始时间']), _seconds(bookings['预定结束时间'])
+    valid = ends > starts
+    keys = pd.MultiIndex.from_arrays([bookings[ideapod_db.STORE_COLUMN].to_numpy()[valid],
+                                      bookings['订单商品名'].to_numpy()[valid]])
+    starts, ends = starts[valid], ends[valid]
+    codes, names = keys.factorize(sort=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+    return {
+        name: PodIndex(starts[order[bounds[i]:bounds[i + 1]]], ends[order[bounds[i]:bounds[i + 1]]])
+        for i, name in enumerate(names)
+    }
+
+# 当前的 (数据版本, 索引)：查询时数据库已更新则重建，整体替换，重建期间其他查询继续使用旧索引
+_index = (None, {})
+_lock = threading.Lock()
+
+def get_index() -> Dict[Tuple[str, str], PodIndex]:
+    global _index
+    version = ideapod_db.data_version()
+    current_version, pods = _index
+    if current_version == version:
+        return pods
+    with _lock:
+        if _index[0] != version:
+            conn = ideapod_db.get_db_connection()
+            try:
+                space_df = pd.read_sql_query(
+                    f'SELECT "{ideapod_db.STORE_COLUMN}", "订单商品名", "预定开始时间", "预定结束时间", "支付时间" FROM Space', conn)
+            finally:
+                conn.close()
+            _index = (version, build_index(space_df))
+            logging.info(f"[Availability] 已建立 {len(_index[1])} 个空间的预订索引")
+        return _index[1]
+
+def _format(seconds: np.int64) -> str:
+    return str(np.datetime64(int(seconds), 's')).replace('T', ' ')
+
+def _select(index: Dict[Tuple[str, str], PodIndex], pods: List[str] = None,
+            stores: List[str] = None) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """所选门店中所选空间的索引键（未指定时为全部），以及在所选门店中都不存在的空间"""
+    keys = [key for key in index if (not stores or key[0] in stores) and (not pods or key[1] in pods)]
+    found = {pod for _, pod in keys}
+    return keys, [pod for pod in pods or () if pod not in found]
+
+def availability(start: pd.Timestamp, end: pd.Timestamp, pods: List[str] = None, stores: List[str] = None) -> List[dict]:
+    """[start, end) 内各门店各空间是否空闲、重叠的预订数、占用时长和占用率"""
+    index = get_index()
+    start_s, end_s = _seconds([start])[0], _seconds([end])[0]
+    length = max(end_s - start_s, 1)
+    keys, unknown = _select(index, pods, stores)
+    results = []
+    for store, pod in keys:
+        pod_index = index[store, pod]
+        busy = pod_index.busy_seconds(start_s, end_s)
+        overlapping = pod_index.overlapping(start_s, end_s)
+        results.append({
+            ideapod_db.STORE_COLUMN: store,
+            '订单商品名': pod,
+            '空闲': overlapping == 0,
+            '重叠预订数': overlapping,
+            '占用分钟': busy / 60,
+            '占用率(%)': busy / length * 100,
+            '最早空闲时间': _format(pod_index.next_free(start_s))
+        })
+    results.extend({'订单商品名': pod, 'error': '未知空间'} for pod in unknown)
+    return results
+
+def occupancy(moment: pd.Timestamp, pods: List[str] = None, stores: List[str] = None) -> dict:
+    """moment 时刻各门店各空间正在使用的预订数，以及被占用的空间数"""
+    index = get_index()
+    moment_s = _seconds([moment])[0]
+    keys, _ = _select(index, pods, stores)
+    active = {key: index[key].active(moment_s) for key in keys}
+    return {
+        '时间': _format(moment_s),
+        '空间数': len(active),
+        '占用空间数': sum(count > 0 for count in active.values()),
+        '各空间': [{ideapod_db.STORE_COLUMN: store, '订单商品名': pod, '使用中预订数': count}
+                 for (store, pod), count in active.items()]
+    }
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+# 购物篮分析参数：每月参与组合的热销商品数（按订单数），每月输出的组合数，组合至少出现的订单数
+BASKET_PARAMS = {'top_items': 20, 'top_rules': 10, 'min_orders': 3}
+
+PAIR_COLUMNS = ['订单月', '商品A', '商品B', '共同订单数', '支持度(%)', '置信度A→B(%)', '置信度B→A(%)', '提升度']
+TRIPLE_COLUMNS = ['订单月', '商品组合', '共同订单数', '支持度(%)', '最强规则', '置信度(%)', '提升度']
+
+def incidence(order_codes: np.ndarray, item_codes: np.ndarray, n_orders: int, n_items: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    订单 × 商品的稀疏关联矩阵（CSR）：indices[indptr[i]:indptr[i + 1]] 为第 i 个订单包含的商品编号，
+    升序且不重复（同一商品出现在多行时只计一次）
+    """
+    keys = np.unique(order_codes.astype(np.int64) * n_items + item_codes)
+    rows, indices = np.divmod(keys, n_items)
+    indptr = np.zeros(n_orders + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_orders), out=indptr[1:])
+    return indptr, indices
+
+def _expand(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """第 i 个元素展开 counts[i] 次，返回 (元素下标, 1..counts[i] 的序号)"""
+    source = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    return source, offsets
+
+def combinations(indptr: np.ndarray, size: int) -> Tuple[np.ndarray, ...]:
+    """
+    每个订单内全部 size 件商品的组合在 indices 中的位置（每个位置数组一项，同一组合内位置递增）
+    逐层展开：在已有组合最后一个位置之后、同一订单之内追加一个位置
+    """
+    row_end = np.repeat(indptr[1:], np.diff(indptr))
+    positions = (np.arange(indptr[-1]),)
+    for _ in range(size - 1):
+        last = positions[-1]
+        source, offsets = _expand(row_end[last] - last - 1)
+        positions = tuple(p[source] for p in positions) + (last[source] + offsets,)
+    return positions
+
+def basket_rules(orders: pd.Series, items: pd.Series, months: pd.Series,
+                 params: Dict = BASKET_PARAMS) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    按月统计商品两两搭配和三件组合的支持度、置信度和提升度
+    orders / items / months: 每个订单明细行的订单号、商品、订单月
+    只统计每月订单数前 top_items 的商品；支持度以当月全部订单数为分母
+    每月按提升度（相同时按共同订单数）取前 top_rules 个至少出现 min_orders 次的组合
+    """
+    valid = (orders.notna() & items.notna() & months.notna()).to_numpy()
+    order_codes, _ = pd.factorize(orders[valid])
+    item_codes, item_names = pd.factorize(items[valid])
+    month_codes, month_names = pd.factorize(months[valid], sort=True)
+    n_orders, n_items, n_months = order_codes.max(initial=-1) + 1, len(item_names), len(month_names)
+    if n_orders == 0:
+        return pd.DataFrame(columns=PAIR_COLUMNS), pd.DataFrame(columns=TRIPLE_COLUMNS)
+
+    order_month = np.zeros(n_orders, dtype=np.int64)
+    order_month[order_codes] = month_codes
+    month_orders = np.bincount(order_month, minlength=n_months)
+
+    # 每月包含各商品的订单数，只保留当月的热销商品
+    indptr, indices = incidence(order_codes, item_codes, n_orders, n_items)
+    rows = np.repeat(np.arange(n_orders), np.diff(indptr))
+    item_orders = np.bincount(order_month[rows] * n_items + indices, minlength=n_months * n_items).reshape(n_months, n_items)
+    top = np.argsort(-item_orders, axis=1, kind='stable')[:, :params['top_items']]
+    is_top = np.zeros_like(item_orders, dtype=bool)
+    np.put_along_axis(is_top, top, np.take_along_axis(item_orders, top, axis=1) > 0, axis=1)
+    keep = is_top[order_month[rows], indices]
+    indptr, indices = incidence(rows[keep], indices[keep], n_orders, n_items)
+    rows = np.repeat(np.arange(n_orders), np.diff(indptr))
+
+    def count(size):
+        """各月每个组合的订单数：组合编码为 (月份, 商品...) 的混合进制数"""
+        positions = combinations(indptr, size)
+        keys = order_month[rows[positions[0]]]
+        for p in positions:
+            keys = keys * n_items + indices[p]
+        keys, counts = np.unique(keys, return_counts=True)
+        parts = []
+        for _ in range(size):
+            keys, code = np.divmod(keys, n_items)
+            parts.insert(0, code)
+        return keys, parts, counts
+
+    def top_rules(frame: pd.DataFrame) -> pd.DataFrame:
+        frame = frame[frame['共同订单数'] >= params['min_orders']]
+        frame = frame.sort_values(['订单月', '提升度', '共同订单数'], ascending=[True, False, False], kind='stable')
+        frame = frame.groupby('订单月').head(params['top_rules']).reset_index(drop=True)
+        frame['订单月'] = frame['订单月'].astype(str)
+        return frame
+
+    names = np.asarray(item_names, dtype=object)
+    total = month_orders.astype(float)
+
+    # 两两搭配
+    month, (a, b), pair_counts = count(2)
+    pair_keys = (month * n_items + a) * n_items + b
+    n_a, n_b = item_orders[month, a], item_orders[month, b]
+    pairs = pd.DataFrame({
+        '订单月': month_names[month],
+        '商品A': names[a],
+        '商品B': names[b],
+        '共同订单数': pair_counts,
+        '支持度(%)': pair_counts / total[month] * 100,
+        '置信度A→B(%)': pair_counts / n_a * 100,
+        '置信度B→A(%)': pair_counts / n_b * 100,
+        '提升度': pair_counts * total[month] / (n_a * n_b)
+    }, columns=PAIR_COLUMNS)
+
+    # 三件组合：最强规则取三种 "两件 → 一件" 中置信度最高的
+    month, (a, b, c), triple_counts = count(3)
+    sub_pairs = [(a, b, c), (a, c, b), (b, c, a)]
+    confidence = np.column_stack([
+        triple_counts / pair_counts[np.searchsorted(pair_keys, (month * n_items + x) * n_items + y)]
+        for x, y, _ in sub_pairs
+    ])
+    best = np.argmax(confidence, axis=1)
+    antecedent = np.array([names[x] + '+' + names[y] for x, y, _ in sub_pairs], dtype=object)
+    consequent = np.array([names[z] for _, _, z in sub_pairs], dtype=object)
+    position = np.arange(len(best))
+    triples = pd.DataFrame({
+        '订单月': month_names[month],
+        '商品组合': names[a] + '+' + names[b] + '+' + names[c],
+        '共同订单数': triple_counts,
+        '支持度(%)': triple_counts / total[month] * 100,
+        '最强规则': antecedent[best, position] + ' → ' + consequent[best, position],
+        '置信度(%)': confidence[position, best] * 100,
+        '提升度': triple_counts * total[month] ** 2 / (item_orders[month, a] * item_orders[month, b] * item_orders[month, c])
+    }, columns=TRIPLE_COLUMNS)
+
+    return top_rules(pairs), top_rules(triples)
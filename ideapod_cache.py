@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from typing import Any, Dict, Iterable
+import ideapod_db
+
+CACHE_DIR = 'db/cache'
+# 缓存总大小上限与最长未使用时间，超出后按最久未使用的顺序删除
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_MAX_AGE = 30 * 24 * 3600  # 秒
+
+def make_key(parts: Dict[str, Any]) -> str:
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f'{key}.pkl')
+
+def get(key: str, cache_dir: str = CACHE_DIR):
+    """读取缓存，不存在、已过期或无法读取时返回 None"""
+    path = _path(key, cache_dir)
+    try:
+        if time.time() - os.stat(path).st_mtime > CACHE_MAX_AGE:
+            os.remove(path)
+            return None
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"[Cache] 缓存文件 {path} 无法读取，已删除: {e}")
+        os.remove(path)
+        return None
+    # 修改时间即最近使用时间，供淘汰时参考
+    os.utime(path)
+    return value
+
+def put(key: str, value: Any, cache_dir: str = CACHE_DIR) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _path(key, cache_dir)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    evict(cache_dir)
+
+def evict(cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES, max_age: int = CACHE_MAX_AGE) -> int:
+    """删除过期的缓存，再按最久未使用的顺序删除到总大小不超过上限，返回删除的文件数"""
+    try:
+        names = [name for name in os.listdir(cache_dir) if name.endswith('.pkl')]
+    except FileNotFoundError:
+        return 0
+    entries = []
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+def clear(cache_dir: str = CACHE_DIR) -> int:
+    return evict(cache_dir, max_bytes=0)
+
+def table_fingerprints(tables: Iterable[str]) -> Dict[str, str]:
+    """各表的内容哈希，与派生表检查共用 ideapod_db 中按数据版本保存的记录"""
+    conn = ideapod_db.get_db_connection()
+    try:
+        return ideapod_db.table_fingerprints(conn, tables)
+    finally:
+        conn.close()
@@ -3,7 +3,13 @@ import pandas as pd
 import numpy as np
 import logging
 from typing import Dict, Any
-from datetime import timedelta
+import ideapod_basket
+import ideapod_customer
+import ideapod_db
+import ideapod_kpi
+import ideapod_promotion
+import ideapod_rfm
+import ideapod_topn
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,6 +19,17 @@ logging.basicConfig(
     ]
 )
 
+# 用户价值（RFM）模型参数：统计天数，最近消费指数的衰减系数 λ（60天下降到50分），消费力权重（餐饮用户单价较低，频次更重要）
+RFM_PARAMS = {'days': 180, 'lambda': 0.0115, 'weight_monetary': 0.4}
+# 热销排行的项数
+TOP_N = 10
+UNCLASSIFIED_PRODUCT = '未分类'
+# Product 表中没有的商品名写入该文件，处理后重新运行
+NEW_PRODUCTS_FILE = 'db/ideapod_product_new.csv'
+# 财务分析中计算滚动环比的周数和指标（名称: 周度财务表的列）
+TRAILING_WEEKS = 4
+TRAILING_METRICS = {'销售收入': '销售收入', '订单量': '订单量'}
+
 def connect_to_db(db_path: str) -> sqlite3.Connection:
     """Efficiently connect to SQLite database"""
     return sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
@@ -29,73 +46,69 @@ def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
                     logging.error(f"[Catering] 转换 {col} 列时出错：{e}")
     return df
 
+# 财务分析的部分聚合合并规则：同一 (日期, 小时) 的金额和计数相加
+FINANCE_MERGE = {'hourly': {'销售金额': 'sum', '订单数量': 'sum', '实收笔数': 'sum'}}
+
+def finance_partial(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """按 (日期, 小时) 汇总一次，周度、周内、日内的指标都从这张表派生"""
+    order_time = catering_df['下单时间']
+    hourly = catering_df.groupby([order_time.dt.normalize().rename('日期'), order_time.dt.hour.rename('订单时刻')]).agg(
+        销售金额=('实收', 'sum'),
+        订单数量=('订单号', 'count'),
+        实收笔数=('实收', 'count')
+    )
+    return {'hourly': hourly}
+
 def analyze_finance(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     """
     财务分析：包括周度实收金额、周内销售金额/订单、时间段销售金额/订单
     """
-    
-    # 添加时间维度
-    catering_df['星期'] = catering_df['下单时间'].dt.day_name()  # 英文星期
-    catering_df['订单时刻'] = catering_df['下单时间'].dt.hour
+    return finance_tables(finance_partial(catering_df))
+
+def finance_tables(partial: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """由（合并后的）(日期, 小时) 汇总表生成财务分析的各表"""
+    hourly = partial['hourly']
+    hour_dates = hourly.index.get_level_values('日期')
 
     # 周度收入分析
-    weekly_revenue_df = catering_df.groupby('订单周').agg(
-        销售收入=('实收', 'sum'),
-        订单量=('订单号', 'count'),
-        订单单价=('实收', 'mean')
-    ).reset_index()
-    weekly_revenue_df['订单周'] = weekly_revenue_df['订单周'].astype(str)
+    weekly_revenue_df = hourly.groupby(hour_dates.to_period('W-MON').start_time.date).sum()
+    weekly_revenue_df = pd.DataFrame({
+        '订单周': weekly_revenue_df.index.astype(str),
+        '销售收入': weekly_revenue_df['销售金额'].to_numpy(),
+        '订单量': weekly_revenue_df['订单数量'].to_numpy(),
+        '订单单价': (weekly_revenue_df['销售金额'] / weekly_revenue_df['实收笔数']).to_numpy()
+    })
 
-    # 定义星期顺序（英文转中文）
-    weekday_order_en = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    # 周内分布：先按天汇总，再按 (月份, 星期) 取日均值
+    daily = hourly.groupby(level='日期')[['销售金额', '订单数量']].sum()
     weekday_order_cn = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-
-    # 周内收入分布
-    weekday_sales = catering_df.groupby(['订单月', '星期', catering_df['下单时间'].dt.date]).agg(
-        日销售金额=('实收', 'sum')  # 先按天汇总
-    ).reset_index().groupby(['订单月', '星期']).agg(
-        日均销售金额=('日销售金额', 'mean')  # 再取日均值
-    ).unstack(fill_value=0)
-    weekday_sales.columns = [weekday_order_cn[weekday_order_en.index(col[1])] for col in weekday_sales.columns]  # 转换为中文
-    weekday_sales = weekday_sales.reindex(columns=weekday_order_cn, fill_value=0).reset_index()
-    weekday_sales['订单月'] = weekday_sales['订单月'].astype(str)
-
-    # 周内单量分布
-    weekday_orders = catering_df.groupby(['订单月', '星期', catering_df['下单时间'].dt.date]).agg(
-        日订单数量=('订单号', 'count')  # 先按天计数
-    ).reset_index().groupby(['订单月', '星期']).agg(
-        日均订单数量=('日订单数量', 'mean')  # 再取日均值
-    ).unstack(fill_value=0)
-    weekday_orders.columns = [weekday_order_cn[weekday_order_en.index(col[1])] for col in weekday_orders.columns]  # 转换为中文
-    weekday_orders = weekday_orders.reindex(columns=weekday_order_cn, fill_value=0).reset_index()
-    weekday_orders['订单月'] = weekday_orders['订单月'].astype(str)
-
-    # 日内收入分布
-    hourly_sales = catering_df.groupby(['订单月', '订单时刻', catering_df['下单时间'].dt.date]).agg(
-        日销售金额=('实收', 'sum')  # 先按天汇总
-    ).reset_index().groupby(['订单月', '订单时刻']).agg(
-        日均销售金额=('日销售金额', 'mean')  # 再取日均值
-    ).unstack(fill_value=0)
-    hourly_sales.columns = [f'{int(col[1])}时' for col in hourly_sales.columns]
-    hourly_sales = hourly_sales.reset_index()
-    hourly_sales['订单月'] = hourly_sales['订单月'].astype(str)
-
-    # 日内单量分布
-    hourly_orders = catering_df.groupby(['订单月', '订单时刻', catering_df['下单时间'].dt.date]).agg(
-        日订单数量=('订单号', 'count')  # 先按天计数
-    ).reset_index().groupby(['订单月', '订单时刻']).agg(
-        日均订单数量=('日订单数量', 'mean')  # 再取日均值
-    ).unstack(fill_value=0)
-    hourly_orders.columns = [f'{int(col[1])}时' for col in hourly_orders.columns]
-    hourly_orders = hourly_orders.reset_index()
-    hourly_orders['订单月'] = hourly_orders['订单月'].astype(str)
+    weekday_means = daily.groupby([daily.index.to_period('M').rename('订单月'), daily.index.dayofweek]).mean()
+
+    # 日内分布：(日期, 小时) 汇总即每天各时段的金额和单量，按 (月份, 小时) 取日均值
+    hourly_means = hourly[['销售金额', '订单数量']].groupby([hour_dates.to_period('M').rename('订单月'),
+                                                     hourly.index.get_level_values('订单时刻')]).mean()
+
+    def weekday_table(column: str) -> pd.DataFrame:
+        table = weekday_means[column].unstack(fill_value=0)
+        table.columns = [weekday_order_cn[day] for day in table.columns]
+        table = table.reindex(columns=weekday_order_cn, fill_value=0).reset_index()
+        table['订单月'] = table['订单月'].astype(str)
+        return table
+
+    def hourly_table(column: str) -> pd.DataFrame:
+        table = hourly_means[column].unstack(fill_value=0)
+        table.columns = [f'{int(hour)}时' for hour in table.columns]
+        table = table.reset_index()
+        table['订单月'] = table['订单月'].astype(str)
+        return table
 
     return {
         '财务分析_bar': weekly_revenue_df,
-        '周内收入分布_stacked': weekday_sales,
-        '周内单量分布_stacked': weekday_orders,
-        '日内收入分布_stacked': hourly_sales,
-        '日内单量分布_stacked': hourly_orders
+        '过去四周环比(%)_line': ideapod_kpi.trailing_change_table(weekly_revenue_df, '订单周', TRAILING_METRICS, TRAILING_WEEKS),
+        '周内收入分布_stacked': weekday_table('销售金额'),
+        '周内单量分布_stacked': weekday_table('订单数量'),
+        '日内收入分布_stacked': hourly_table('销售金额'),
+        '日内单量分布_stacked': hourly_table('订单数量')
     }
 
 def analyze_order(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
@@ -132,31 +145,37 @@ def analyze_order(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
         '订单单价_服务方式_bar': source_price
     }
 
-def analyze_product(catering_df: pd.DataFrame, conn) -> dict:
+def parse_order_items(catering_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    将商品字符串（'商品名x数量,商品名x数量'）拆成逐商品明细：订单号、product、quantity、订单日期
+    不是'名称x数量'格式的项忽略；有数量无法解析的订单整单跳过
+    """
+    items = catering_df.loc[catering_df['商品'].notna(), ['订单号', '商品', '下单时间']]
+    items = items.rename(columns={'下单时间': '订单日期'}).reset_index(drop=True)
+    items = items.assign(item=items['商品'].str.split(',')).explode('item')
+    items = items[items['item'].str.count('x') == 1]
+    if items.empty:
+        # 没有可解析的商品时 split(expand=True) 不产生任何列
+        return pd.DataFrame({'订单号': pd.Series(dtype=object), 'product': pd.Series(dtype=object),
+                             'quantity': pd.Series(dtype=float), '订单日期': items['订单日期']}).reset_index(drop=True)
+
+    parts = items['item'].str.split('x', expand=True)
+    items['product'] = parts[0].str.strip()
+    items['quantity'] = pd.to_numeric(parts[1].str.strip(), errors='coerce').astype(float)
+
+    invalid_orders = items.index[items['quantity'].isna()].unique()
+    if len(invalid_orders) > 0:
+        print(f"解析商品字符串时出错: {len(invalid_orders)} 个订单的商品数量无法解析，已跳过")
+        items = items[~items.index.isin(invalid_orders)]
+    return items[['订单号', 'product', 'quantity', '订单日期']].reset_index(drop=True)
+
+def analyze_product(catering_df: pd.DataFrame, product_df: pd.DataFrame) -> dict:
     """
     商品分析：产品周度销售分析，筛选前20个产品类型，按周输出销售数量
+    product_df: Product 表（商品名与产品类型的对应关系）
     """
-    product_df = pd.read_sql_query("SELECT * FROM Product", conn)
-
-    def parse_products(product_str, order_date):
-        try:
-            products = product_str.split(',')
-            parsed_products = []
-            for p in products:
-                parts = p.split('x')
-                if len(parts) == 2:
-                    product_name = parts[0].strip()
-                    quantity = float(parts[1].strip())
-                    parsed_products.append({'product': product_name, 'quantity': quantity, '订单日期': order_date})
-            return pd.DataFrame(parsed_products)
-        except Exception as e:
-            print(f"解析商品字符串时出错: {e}")
-            return pd.DataFrame()
-
     # 解析商品并合并产品类型信息
-    
-    product_analysis = catering_df[['商品', '下单时间']].apply(lambda x: parse_products(x['商品'], x['下单时间']), axis=1)
-    product_sales = pd.concat(product_analysis.tolist(), ignore_index=True)
+    product_sales = parse_order_items(catering_df)[['product', 'quantity', '订单日期']]
     product_sales = pd.merge(product_sales, product_df[['商品名', '产品类型']], 
                             left_on='product', right_on='商品名', how='left')
     
@@ -165,12 +184,9 @@ def analyze_product(catering_df: pd.DataFrame, conn) -> dict:
     if len(unmatched_products) > 0:
         # 将新的商品名保存到文件
         new_products_df = pd.DataFrame({'product': unmatched_products})
-        new_products_df.to_csv('db/ideapod_product_new.csv', index=False, encoding='utf-8-sig')
-        print(f"发现 {len(unmatched_products)} 个新商品名，已保存到 db/ideapod_product_new.csv")
-        print("程序已暂停执行，请处理新商品后重新运行")
-        # 使用 sys.exit() 暂停程序执行，如果不想完全退出也可以用其他方式
-        import sys
-        sys.exit(1)
+        new_products_df.to_csv(NEW_PRODUCTS_FILE, index=False, encoding='utf-8-sig')
+        # 抛出普通异常而不是退出进程：按需计算的请求线程、后台任务和流水线都按分析错误处理
+        raise ValueError(f"发现 {len(unmatched_products)} 个新商品名，已保存到 {NEW_PRODUCTS_FILE}，请处理新商品后重新运行")
 
 
     # 计算总销售量并筛选前20个产品类型
@@ -178,7 +194,7 @@ def analyze_product(catering_df: pd.DataFrame, conn) -> dict:
     product_sales = product_sales[product_sales['产品类型'].isin(top_products)]
     
     # 添加周标识
-    product_sales['订单周'] = product_sales['订单日期'].dt.to_period('W-MON').apply(lambda x: x.start_time.date())
+    product_sales['订单周'] = product_sales['订单日期'].dt.to_period('W-MON').dt.start_time.dt.date
     
     # 按周和产品类型统计销售数量
     weekly_product_sales = product_sales.groupby(['订单周', '产品类型']).agg(
@@ -192,149 +208,182 @@ def analyze_product(catering_df: pd.DataFrame, conn) -> dict:
         '产品销售量_bar': weekly_product_sales
     }
 
+def build_product_summaries(catering_df: pd.DataFrame, product_df: pd.DataFrame) -> pd.DataFrame:
+    """每个 (日期, 小时) 的商品和产品类型销量摘要，Product 表中没有的商品归为未分类"""
+    items = parse_order_items(catering_df)
+    items = items[items['订单日期'].notna()]
+    types = product_df.drop_duplicates('商品名').set_index('商品名')['产品类型']
+    groups = pd.DataFrame({
+        '日期': items['订单日期'].dt.strftime('%Y-%m-%d'),
+        '小时': items['订单日期'].dt.hour
+    })
+    parts = [
+        ideapod_topn.summarize(groups.assign(维度='商品'), items['product'], items['quantity']),
+        ideapod_topn.summarize(groups.assign(维度='产品类型'),
+                               items['product'].map(types).fillna(UNCLASSIFIED_PRODUCT), items['quantity'])
+    ]
+    return pd.concat(parts, ignore_index=True)[ideapod_topn.SUMMARY_COLUMNS]
+
+def write_product_summaries(conn: sqlite3.Connection, start_date=None) -> int:
+    """重建 start_date（含）之后各日的销量摘要，默认全部重建，返回摘要行数"""
+    catering_df = preprocess_datetime(ideapod_db.read_table(conn, 'Catering', start_date))
+    # 与 prepare_data 一致，不计报损/领用的订单，按服务方式或门店筛选时由订单直接建立的摘要与之相同
+    catering_df = catering_df[catering_df['服务方式'] != '报损']
+    product_df = pd.read_sql_query("SELECT * FROM Product", conn)
+    count = ideapod_topn.write_summaries(conn, build_product_summaries(catering_df, product_df), start_date)
+    ideapod_db.record_sources(conn, ideapod_topn.SUMMARY_TABLE)
+    return count
+
+def read_product_summaries(conn: sqlite3.Connection, start_date=None, end_date=None) -> pd.DataFrame:
+    """读取日期范围内两个维度的销量摘要；摘要表只在导入 / 更新时建立，不存在或与 Catering / Product 不一致时报错"""
+    ideapod_db.check_derived(conn, ideapod_topn.SUMMARY_TABLE)
+    return pd.concat([ideapod_topn.read_summaries(conn, dimension, start_date, end_date)
+                      for dimension in ideapod_topn.DIMENSIONS], ignore_index=True)
+
+def analyze_top_products(summaries: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    热销排行：各月销量前 TOP_N 的商品、各小时销量前 TOP_N 的产品类型，由每日每小时的摘要合并得到，
+    数量为销量上限，数量下限为保证值，确定入选表示该项一定属于真实的前 TOP_N
+    """
+    def ranking(frame: pd.DataFrame, by: pd.Series, label: str) -> pd.DataFrame:
+        parts = [ideapod_topn.top_items(ideapod_topn.merge(group), TOP_N).assign(**{label: key})
+                 for key, group in frame.groupby(by, sort=True)]
+        columns = [label] + ideapod_topn.TOP_COLUMNS
+        return pd.concat(parts, ignore_index=True)[columns] if parts else pd.DataFrame(columns=columns)
+
+    products = summaries[summaries['维度'] == '商品']
+    types = summaries[summaries['维度'] == '产品类型']
+    hourly = ranking(types, types['小时'], '小时')
+    hourly['小时'] = hourly['小时'].astype(str) + '点'
+    return {
+        '各月热销商品_table': ranking(products, products['日期'].str[:7], '订单月'),
+        '各时段热销产品类型_table': hourly
+    }
+
+def analyze_basket(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """购物篮分析：每月热销商品的两两搭配和三件组合"""
+    items = parse_order_items(catering_df)
+    pairs, triples = ideapod_basket.basket_rules(items['订单号'], items['product'], items['订单日期'].dt.to_period('M'))
+    return {
+        '商品搭配_table': pairs,
+        '三件组合_table': triples
+    }
+
 def analyze_marketing(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-    """营销分析，移除重复的促销类型"""
-
-    # 处理促销类型，去除重复的优惠信息
-    def deduplicate_promotions(promo):
-        if pd.isna(promo) or promo == '无优惠':
-            return '无优惠'
-        # 将促销类型按逗号分隔并去重
-        promo_list = promo.split(',')
-        unique_promos = list(dict.fromkeys(promo_list))  # 去重并保持顺序
-        return ','.join(unique_promos)
-
-    # 应用去重逻辑
-    catering_df['促销类型'] = catering_df['使用优惠'].apply(deduplicate_promotions)
-
-    # 分组统计
-    promotion_analysis = catering_df.groupby(['订单月', '促销类型']).agg(
+    """营销分析：按去重后的优惠组合和按单项优惠分别统计"""
+    metrics = dict(
         订单总数=('订单号', 'count'),
         销售收入=('实收', 'sum'),
         平均折扣=('打折', 'mean'),
         总折扣金额=('打折', 'sum')
-    ).reset_index()
+    )
+
+    # 优惠组合：重复的优惠只保留一次
+    catering_df['促销类型'] = ideapod_promotion.promotion_combinations(catering_df['使用优惠'])
+    promotion_analysis = catering_df.groupby(['订单月', '促销类型'], observed=True).agg(**metrics).reset_index()
     promotion_analysis['订单月'] = promotion_analysis['订单月'].astype(str)
+    promotion_analysis['促销类型'] = promotion_analysis['促销类型'].astype(str)
+
+    # 单项优惠：使用了多种优惠的订单计入每一种
+    tags = ideapod_promotion.promotion_tags(catering_df['使用优惠'])
+    tagged = catering_df.loc[tags.index, ['订单月', '订单号', '实收', '打折']]
+    tagged['优惠'] = tags['优惠'].to_numpy()
+    single_analysis = tagged.groupby(['订单月', '优惠'], observed=True).agg(**metrics).reset_index()
+    single_analysis['订单月'] = single_analysis['订单月'].astype(str)
+    single_analysis['优惠'] = single_analysis['优惠'].astype(str)
 
     return {
-        '促销优惠分析_bar': promotion_analysis
+        '促销优惠分析_bar': promotion_analysis,
+        '单项优惠分析_bar': single_analysis
     }
 
-def analyze_user(catering_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+def customer_ids(catering_df: pd.DataFrame, identity: pd.DataFrame) -> pd.Series:
+    """订单的客户编号（客户维度表 ideapod_customer.read_identity），同一客户的多个会员号合为一位用户；非会员订单为空"""
+    keys = ideapod_customer.customer_keys(identity, '会员号', catering_df['会员号'])
+    return pd.Series(keys, index=catering_df.index, dtype=float).where(keys >= 0)
+
+def analyze_user(catering_df: pd.DataFrame, identity: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     """
     用户分析：原来是以周度，将用户按订单次数分类，计算订单数量、总收入、平均订单价格
-    现在修改为基于catering_df计算RFM用户价值
+    现在修改为基于catering_df计算RFM用户价值，按客户编号统计（非会员订单无法对应到用户，不计入），
+    分布图使用近 RFM_PARAMS['days'] 天的数据
     注意参数：lamda，weight，以及用户价值的算法
     """
-    catering_df['member_id'] = np.where(
-        catering_df['会员号'].isna() | catering_df['会员号'].isnull() | (catering_df['会员号'] == ''),
-        catering_df.index.map(lambda x: f'8888000{x:04d}'),
-        catering_df['会员号']
+    scored = ideapod_rfm.score_customers(
+        customer_ids(catering_df, identity), catering_df['下单时间'], catering_df['实收'], catering_df['订单号'],
+        RFM_PARAMS, windows=set(ideapod_rfm.RFM_WINDOWS) | {RFM_PARAMS['days']}
     )
-    # 设置时间范围（过去180天）
-    today = catering_df['下单时间'].max()
-    begin_day = today - timedelta(days=180)  # 统计过去6个月的数据
-    df_filtered = catering_df[catering_df['下单时间'] >= begin_day].copy()
-    
-    # 按会员号聚合计算所需指标
-    rfm_analysis = df_filtered.groupby('member_id').agg({
-        '下单时间': 'max',  # 最近一次下单时间
-        '实收': 'sum',      # 总消费金额
-        '订单号': 'count'   # 消费次数
-    }).reset_index()
-    
-    # 重命名列
-    rfm_analysis.columns = ['会员号', '最近下单时间', '总消费金额', '消费次数']
-    rfm_analysis['Recency'] = (today - rfm_analysis['最近下单时间']).dt.days
-    
-    # 计算最近购买时间指数: e^(-λ * Recency), λ=0.0115对应60天下降到50
-    lambda_param = 0.0115
-    rfm_analysis['最近一次消费指数'] = np.exp(-lambda_param * rfm_analysis['Recency']) * 100
-    
-    # 计算原始的消费力和消费频次指数
-    rfm_analysis['monetary_raw'] = np.log(rfm_analysis['总消费金额'] + 1)
-    rfm_analysis['frequency_raw'] = np.log(rfm_analysis['消费次数'] + 1)
-  
-    # 新算法：以理论最小值 0 为基准，最大值拉到 100
-    monetary_max = rfm_analysis['monetary_raw'].max()
-    rfm_analysis['消费力指数'] = (rfm_analysis['monetary_raw'] / monetary_max) * 100
-    
-    frequency_max = rfm_analysis['frequency_raw'].max()
-    rfm_analysis['消费频次指数'] = (rfm_analysis['frequency_raw'] / frequency_max) * 100
-     
-    # 加权计算user_value
-    weight_monetary = 0.4  # 餐饮用户单价较低，频次更重要
-    weight_frequency = 1 - weight_monetary  
-    
-    rfm_analysis['用户价值'] = (
-        rfm_analysis['最近一次消费指数'] * 
-        (rfm_analysis['消费力指数'] * weight_monetary + 
-         rfm_analysis['消费频次指数'] * weight_frequency)
-    ) / 100
-    
-    # 创建0-100的区间（以1为间隔）
-    bins = np.arange(0, 101, 1)
-    
-    # 对四个指标进行分布统计
-    value_dist = pd.cut(rfm_analysis['用户价值'], bins=bins, include_lowest=True).value_counts().sort_index()
-    recency_dist = pd.cut(rfm_analysis['最近一次消费指数'], bins=bins, include_lowest=True).value_counts().sort_index()
-    monetary_dist = pd.cut(rfm_analysis['消费力指数'], bins=bins, include_lowest=True).value_counts().sort_index()
-    frequency_dist = pd.cut(rfm_analysis['消费频次指数'], bins=bins, include_lowest=True).value_counts().sort_index()
-    
-    # 创建包含0-100的第一列
-    score_range = pd.Series(range(1, 101), name='分数区间')
-
-    # 创建结果DataFrame
-    distribution_result = pd.DataFrame({
-        '分数区间': score_range,
-        '用户价值分布': value_dist.values,
-        '最近一次消费指数分布': recency_dist.values,
-        '消费力指数分布': monetary_dist.values,
-        '消费频次指数分布': frequency_dist.values
-    })
+    distribution_result = ideapod_rfm.score_distribution(scored[scored['窗口天数'] == RFM_PARAMS['days']])
      
     return {
-        '用户价值分布（RFM模型）_bar': distribution_result
+        '用户价值分布（RFM模型）_bar': distribution_result,
+        '用户价值分层_table': ideapod_rfm.segment_table(scored)
     }
 
-def analyze(conn):
-    """主分析函数"""
+def read_identity(conn: sqlite3.Connection) -> pd.DataFrame:
+    """读取客户维度表；表尚未建立（较早建立的数据库）时由各表的对应关系临时计算，编号不同但分组相同"""
     try:
-        catering_df = pd.read_sql_query("SELECT * FROM Catering", conn)
-        
-        catering_df = preprocess_datetime(catering_df)
-        catering_df['订单月'] = catering_df['下单时间'].dt.to_period('M')
-        catering_df['订单周'] = catering_df['下单时间'].dt.to_period('W-MON').apply(lambda x: x.start_time.date())
-        
-        # 删除报损/领用的订单
-        catering_df.drop(catering_df[catering_df['服务方式'] == '报损'].index, inplace=True)
+        return ideapod_customer.read_identity(conn)
+    except RuntimeError as e:
+        logging.warning(f"[Catering] {e}，用户价值改用临时计算的客户编号")
+        return ideapod_customer.build_identity(ideapod_customer.read_links(conn))
+
+def prepare_data(catering_df: pd.DataFrame) -> pd.DataFrame:
+    """预处理时间列，添加订单月、订单周，并删除报损/领用的订单"""
+    catering_df = preprocess_datetime(catering_df)
+    catering_df['订单月'] = catering_df['下单时间'].dt.to_period('M')
+    catering_df['订单周'] = catering_df['下单时间'].dt.to_period('W-MON').dt.start_time.dt.date
+    
+    # 删除报损/领用的订单
+    catering_df.drop(catering_df[catering_df['服务方式'] == '报损'].index, inplace=True)
+    return catering_df
+
+def analyze(conn, start_date=None, end_date=None, lines=None, stores=None):
+    """
+    主分析函数
+    start_date / end_date: 只分析该日期范围（含首尾）内的订单，默认全部历史
+    lines: 只分析指定的服务方式
+    stores: 只分析指定门店的订单，默认全部门店
+    """
+    try:
+        filters = {}
+        if lines:
+            filters['服务方式'] = lines
+        if stores:
+            filters[ideapod_db.STORE_COLUMN] = stores
+        catering_df = ideapod_db.read_table(conn, 'Catering', start_date, end_date, filters)
+        catering_df = prepare_data(catering_df)
+        product_df = pd.read_sql_query("SELECT * FROM Product", conn)
 
         financial_results = analyze_finance(catering_df)
         order_results = analyze_order(catering_df)
-        product_results = analyze_product(catering_df, conn)
+        product_results = analyze_product(catering_df, product_df)
         marketing_results = analyze_marketing(catering_df)
-        user_results = analyze_user(catering_df)
+        user_results = analyze_user(catering_df, read_identity(conn))
+        basket_results = analyze_basket(catering_df)
+        # 按服务方式或门店筛选时摘要中没有对应的拆分，直接由筛选后的订单建立
+        if lines or stores:
+            summaries = build_product_summaries(catering_df, product_df)
+        else:
+            try:
+                summaries = read_product_summaries(conn, start_date, end_date)
+            except RuntimeError as e:
+                # 摘要表缺失或未随订单重建（如较早建立的数据库）时同样由订单直接建立，只是慢一些
+                logging.warning(f"[Catering] {e}，热销排行改由订单直接计算")
+                summaries = build_product_summaries(catering_df, product_df)
+        top_results = analyze_top_products(summaries)
 
         all_results = {
             '财务分析': financial_results,
             '订单分析': order_results,
             '餐饮产品': product_results,
             '用户价值': user_results,
-            '促销分析': marketing_results
+            '促销分析': marketing_results,
+            '购物篮分析': basket_results,
+            '热销排行': top_results
         }
 
-        def convert_df_to_dict(data):
-            if isinstance(data, pd.DataFrame):
-                return data.to_dict(orient='records')
-            return data
-
-        processed_results = {}
-        for category, data in all_results.items():
-            processed_results[category] = {
-                key: convert_df_to_dict(value) for key, value in data.items()
-            }
-
-        return processed_results
+        return all_results
 
     except sqlite3.Error as e:
         return {'error': f"Database error: {e}"}
@@ -0,0 +1,151 @@
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Dict, Tuple
+import ideapod_db
+
+# 客户维度表：每个标识（会员号 / 手机号）一行，对应一个整数客户编号
+# 同一会员的会员号和手机号、同一订单上的会员号和手机号属于同一客户；已分配的编号保持不变
+IDENTITY_TABLE = 'CustomerIdentity'
+ID_TYPES = ('会员号', '手机号')
+# 提供 (会员号, 手机号) 对应关系的表，没有的一列按空值处理
+LINK_TABLES = ('Member', 'Space', 'Catering')
+# 按日期读取增量对应关系时各表使用的时间列，与 ideapod_update.replace_from 替换数据的时间列一致
+LINK_TIME_COLUMNS = {'Space': '创建时间', 'Catering': '下单时间'}
+# 视为空值的标识（astype(str) 之后的缺失值）
+MISSING_IDS = {'', 'nan', 'None', 'NaN', '<NA>', 'NaT'}
+
+def clean_ids(values: pd.Series) -> pd.Series:
+    """标识统一为去掉首尾空格的字符串，缺失为 None"""
+    values = values.astype('string').str.strip()
+    values = values.where(values.notna() & ~values.isin(MISSING_IDS))
+    return values.astype(object).where(values.notna(), None)
+
+def build_identity(links: pd.DataFrame, existing: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    由 (会员号, 手机号) 对应关系求客户编号：两类标识作为图的节点，每条对应关系是一条边，
+    连通的标识属于同一客户。已有的标识沿用原编号（两个已有客户被连通时取较小的编号），
+    新客户从现有最大编号之后依次编号；已有客户的连通关系不必再由 links 提供，只需给出新的对应关系
+    返回涉及的标识（links 中的标识及与其同属一个已有客户的标识）的 (类型, 标识, 客户编号)，
+    按客户编号、类型、标识排序
+    """
+    members, phones = clean_ids(links['会员号']), clean_ids(links['手机号'])
+    nodes = pd.concat([
+        pd.DataFrame({'类型': '会员号', '标识': members}),
+        pd.DataFrame({'类型': '手机号', '标识': phones})
+    ], ignore_index=True).dropna(subset=['标识']).drop_duplicates()
+    related = pd.DataFrame({'类型': [], '标识': [], '客户编号': []}) if existing is None else existing
+    if len(related):
+        # 只有与新对应关系中的标识同属一个客户的已有标识，编号可能因合并而变化
+        touched = pd.MultiIndex.from_frame(related[['类型', '标识']]).isin(pd.MultiIndex.from_frame(nodes))
+        related = related[related['客户编号'].isin(related.loc[touched, '客户编号'])]
+        nodes = pd.concat([related[['类型', '标识']], nodes], ignore_index=True).drop_duplicates()
+    nodes = nodes.reset_index(drop=True)
+    if nodes.empty:
+        return pd.DataFrame({'类型': [], '标识': [], '客户编号': np.array([], dtype=np.int64)})
+    node_index = pd.MultiIndex.from_frame(nodes)
+
+    # 初始编号：已有标识用原编号，新标识暂用现有最大编号之后的临时编号
+    labels = np.full(len(nodes), -1, dtype=np.int64)
+    next_key = 1
+    if existing is not None and len(existing):
+        next_key = int(existing['客户编号'].max()) + 1
+    known = node_index.get_indexer(pd.MultiIndex.from_frame(related[['类型', '标识']]))
+    labels[known] = related['客户编号'].to_numpy()
+    original = labels[known]
+    new = labels < 0
+    labels[new] = next_key + np.arange(new.sum())
+
+    # 边的两端都取较小的编号，原属同一客户的已有标识也取其中较小的编号，直到不再变化
+    both = members.notna() & phones.notna()
+    u = node_index.get_indexer(pd.MultiIndex.from_arrays([np.full(both.sum(), '会员号'), members[both]]))
+    v = node_index.get_indexer(pd.MultiIndex.from_arrays([np.full(both.sum(), '手机号'), phones[both]]))
+    while True:
+        edge_labels = np.minimum(labels[u], labels[v])
+        updated = labels.copy()
+        np.minimum.at(updated, u, edge_labels)
+        np.minimum.at(updated, v, edge_labels)
+        if len(known):
+            updated[known] = pd.Series(updated[known]).groupby(original).transform('min').to_numpy()
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    # 新客户的临时编号改为连续编号
+    fresh = labels >= next_key
+    codes, _ = pd.factorize(labels[fresh])
+    labels[fresh] = next_key + codes
+    identity = nodes.assign(客户编号=labels)
+    return identity.sort_values(['客户编号', '类型', '标识']).reset_index(drop=True)
+
+def frame_links(df: pd.DataFrame) -> pd.DataFrame:
+    """已读入的表中的 (会员号, 手机号) 对应关系，表中没有的一列为空"""
+    return pd.DataFrame({col: df[col] if col in df.columns else None for col in ID_TYPES}, index=df.index)
+
+def read_links(conn: sqlite3.Connection, start_dates: Dict[str, date] = None) -> pd.DataFrame:
+    """
+    各表中出现的 (会员号, 手机号) 对应关系（去重）
+    start_dates: 表 -> 日期，只读该表 LINK_TIME_COLUMNS 在这天（含）之后的记录；未给出的表全部读取
+    """
+    parts = []
+    for table in LINK_TABLES:
+        columns = ideapod_db.table_columns(conn, table)
+        selected = [f'"{col}"' if col in columns else f'NULL AS "{col}"' for col in ID_TYPES]
+        if not any(col in columns for col in ID_TYPES):
+            continue
+        query, params = f'SELECT DISTINCT {", ".join(selected)} FROM "{table}"', []
+        if start_dates and table in start_dates:
+            query += f' WHERE "{LINK_TIME_COLUMNS[table]}" >= ?'
+            params.append(start_dates[table].strftime('%Y-%m-%d'))
+        parts.append(pd.read_sql_query(query, conn, params=params))
+    if not parts:
+        return pd.DataFrame(columns=list(ID_TYPES))
+    return pd.concat(parts, ignore_index=True).drop_duplicates()
+
+def read_identity(conn: sqlite3.Connection) -> pd.DataFrame:
+    """读取客户维度表；表只在导入 / 更新时维护，不存在时报错"""
+    if not ideapod_db.table_columns(conn, IDENTITY_TABLE):
+        raise RuntimeError(f"{IDENTITY_TABLE} 表不存在，请先运行 ideapod_fetch.py 或 ideapod_update.py 建立")
+    return pd.read_sql_query(f'SELECT "类型", "标识", "客户编号" FROM "{IDENTITY_TABLE}"', conn)
+
+def update_identity(conn: sqlite3.Connection, start_dates: Dict[str, date] = None) -> Tuple[int, int]:
+    """
+    增量维护客户维度表：只插入新标识、更新被合并的标识，已有编号不变
+    start_dates: 增量更新的表 -> 新数据的最早日期，只读这之后的订单中的对应关系（已有的对应关系已计入表中）；
+    默认读取全部
+    返回 (新增标识数, 编号变化的标识数)
+    """
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS "{IDENTITY_TABLE}" (
+            "类型" TEXT NOT NULL,
+            "标识" TEXT NOT NULL,
+            "客户编号" INTEGER NOT NULL,
+            PRIMARY KEY ("类型", "标识")
+        ) WITHOUT ROWID
+    ''')
+    existing = read_identity(conn)
+    identity = build_identity(read_links(conn, start_dates), existing)
+
+    merged = identity.merge(existing, on=['类型', '标识'], how='left', suffixes=('', '_原'))
+    inserted = merged[merged['客户编号_原'].isna()]
+    changed = merged[merged['客户编号_原'].notna() & (merged['客户编号'] != merged['客户编号_原'])]
+    conn.executemany(f'INSERT INTO "{IDENTITY_TABLE}" ("类型", "标识", "客户编号") VALUES (?, ?, ?)',
+                     inserted[['类型', '标识', '客户编号']].itertuples(index=False, name=None))
+    conn.executemany(f'UPDATE "{IDENTITY_TABLE}" SET "客户编号" = ? WHERE "类型" = ? AND "标识" = ?',
+                     changed[['客户编号', '类型', '标识']].itertuples(index=False, name=None))
+    conn.commit()
+    if len(changed):
+        logging.info(f"[Customer] {len(changed)} 个标识因关联到其他客户而合并编号")
+    return len(inserted), len(changed)
+
+def customer_keys(identity: pd.DataFrame, id_type: str, values: pd.Series) -> np.ndarray:
+    """按标识查客户编号（哈希索引），查不到或为空时为 -1"""
+    lookup = identity[identity['类型'] == id_type]
+    index = pd.Index(lookup['标识'])
+    positions = index.get_indexer(clean_ids(values))
+    keys = np.full(len(positions), -1, dtype=np.int64)
+    found = positions >= 0
+    keys[found] = lookup['客户编号'].to_numpy(dtype=np.int64)[positions[found]]
+    return keys
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import sqlite3
+import pandas as pd
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+DB_PATH = 'db/ideapod.db'
+
+# 按时间范围查询时各表使用的时间列
+TIME_COLUMNS = {
+    'Space': '预定开始时间',
+    'Catering': '下单时间'
+}
+
+# Space 和 Catering 中记录订单所属门店的列，按门店拆分的分析、导入和更新都以它为分区键
+STORE_COLUMN = '下单门店'
+
+# 索引名: (表名, 列)
+INDEXES = {
+    'idx_space_start': ('Space', ['预定开始时间']),
+    'idx_space_product_start': ('Space', ['订单商品名', '预定开始时间']),
+    'idx_catering_time': ('Catering', ['下单时间']),
+    'idx_catering_service_time': ('Catering', ['服务方式', '下单时间']),
+    'idx_space_store_start': ('Space', [STORE_COLUMN, '预定开始时间']),
+    'idx_catering_store_time': ('Catering', [STORE_COLUMN, '下单时间']),
+    'idx_customer_key': ('CustomerIdentity', ['客户编号'])
+}
+
+# 由其他表派生、在导入 / 更新时重建的表: 来源表
+# 重建后记录各来源表的内容哈希，读取前比对，来源表变化而派生表未重建时报错而不是返回过期的结果
+DERIVED_TABLES = {
+    'ProductSummary': ('Catering', 'Product'),
+    'UserSketch': ('Space', 'Catering', 'Member', 'CustomerIdentity'),
+    'RemarkIndex': ('Space', 'Catering')
+}
+DERIVED_SOURCE_TABLE = 'DerivedSource'
+# 已检查过的 (数据库文件, 派生表) -> 检查时的数据版本，数据库未变化时不重复检查
+_checked = {}
+# 各表内容哈希的记录文件（与数据库文件同名、在同一目录），数据库未变化时各进程直接沿用；
+# 派生表检查与结果缓存（ideapod_cache）共用，每个数据版本每个表只读一次
+FINGERPRINT_SUFFIX = '.tables.json'
+# 数据库文件 -> 进程内的记录 {'version': ..., 'tables': {表: 哈希}}
+_fingerprints = {}
+
+def get_db_connection(db_path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    """建立按时间范围和业务线查询所需的索引（to_sql replace 会删除索引，写表后需重新调用）"""
+    for name, (table, columns) in INDEXES.items():
+        existing = table_columns(conn, table)
+        if not existing or not all(col in existing for col in columns):
+            continue
+        column_sql = ', '.join(f'"{col}"' for col in columns)
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_sql})')
+    conn.commit()
+
+def data_version(db_path: str = DB_PATH) -> int:
+    """数据库文件的修改时间，数据更新后即变化，用作缓存键的一部分"""
+    try:
+        return os.stat(db_path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def _file_version(path: str) -> list:
+    """
+    数据库文件的修改时间和文件头中的修改计数（每次提交的事务加一），
+    修改时间精度不足以区分紧接着的两次写入时由计数区分
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(24)
+            counter = int.from_bytes(f.read(4), 'big')
+    except (FileNotFoundError, IsADirectoryError):
+        counter = 0
+    return [data_version(path), counter]
+
+def table_fingerprint(conn: sqlite3.Connection, table: str) -> str:
+    """
+    表内容（列名和全部行）的哈希，内容不变则不变，与表是否被重写无关
+    逐批读取原始行，不经过 pandas
+    """
+    columns = table_columns(conn, table)
+    digest = hashlib.sha256(repr(columns).encode('utf-8'))
+    if not columns:
+        # 表尚未建立（如首次使用前的规则表）时按空表处理
+        return digest.hexdigest()
+    # 按 rowid（WITHOUT ROWID 表按主键）排序，行的顺序与查询计划（如之后新建的索引）无关
+    try:
+        cursor = conn.execute(f'SELECT * FROM "{table}" ORDER BY rowid')
+    except sqlite3.OperationalError:
+        primary_key = sorted((row[5], row[1]) for row in conn.execute(f'PRAGMA table_info("{table}")') if row[5])
+        order = ', '.join(f'"{name}"' for _, name in primary_key)
+        cursor = conn.execute(f'SELECT * FROM "{table}" ORDER BY {order}')
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        digest.update(repr([tuple(row) for row in rows]).encode('utf-8'))
+    return digest.hexdigest()
+
+def table_fingerprints(conn: sqlite3.Connection, tables) -> Dict[str, str]:
+    """
+    各表的内容哈希，每个数据版本每个表只计算一次：结果保存在进程内和数据库文件旁的记录文件中，
+    数据库未变化时直接沿用（只重写而内容未变的表，哈希保持不变）
+    """
+    tables = list(tables)
+    path = _db_file(conn)
+    version = _file_version(path) if path else None
+    record = _fingerprints.get(path)
+    record_path = os.path.splitext(path)[0] + FINGERPRINT_SUFFIX if path else None
+    if record is None or record['version'] != version:
+        try:
+            with open(record_path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (TypeError, FileNotFoundError, json.JSONDecodeError):
+            record = {}
+        if not path or record.get('version') != version:
+            record = {'version': version, 'tables': {}}
+        _fingerprints[path] = record
+
+    missing = [table for table in tables if table not in record['tables']]
+    if missing:
+        for table in missing:
+            record['tables'][table] = table_fingerprint(conn, table)
+        if path:
+            tmp_path = f'{record_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, record_path)
+    return {table: record['tables'][table] for table in tables}
+
+def read_table(conn: sqlite3.Connection, table: str, start_date: Optional[date] = None,
+               end_date: Optional[date] = None, filters: Optional[Dict[str, List[str]]] = None) -> pd.DataFrame:
+    """
+    读取表中指定日期范围（含首尾两天）和取值范围内的记录，条件走索引在 SQLite 中完成
+    时间列以 'YYYY-MM-DD HH:MM:SS' 文本存储，可直接按字符串比较
+    """
+    conditions, params = [], []
+    time_col = TIME_COLUMNS.get(table)
+    if start_date is not None:
+        conditions.append(f'"{time_col}" >= ?')
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date is not None:
+        conditions.append(f'"{time_col}" < ?')
+        params.append((end_date + timedelta(days=1)).strftime('%Y-%m-%d'))
+    for col, values in (filters or {}).items():
+        conditions.append(f'"{col}" IN ({", ".join("?" * len(values))})')
+        params.extend(values)
+
+    query = f'SELECT * FROM "{table}"'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return pd.read_sql_query(query, conn, params=params)
+
+def _db_file(conn: sqlite3.Connection) -> str:
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+def record_sources(conn: sqlite3.Connection, table: str) -> None:
+    """派生表重建后记录各来源表的内容哈希"""
+    # 先提交来源表的写入，哈希按提交后的数据版本记录
+    conn.commit()
+    fingerprints = table_fingerprints(conn, DERIVED_TABLES[table])
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS "{DERIVED_SOURCE_TABLE}" (
+            "派生表" TEXT NOT NULL,
+            "来源表" TEXT NOT NULL,
+            "内容哈希" TEXT NOT NULL,
+            PRIMARY KEY ("派生表", "来源表")
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'DELETE FROM "{DERIVED_SOURCE_TABLE}" WHERE "派生表" = ?', (table,))
+    conn.executemany(f'INSERT INTO "{DERIVED_SOURCE_TABLE}" VALUES (?, ?, ?)',
+                     [(table, source, fingerprints[source]) for source in DERIVED_TABLES[table]])
+    conn.commit()
+
+def stale_sources(conn: sqlite3.Connection, table: str) -> List[str]:
+    """内容与派生表上次重建时不同的来源表；派生表不存在或没有记录时为全部来源表"""
+    sources = list(DERIVED_TABLES[table])
+    if not table_columns(conn, table) or not table_columns(conn, DERIVED_SOURCE_TABLE):
+        return sources
+    recorded = dict(conn.execute(f'SELECT "来源表", "内容哈希" FROM "{DERIVED_SOURCE_TABLE}" WHERE "派生表" = ?',
+                                 (table,)).fetchall())
+    fingerprints = table_fingerprints(conn, sources)
+    return [source for source in sources if recorded.get(source) != fingerprints[source]]
+
+def check_derived(conn: sqlite3.Connection, table: str) -> None:
+    """派生表不存在或与来源表不一致时抛出 RuntimeError"""
+    path = _db_file(conn)
+    version = _file_version(path)
+    if _checked.get((path, table)) == version:
+        return
+    if not table_columns(conn, table):
+        raise RuntimeError(f"{table} 表不存在，请先运行 ideapod_fetch.py 或 ideapod_update.py 建立")
+    stale = stale_sources(conn, table)
+    if stale:
+        raise RuntimeError(f"{table} 表在 {', '.join(stale)} 更新后未重建，请运行 ideapod_update.py 重建")
+    _checked[(path, table)] = version
@@ -0,0 +1,195 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+# 静态页面与对应的分析结果
+PAGES = {
+    'space': 'static/space_results.json',
+    'catering': 'static/catering_results.json',
+    'group': 'static/group_results.json'
+}
+SOURCE_DIR = 'static/Synology'
+OUTPUT_DIR = 'dist/ideapod'
+DATA_DIR = 'data'
+HASH_LENGTH = 12  # 与 HTACCESS 中的 [0-9a-f]{12} 保持一致
+# 大于该字节数的文本文件才生成 .gz 预压缩版本
+GZIP_MIN_SIZE = 1024
+# 导出器写入的文件清单，清理时只删除清单中记录过的文件；以 .ht 开头，Apache 默认不对外提供
+EXPORT_RECORD = '.htexport.json'
+
+# Synology Web Station (Apache) 缓存与预压缩配置
+HTACCESS = """# 由 ideapod_export.py 生成，请勿手动修改
+AddDefaultCharset utf-8
+
+<IfModule mod_rewrite.c>
+    RewriteEngine On
+    RewriteCond %{HTTP:Accept-Encoding} gzip
+    RewriteCond %{REQUEST_FILENAME}.gz -f
+    RewriteRule ^(.+)\\.(json|js|css|html)$ $1.$2.gz [L]
+</IfModule>
+
+<FilesMatch "\\.json\\.gz$">
+    ForceType application/json
+</FilesMatch>
+<FilesMatch "\\.js\\.gz$">
+    ForceType application/javascript
+</FilesMatch>
+<FilesMatch "\\.css\\.gz$">
+    ForceType text/css
+</FilesMatch>
+<FilesMatch "\\.html\\.gz$">
+    ForceType text/html
+</FilesMatch>
+
+<IfModule mod_headers.c>
+    <FilesMatch "\\.gz$">
+        Header set Content-Encoding gzip
+    </FilesMatch>
+    <FilesMatch "\\.(json|js|css|html)(\\.gz)?$">
+        Header append Vary Accept-Encoding
+    </FilesMatch>
+    # 文件名带内容哈希，内容不变则永久缓存
+    <FilesMatch "\\.[0-9a-f]{12}\\.(json|js|css)(\\.gz)?$">
+        Header set Cache-Control "public, max-age=31536000, immutable"
+    </FilesMatch>
+    # 页面与 manifest 每次向服务器确认
+    <FilesMatch "(\\.html|\\.manifest\\.json)(\\.gz)?$">
+        Header set Cache-Control "no-cache"
+    </FilesMatch>
+</IfModule>
+"""
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+def hashed_name(name: str, data: bytes) -> str:
+    """styles.css -> styles.<hash>.css"""
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{content_hash(data)}{ext}'
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """内容不同才写入，保持未变化文件的修改时间，便于 rsync 只同步增量"""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+def write_file(output_dir: str, name: str, data: bytes, stats: dict, compress: bool = True) -> None:
+    """写入文件及其 .gz 预压缩版本，并记录在 stats 中"""
+    path = os.path.join(output_dir, name)
+    stats['files'].add(name)
+    changed = write_if_changed(path, data)
+    if compress and len(data) >= GZIP_MIN_SIZE:
+        stats['files'].add(name + '.gz')
+        # mtime=0 保证相同内容得到相同的压缩结果
+        if changed or not os.path.exists(path + '.gz'):
+            write_if_changed(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    stats['written' if changed else 'unchanged'].append(name)
+
+def export_page_data(page: str, results_path: str, output_dir: str, stats: dict) -> str:
+    """按标签拆分分析结果并写入带哈希的数据文件，返回 manifest 的相对路径"""
+    with open(results_path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if 'error' in results:
+        raise ValueError(f"{results_path} 包含错误信息: {results['error']}")
+
+    tabs = []
+    for tab_name, tab_data in results.items():
+        data = json.dumps(tab_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        name = f'{DATA_DIR}/{page}.{content_hash(data)}.json'
+        write_file(output_dir, name, data, stats)
+        tabs.append({'name': tab_name, 'file': name})
+
+    manifest_name = f'{DATA_DIR}/{page}.manifest.json'
+    manifest = json.dumps({'tabs': tabs}, ensure_ascii=False, indent=2).encode('utf-8')
+    write_file(output_dir, manifest_name, manifest, stats)
+    return manifest_name
+
+def render_page(html: str, assets: dict, manifest_name: str = None) -> str:
+    """替换页面中的静态资源链接和数据来源"""
+    for name, hashed in assets.items():
+        html = re.sub(rf'(href|src)="{re.escape(name)}"', rf'\1="{hashed}"', html)
+    if manifest_name:
+        html = re.sub(r'data-json-file="[^"]*"', f'data-manifest="{manifest_name}"', html)
+    return html
+
+def read_export_record(output_dir: str) -> set:
+    """上次导出写入的文件，没有记录时为空"""
+    path = os.path.join(output_dir, EXPORT_RECORD)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return set(json.load(f)['files'])
+
+def prune(output_dir: str, keep: set) -> list:
+    """删除上次导出记录过、本次未引用的文件，输出目录中的其他文件不受影响"""
+    removed = []
+    for name in sorted(read_export_record(output_dir) - keep):
+        path = os.path.join(output_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+            removed.append(name)
+    return removed
+
+def export_site(source_dir: str = SOURCE_DIR, output_dir: str = OUTPUT_DIR) -> dict:
+    """导出 Synology 静态站点，只更新内容有变化的文件"""
+    stats = {'written': [], 'unchanged': [], 'files': set()}
+    source_files = sorted(os.listdir(source_dir))
+
+    # 1. 样式与脚本：文件名带哈希
+    assets = {}
+    for name in source_files:
+        if name.endswith(('.css', '.js')):
+            with open(os.path.join(source_dir, name), 'rb') as f:
+                data = f.read()
+            assets[name] = hashed_name(name, data)
+            write_file(output_dir, assets[name], data, stats)
+
+    # 2. 各页面的分标签数据
+    manifests = {}
+    for page, results_path in PAGES.items():
+        if os.path.exists(results_path):
+            manifests[page] = export_page_data(page, results_path, output_dir, stats)
+        else:
+            print(f"{results_path} 不存在，跳过 {page} 数据导出")
+
+    # 3. 页面和其他静态文件（图片等）
+    for name in source_files:
+        path = os.path.join(source_dir, name)
+        if name in assets or name.startswith('.') or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if name.endswith('.html'):
+            page = os.path.splitext(name)[0]
+            data = render_page(data.decode('utf-8'), assets, manifests.get(page)).encode('utf-8')
+        write_file(output_dir, name, data, stats)
+
+    write_file(output_dir, '.htaccess', HTACCESS.encode('utf-8'), stats, compress=False)
+
+    stats['removed'] = prune(output_dir, stats['files'])
+    record = json.dumps({'files': sorted(stats['files'])}, ensure_ascii=False, indent=2).encode('utf-8')
+    write_if_changed(os.path.join(output_dir, EXPORT_RECORD), record)
+    return stats
+
+def main():
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else OUTPUT_DIR
+    stats = export_site(output_dir=output_dir)
+    print(f"导出完成: {output_dir}")
+    print(f"更新 {len(stats['written'])} 个文件，未变化 {len(stats['unchanged'])} 个，删除 {len(stats['removed'])} 个")
+    for name in stats['written']:
+        print(f"  更新: {name}")
+    for name in stats['removed']:
+        print(f"  删除: {name}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
+import os
 import pandas as pd
 import sqlite3
+import ideapod_catering
+import ideapod_customer
+import ideapod_db
+import ideapod_hll
+import ideapod_remark
+import ideapod_store
 
 def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
     """Unified datetime preprocessing for all tables"""
@@ -15,35 +22,36 @@ def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
             df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
     return df
 
-def load_and_prepare_data(catering_file, space_file, member_file, product_file, database_path):
-    """
-    Load CSV files, clean and prepare data, then save to SQLite database
-    """
-    # 读取 CSV 文件
-    catering_df = pd.read_csv(catering_file, dtype={"会员号": str,"订单号": str,"原订单号": str})
-    space_df = pd.read_csv(space_file, dtype={"手机号": str})
-    member_df = pd.read_csv(member_file, dtype={"会员号": str, "手机号": str})
-    product_df = pd.read_csv(product_file)
-
-    # 删除指定列
-    catering_df.rename(columns={'入账时间（原下单时间）': '下单时间'}, inplace=True)
-    catering_df.drop(columns=[
-        "号牌", "FLIPOS版本", "状态", "代金券", "下单门店", "门店编号", "门店区域", 
+def clean_catering(catering_df: pd.DataFrame) -> pd.DataFrame:
+    """清洗一个门店的餐饮订单，只做逐行处理，可按门店并行"""
+    # 删除指定列，门店列保留
+    catering_df = catering_df.rename(columns={'入账时间（原下单时间）': '下单时间'})
+    catering_df = catering_df.drop(columns=[
+        "号牌", "FLIPOS版本", "状态", "代金券", "门店编号", "门店区域",
         "入账门店", "ERP流水号", "第三方外卖平台单号", "配送平台", 
         "配送平台订单编号", "包装费", "配送费", "积分", "收银备注"
-    ], inplace=True)
-
-    space_df.rename(columns={'支付金额1': '场景实收_flipos','支付金额2':'场景实收_non_flipos'}, inplace=True)
-    space_df.drop(columns=["用户昵称"], inplace=True)
-    member_df.drop(columns=["UnionID", "OpenID", "昵称", "标签", "首次消费门店", "最后消费门店"], inplace=True)
+    ], errors='ignore')
 
     # 数据清洗
     # 1. 过滤 catering_df 中服务方式为"报损"和赠送为0的记录
-    catering_df = catering_df[catering_df['服务方式'] != '报损']
+    catering_df = catering_df[catering_df['服务方式'] != '报损'].copy()
     
     # 赠送不影响实收
     # catering_df = catering_df[catering_df['赠送'] == 0]
-    
+
+    # 格式化日期列
+    catering_df = preprocess_datetime(catering_df)
+    # 取消备注中的换行符
+    catering_df["备注"] = catering_df["备注"].str.replace("\n", ",", regex=False)
+    # 类型转换
+    catering_df["会员号"] = catering_df["会员号"].astype(str)
+    return catering_df
+
+def clean_space(space_df: pd.DataFrame) -> pd.DataFrame:
+    """清洗一个门店的空间订单，只做逐行处理，可按门店并行"""
+    space_df = space_df.rename(columns={'支付金额1': '场景实收_flipos','支付金额2':'场景实收_non_flipos'})
+    space_df = space_df.drop(columns=["用户昵称"], errors='ignore')
+
     # 2. 支付方式映射和调整
     mapping_dict = {
         5: 'flipos',
@@ -77,36 +85,56 @@ def load_and_prepare_data(catering_file, space_file, member_file, product_file,
     space_df.loc[condition3, '支付方式2'] = space_df.loc[condition3, '支付方式1']
     space_df.loc[condition3, ['支付方式1', '场景实收_flipos']] = pd.NA
     
-    product_df['商品名'] = product_df['商品名'].str.strip()
-    product_df['产品类型'] = product_df['产品类型'].str.strip()
-    product_df[['场景','食品','饮品','甜品','卡券','营销系列', '口味', '价格','备注']] = product_df[['场景','食品','饮品','甜品','卡券','营销系列', '口味', '价格','备注']].fillna('')
-    
     # 格式化日期列
-    catering_df = preprocess_datetime(catering_df)
     space_df = preprocess_datetime(space_df)
-    member_df = preprocess_datetime(member_df)
 
     # 取消备注中的换行符
     space_df["订单备注"] = space_df["订单备注"].str.replace("\n", ",", regex=False)
     space_df["预定备注"] = space_df["预定备注"].str.replace("\n", ",", regex=False)
-    catering_df["备注"] = catering_df["备注"].str.replace("\n", ",", regex=False)
     # 类型转换
-    catering_df["会员号"] = catering_df["会员号"].astype(str)
     space_df["手机号"] = space_df["手机号"].astype(str)
-    member_df["会员号"] = member_df["会员号"].astype(str)
-    if "手机号" in member_df.columns:
-        member_df["手机号"] = member_df["手机号"].astype(str)
 
     if "实际结束时间" in space_df.columns:
         space_df['实际结束时间'] = space_df['实际结束时间'].fillna('NA')
 
-    # 内容处理
-    space_df['订单商品名'] = space_df['订单商品名'].fillna('').str.strip().str.replace('上海洛克外滩店-', '').str.replace('ideaPod 二楼专注-', '').str.replace(' the Box', '')
+    # 内容处理：门店前缀已记入门店列（ideapod_store.assign_store），从名称中去掉
+    space_df['订单商品名'] = ideapod_store.strip_store_prefix(space_df['订单商品名'].fillna('').str.strip()) \
+        .str.replace('ideaPod 二楼专注-', '').str.replace(' the Box', '')
         # 名字修改对应关系需要确认
     space_df['订单商品名'] = space_df['订单商品名'].replace({'丛林心流舱·日':'心流舱·巴赫','丛林心流舱·月':'心流舱·荣格','丛林心流舱·星':'心流舱·雨果','丛林心流舱·辰':'心流舱·牛顿','一层半帘区1':'蘑菇半帘区'})
     space_df['订单商品名'] = space_df['订单商品名'].apply(
         lambda x: '图书馆专注区' if x == '图书馆专注' else x
     )
+    return space_df
+
+def load_and_prepare_data(catering_file, space_file, member_file, product_file, database_path, jobs=1):
+    """
+    Load CSV files, clean and prepare data, then save to SQLite database
+    jobs: 餐饮和空间订单按门店拆分后清洗的并行进程数
+    """
+    # 读取 CSV 文件
+    catering_df = pd.read_csv(catering_file, dtype={"会员号": str,"订单号": str,"原订单号": str})
+    space_df = pd.read_csv(space_file, dtype={"手机号": str})
+    member_df = pd.read_csv(member_file, dtype={"会员号": str, "手机号": str})
+    product_df = pd.read_csv(product_file)
+
+    # 订单按门店清洗
+    catering_df = ideapod_store.map_stores(clean_catering, catering_df, jobs)
+    space_df = ideapod_store.map_stores(clean_space, space_df, jobs)
+
+    member_df.drop(columns=["UnionID", "OpenID", "昵称", "标签", "首次消费门店", "最后消费门店"], inplace=True)
+
+    product_df['商品名'] = product_df['商品名'].str.strip()
+    product_df['产品类型'] = product_df['产品类型'].str.strip()
+    product_df[['场景','食品','饮品','甜品','卡券','营销系列', '口味', '价格','备注']] = product_df[['场景','食品','饮品','甜品','卡券','营销系列', '口味', '价格','备注']].fillna('')
+    
+    # 格式化日期列
+    member_df = preprocess_datetime(member_df)
+
+    # 类型转换
+    member_df["会员号"] = member_df["会员号"].astype(str)
+    if "手机号" in member_df.columns:
+        member_df["手机号"] = member_df["手机号"].astype(str)
 
     #  member_df，手机号有重复，只保留"会员号"数值最大的那一条
     member_df = member_df.sort_values("会员号", ascending=False).drop_duplicates(subset=["手机号"], keep="first")
@@ -129,6 +157,12 @@ def load_and_prepare_data(catering_file, space_file, member_file, product_file,
         space_df.to_sql("Space", conn, if_exists="replace", index=True)
         member_df.to_sql("Member", conn, if_exists="replace", index=True)
         product_df.to_sql("Product", conn, if_exists="replace", index=True)
+        ideapod_catering.write_product_summaries(conn)
+        ideapod_customer.update_identity(conn)
+        ideapod_hll.write_sketches(conn)
+        ideapod_remark.ensure_rules(conn)
+        ideapod_remark.write_remark_index(conn)
+        ideapod_db.create_indexes(conn)
 
         print("数据已成功导入到 SQLite 数据库并完成清理！")
     finally:
@@ -142,8 +176,8 @@ def main():
     product_file = "db/ideapod_product.csv"
     database_path = "db/ideapod.db"
 
-    # 加载和准备数据
-    load_and_prepare_data(catering_file, space_file, member_file, product_file, database_path)
+    # 加载和准备数据，各门店的订单在全部核上并行清洗
+    load_and_prepare_data(catering_file, space_file, member_file, product_file, database_path, jobs=os.cpu_count())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+# 预测参数：用最近 history_weeks 个完整周拟合（有数据的完整周不足 min_history_weeks 的序列不预测），
+# 预测之后 horizon_weeks 周，区间为 预测值 ± interval_z * 周残差标准差（1.2816 对应 80% 区间）
+FORECAST_PARAMS = {'history_weeks': 26, 'min_history_weeks': 2, 'horizon_weeks': 8, 'interval_z': 1.2816}
+# 订单周为周二至周一（W-MON），预测周与之对齐
+WEEK_FREQ = 'W-MON'
+HOURS_PER_WEEK = 168
+
+def history_range(last_day: pd.Timestamp, history_weeks: int, first_day: pd.Timestamp = None) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    拟合使用的完整周：最多 history_weeks 周，最后一天所在的周未结束时不计入；
+    给定第一天（最早有数据的一天）时不早于它，其所在的周不完整时也不计入
+    返回 (第一周的开始, 最后一周结束后的一天)，没有完整周时两者相同
+    """
+    week = pd.Timestamp(last_day).to_period(WEEK_FREQ)
+    if pd.Timestamp(last_day).normalize() < week.end_time.normalize():
+        week -= 1
+    end = (week + 1).start_time
+    start = end - pd.Timedelta(weeks=history_weeks)
+    if first_day is not None:
+        start = min(max(start, first_full_week(first_day)), end)
+    return start, end
+
+def first_full_week(first_day: pd.Timestamp) -> pd.Timestamp:
+    """从 first_day 起第一个完整周的开始：first_day 不是周的第一天时为下一周"""
+    week = pd.Timestamp(first_day).to_period(WEEK_FREQ)
+    if pd.Timestamp(first_day).normalize() > week.start_time:
+        week += 1
+    return week.start_time
+
+def seasonal_forecast(series: np.ndarray, steps_per_week: int, params: Dict = FORECAST_PARAMS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    series: (T, S) 从某周开始连续 T 步（T 为 steps_per_week 的整数倍）的 S 条序列
+    每条序列拟合 周内位置（星期 × 小时或星期）的季节项 + 线性趋势，所有序列共用同一个设计矩阵，
+    一次最小二乘同时求解全部系数
+    返回 (各预测周的合计 (H, S), 周残差标准差 (S,))
+    """
+    steps, n_series = series.shape
+    n_weeks = steps // steps_per_week
+    horizon = params['horizon_weeks'] * steps_per_week
+    t = np.arange(steps + horizon)
+    trend = (t - (steps - 1) / 2) / steps_per_week
+    design = np.zeros((len(t), steps_per_week + 1))
+    design[t, t % steps_per_week] = 1
+    design[:, -1] = trend
+
+    coef, *_ = np.linalg.lstsq(design[:steps], series, rcond=None)
+    fitted = design @ coef
+    forecast = fitted[steps:].reshape(params['horizon_weeks'], steps_per_week, n_series).sum(axis=1)
+
+    # 以周合计的残差估计波动：季节项使残差总和为 0，再扣除趋势一个自由度
+    residual = (series - fitted[:steps]).reshape(n_weeks, steps_per_week, n_series).sum(axis=1)
+    sigma = np.sqrt((residual ** 2).sum(axis=0) / max(n_weeks - 2, 1))
+    return forecast, sigma
+
+def forecast_table(series: np.ndarray, names: pd.Index, first_week: pd.Timestamp, steps_per_week: int,
+                   name_col: str, params: Dict = FORECAST_PARAMS, non_negative: bool = False,
+                   start_weeks: np.ndarray = None) -> pd.DataFrame:
+    """
+    各序列的周度预测表：(name_col, 预测周, 预测值, 下限, 上限)，按序列、预测周排序
+    start_weeks: 各序列第一个有数据的完整周（从 series 开始计的周数），之前的部分不参与拟合（不按 0 计）；
+    起始周相同的序列共用设计矩阵一次求解，有数据的完整周不足 min_history_weeks 的序列不预测
+    """
+    n_weeks = len(series) // steps_per_week
+    start_weeks = np.zeros(series.shape[1], dtype=np.int64) if start_weeks is None else np.asarray(start_weeks)
+    horizon = params['horizon_weeks']
+    weeks = pd.date_range(first_week, periods=horizon, freq='7D').strftime('%Y-%m-%d')
+    names = np.asarray(names, dtype=object)
+    parts = []
+    for start in np.unique(start_weeks):
+        if n_weeks - start < params['min_history_weeks']:
+            continue
+        columns = np.flatnonzero(start_weeks == start)
+        forecast, sigma = seasonal_forecast(series[start * steps_per_week:, columns], steps_per_week, params)
+        width = params['interval_z'] * sigma
+        lower, upper = forecast - width, forecast + width
+        if non_negative:
+            forecast, lower, upper = (np.maximum(a, 0) for a in (forecast, lower, upper))
+        parts.append(pd.DataFrame({
+            '序列': np.repeat(columns, horizon),
+            name_col: np.repeat(names[columns], horizon),
+            '预测周': np.tile(weeks, len(columns)),
+            '预测值': forecast.T.ravel(),
+            '下限': lower.T.ravel(),
+            '上限': upper.T.ravel()
+        }))
+    if not parts:
+        return pd.DataFrame({name_col: pd.Series(dtype=object), '预测周': pd.Series(dtype=object),
+                             **{col: pd.Series(dtype=float) for col in ('预测值', '下限', '上限')}})
+    table = pd.concat(parts, ignore_index=True).sort_values(['序列', '预测周'], kind='stable')
+    return table.drop(columns='序列').reset_index(drop=True)
+
+def start_week_offsets(first_days, origin: pd.Timestamp) -> np.ndarray:
+    """各序列（最早有数据的一天）第一个完整周距 origin（拟合第一周的开始）的周数，不小于 0"""
+    return np.array([max((first_full_week(day) - origin) // pd.Timedelta(weeks=1), 0) for day in first_days], dtype=np.int64)
+
+def hourly_usage(keys: np.ndarray, starts: pd.Series, ends: pd.Series, origin: pd.Timestamp, n_hours: int, n_keys: int) -> np.ndarray:
+    """
+    keys: 每个订单的序列编号；返回 (n_hours, n_keys) 从 origin 起每个整点各序列的使用小时数
+    每个订单展开为它覆盖的整点，按与整点的重叠时长累加，超出范围的部分不计
+    """
+    start_hours = ((starts - origin) / pd.Timedelta(hours=1)).to_numpy(dtype=float)
+    end_hours = ((ends - origin) / pd.Timedelta(hours=1)).to_numpy(dtype=float)
+    start_hours, end_hours = np.clip(start_hours, 0, n_hours), np.clip(end_hours, 0, n_hours)
+    valid = ~np.isnan(start_hours) & ~np.isnan(end_hours) & (end_hours > start_hours)
+    keys, start_hours, end_hours = keys[valid], start_hours[valid], end_hours[valid]
+
+    first = np.floor(start_hours).astype(np.int64)
+    counts = np.ceil(end_hours).astype(np.int64) - first
+    position = np.repeat(np.arange(len(first)), counts)
+    hour = first[position] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    overlap = np.minimum(end_hours[position], hour + 1) - np.maximum(start_hours[position], hour)
+
+    usage = np.zeros(n_hours * n_keys)
+    np.add.at(usage, hour * n_keys + keys[position], overlap)
+    return usage.reshape(n_hours, n_keys)
@@ -1,10 +1,17 @@
-import json
 import sqlite3
 from collections import defaultdict
-import datetime
 import pandas as pd
 import logging
 import numpy as np
+from typing import Dict, Tuple
+import ideapod_anomaly
+import ideapod_customer
+import ideapod_db
+import ideapod_forecast
+import ideapod_hll
+import ideapod_interval
+import ideapod_kpi
+import ideapod_remark
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,6 +21,17 @@ logging.basicConfig(
     ]
 )
 
+# 环比起算日期：该日期及之前各周的周环比、月环比记为 0
+CUTOFF_DATES = {'space': '2024-04-30', 'catering': '2023-11-06'}
+# 环比按过去四周的滚动合计计算，各业务线使用的周度收入列和输出名称
+TRAILING_WEEKS = 4
+TRAILING_METRICS = {'space': '场景收入', 'catering': '餐饮收入'}
+LINE_NAMES = {'space': '场景', 'catering': '餐饮'}
+# 书玉提供的智能货柜、最福利餐饮收入（按日），与日度账本合并
+EXTERNAL_DATA_FILE = 'db/shuyu_data.csv'
+# 不计入收入的餐饮商品（押金和尾款）
+NON_REVENUE_ITEMS = '押金|尾款'
+
 def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
     """Central datetime preprocessing to reduce redundant operations"""
     datetime_columns = [
@@ -29,59 +47,50 @@ def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
                     logging.error(f"[Group] 转换 {col} 列时出错：{e}")
     return df
 
-def convert_df_to_dict(data):
-    """Convert pandas DataFrame objects to dictionaries suitable for JSON serialization."""
-    if isinstance(data, pd.DataFrame):
-        df = data.copy()
-        # 处理时间类型列
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]) or pd.api.types.is_period_dtype(df[col]):
-                df[col] = df[col].astype(str)
-        # 处理时间类型的索引
-        if pd.api.types.is_datetime64_any_dtype(df.index) or pd.api.types.is_period_dtype(df.index):
-            df.index = df.index.astype(str)
-        # 将 NaN 替换为 None，确保 JSON 中为 null
-        return df.replace({np.nan: None}).to_dict(orient='records')
-    elif isinstance(data, dict):
-        return {k: convert_df_to_dict(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_df_to_dict(item) for item in data]
-    elif isinstance(data, (pd.Timestamp, pd.Period, datetime.date)) or pd.isna(data):
-        return str(data) if not pd.isna(data) else None
-    return data
-
-def analyze_finance(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> dict:
-    """周度和日度财务分析"""
+# 日度账本的部分聚合合并规则：同一天的各项收入相加
+FINANCE_MERGE = {'daily': {col: 'sum' for col in [
+    '吧台实收', '吧台活动收入', '场景毛收入', '场景收入_吧台', '场景实收_non_flipos',
+    '场景收入_月结', '场景收入_最福利', '场景收入_大众点评', '场景收入_活动']}}
+
+def analyze_finance(space_df: pd.DataFrame, catering_df: pd.DataFrame, categories: pd.DataFrame = None) -> dict:
+    """
+    周度和日度财务分析
+    categories: 备注索引按关键词规则查出的订单类别（ideapod_remark.classify），用于识别活动收入
+    """
+    return finance_tables(finance_partial(space_df, catering_df, categories))
+
+def finance_partial(space_df: pd.DataFrame, catering_df: pd.DataFrame, categories: pd.DataFrame = None) -> Dict[str, pd.DataFrame]:
+    """日度账本的部分聚合：各天吧台和场景的各项收入，以订单日为索引，可按 FINANCE_MERGE 合并"""
     
     # 过滤掉押金和尾款数据
     original_len = len(catering_df)
-    catering_df = catering_df[~catering_df['商品'].str.contains('押金|尾款', na=False)]
+    catering_df = catering_df[~catering_df['商品'].str.contains(NON_REVENUE_ITEMS, na=False)]
     filtered_count = original_len - len(catering_df)
     logging.info(f"[Group] 已过滤掉 {filtered_count} 条押金和尾款数据")
     
-    def categorize_incomes(row):
-        payment_method = row['支付方式2']  # 已经是映射后的字符串
-        remark = str(row.get('订单备注', '')).lower()  # 拍摄仍需检查备注 
-        space_non_flipos_sales = row['场景实收_non_flipos']
-        space_flipos_sales = row['场景实收_flipos']
+    def categorize_incomes(space_df: pd.DataFrame) -> pd.DataFrame:
+        payment_method = space_df['支付方式2']  # 已经是映射后的字符串
+        event = ideapod_remark.category_flags(space_df, 'Space', '场景活动', categories)  # 拍摄、戴老师活动等按备注识别
+        space_non_flipos_sales = space_df['场景实收_non_flipos']
+        space_flipos_sales = space_df['场景实收_flipos']
         
-        space_monthly_settlement_revenue = space_non_flipos_sales if payment_method == '月结' else 0
-        space_welfare_revenue = space_non_flipos_sales if payment_method == '最福利积分' else 0
-        space_dianping_revenue = space_non_flipos_sales if payment_method == '大众点评' else 0
-        space_event_revenue = space_flipos_sales if '拍摄' in remark or '戴老师活动' in remark else 0 # 特殊处理戴老师活动订单
-        return space_monthly_settlement_revenue, space_welfare_revenue, space_dianping_revenue, space_event_revenue
+        return pd.DataFrame({
+            '月结收入': space_non_flipos_sales.where(payment_method == '月结', 0),
+            '最福利场景收入': space_non_flipos_sales.where(payment_method == '最福利积分', 0),
+            '大众点评收入': space_non_flipos_sales.where(payment_method == '大众点评', 0),
+            '场景活动收入': space_flipos_sales.where(event, 0)
+        }, index=space_df.index)
 
     # Daily analysis
-    daily_catering = catering_df.groupby('订单日').agg(
+    bar_event = ideapod_remark.category_flags(catering_df, 'Catering', '吧台活动', categories)
+    daily_catering = catering_df.assign(吧台活动收入=catering_df['实收'].where(bar_event, 0)).groupby('订单日').agg(
         吧台实收=('实收', 'sum'),
-        吧台活动收入=('实收', lambda x: x[catering_df.loc[x.index, '商品'].str.contains('拍摄|包场', na=False)].sum())
+        吧台活动收入=('吧台活动收入', 'sum')
     ).reset_index()
     
     daily_space = space_df.copy()
     # Apply categorization for all conditions
-    daily_space[['月结收入', '最福利场景收入', '大众点评收入', '场景活动收入']] = daily_space.apply(
-        lambda row: pd.Series(categorize_incomes(row)), axis=1
-    )
+    daily_space[['月结收入', '最福利场景收入', '大众点评收入', '场景活动收入']] = categorize_incomes(daily_space)
     
     # Aggregate daily data
     daily_categorized = daily_space.groupby('订单日').agg({
@@ -98,10 +107,15 @@ def analyze_finance(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> dict:
                                 '场景收入_月结', '场景收入_最福利', '场景收入_大众点评', '场景收入_活动']
     
     daily_data = daily_catering.merge(daily_categorized, on='订单日', how='outer').fillna(0)
-    
+    return {'daily': daily_data.set_index('订单日')}
+
+def finance_tables(partial: Dict[str, pd.DataFrame]) -> dict:
+    """由（合并后的）日度账本加上外部数据，生成周度和日度财务表"""
+    daily_data = partial['daily'].reset_index()
+
     # 读取书玉的数据并合并到 daily_data
     try:
-        external_data = pd.read_csv('db/shuyu_data.csv')
+        external_data = pd.read_csv(EXTERNAL_DATA_FILE)
         # 确保日期格式一致
         external_data['日期'] = pd.to_datetime(external_data['日期'], format='%m/%d/%y', errors='coerce')
         daily_data['订单日'] = pd.to_datetime(daily_data['订单日'], errors='coerce')
@@ -137,14 +151,13 @@ def analyze_finance(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> dict:
     
     daily_result = daily_data[['订单日', '餐饮收入', '场景收入', '吧台实收', '餐饮收入_吧台', '场景收入_吧台',
                             '场景实收_non_flipos', '场景收入_大众点评', '场景收入_月结', '餐饮收入_智能货柜', 
-                            '餐饮收入_最福利', '场景收入_最福利', '活动收入']].to_dict(orient='records')
+                            '餐饮收入_最福利', '场景收入_最福利', '活动收入']]
 
     # Weekly analysis
     # 从 daily_data 中提取需要加总的列，并按 '订单周' 分组
     weekly_data = daily_data.copy()
-    weekly_data['订单周'] = pd.to_datetime(weekly_data['订单日'], errors='coerce').dt.to_period('W-MON').apply(
-        lambda x: x.start_time.date() if pd.notna(x) else None
-    )
+    # 与 prepare_data 相同按各周的开始日期标记（空表时也是日期列而不是周期列）
+    weekly_data['订单周'] = pd.to_datetime(weekly_data['订单日'], errors='coerce').dt.to_period('W-MON').dt.start_time.dt.date
     
     weekly_data = weekly_data.dropna(subset=['订单周'])
     
@@ -166,61 +179,19 @@ def analyze_finance(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> dict:
     
     weekly_result = weekly_data[['订单周', '餐饮收入', '场景收入', '吧台实收', '餐饮收入_吧台', '场景收入_吧台',
                             '场景实收_non_flipos', '场景收入_大众点评', '场景收入_月结', '餐饮收入_智能货柜', 
-                            '餐饮收入_最福利', '场景收入_最福利', '活动收入']].to_dict(orient='records')
-    
-    # Fixed: Using datetime.datetime instead of just datetime
-    cutoff_date_space = datetime.datetime.strptime("2024-04-30", "%Y-%m-%d")
-    cutoff_date_catering = datetime.datetime.strptime("2023-11-06", "%Y-%m-%d")    
+                            '餐饮收入_最福利', '场景收入_最福利', '活动收入']]
     
-    # Trailing 4 weeks analysis
-    trailing_data = []
-    for i in range(len(weekly_result)):
-        space_trailing_4 = sum(d['场景收入'] for d in weekly_result[max(0, i-3):i+1])
-        catering_trailing_4 = sum(d['餐饮收入'] for d in weekly_result[max(0, i-3):i+1])
-        
-        week_trailing = {
-            "周": str(weekly_result[i]['订单周']),
-            "场景_trailing_4_week收入": space_trailing_4,
-            "餐饮_trailing_4_week收入": catering_trailing_4
-        }
-
-        # Fixed: Using datetime.datetime instead of just datetime
-        week_date = datetime.datetime.strptime(week_trailing["周"], "%Y-%m-%d")
-        
-        # WoW calculation
-        if i > 0:
-            prev_space = trailing_data[i-1]["场景_trailing_4_week收入"]
-            prev_catering = trailing_data[i-1]["餐饮_trailing_4_week收入"]
-            
-            # Avoid division by zero
-            space_wow = (space_trailing_4 / prev_space - 1) * 100 if prev_space != 0 else 0
-            week_trailing["场景_wow"] = 0 if week_date <= cutoff_date_space else space_wow
-            
-            catering_wow = (catering_trailing_4 / prev_catering - 1) * 100 if prev_catering != 0 else 0
-            week_trailing["餐饮_wow"] = 0 if week_date <= cutoff_date_catering else catering_wow
-        else:
-            week_trailing["场景_wow"] = 0
-            week_trailing["餐饮_wow"] = 0
-        
-        # MoM calculation
-        if i >= 4:
-            prev_4_space = trailing_data[i-4]["场景_trailing_4_week收入"]
-            prev_4_catering = trailing_data[i-4]["餐饮_trailing_4_week收入"]
-            
-            # Avoid division by zero
-            space_mom = (space_trailing_4 / prev_4_space - 1) * 100 if prev_4_space != 0 else 0
-            week_trailing["场景_mom"] = 0 if week_date <= cutoff_date_space else space_mom
-            
-            catering_mom = (catering_trailing_4 / prev_4_catering - 1) * 100 if prev_4_catering != 0 else 0
-            week_trailing["餐饮_mom"] = 0 if week_date <= cutoff_date_catering else catering_mom
-        else:
-            week_trailing["场景_mom"] = 0
-            week_trailing["餐饮_mom"] = 0
-        
-        trailing_data.append(week_trailing)
-    
-    wow_result = [{"周": w["周"], "场景周环比": w["场景_wow"], "餐饮周环比": w["餐饮_wow"]} for w in trailing_data]
-    mom_result = [{"周": w["周"], "场景月环比": w["场景_mom"], "餐饮月环比": w["餐饮_mom"]} for w in trailing_data]
+    # 过去四周滚动合计的周环比、月环比
+    trailing_df = ideapod_kpi.rolling_kpis(
+        weekly_result, '订单周', TRAILING_METRICS, windows=(TRAILING_WEEKS,),
+        comparisons={'wow': 1, 'mom': TRAILING_WEEKS}, cutoffs=CUTOFF_DATES
+    )
+    week_labels = weekly_result['订单周'].astype(str)
+    wow_result = pd.DataFrame({'周': week_labels})
+    mom_result = pd.DataFrame({'周': week_labels})
+    for line, name in LINE_NAMES.items():
+        wow_result[f'{name}周环比'] = trailing_df[f'{line}_trailing_{TRAILING_WEEKS}_wow']
+        mom_result[f'{name}月环比'] = trailing_df[f'{line}_trailing_{TRAILING_WEEKS}_mom']
 
     # Output structure
     output_data = {
@@ -232,35 +203,296 @@ def analyze_finance(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> dict:
 
     return {'集团财务': output_data}
 
-def analyze(conn):
-    """主分析函数"""
+def data_as_of(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> pd.Timestamp:
+    """数据截止时间：最晚的餐饮下单时间和场景订单创建时间（场景按预定开始时间入账，可能晚于截止时间）"""
+    return pd.Series([catering_df['下单时间'].max(), space_df['创建时间'].max()], dtype='datetime64[ns]').max()
+
+def analyze_revenue_anomaly(finance: Dict[str, pd.DataFrame], state_file: str = ideapod_anomaly.STATE_FILE,
+                            as_of: pd.Timestamp = None) -> Dict[str, pd.DataFrame]:
+    """
+    日度、周度收入账本的异常检测：各收入指标与之前同星期（周度为之前各周）的稳健 z 分数，
+    以及没有任何收入的缺失日。state_file 为 None 时不使用上次的检测状态；
+    as_of 为数据截止时间（data_as_of），尚未结束的当天、当周不检测
+    """
+    anomalies = ideapod_anomaly.detect_ledgers({
+        'daily': (finance['日度销售收入_table'], '订单日'),
+        'weekly': (finance['周度销售收入_stacked'], '订单周')
+    }, state_file, as_of)
+    return {
+        '日度收入异常_table': anomalies['daily'],
+        '周度收入异常_table': anomalies['weekly'].drop(columns='星期')
+    }
+
+def analyze_forecast(space_df: pd.DataFrame, finance: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    未来几周的预测：各空间（订单商品名）的使用时长和收入按 星期 × 小时 季节项 + 趋势拟合，
+    日度账本的各收入指标按 星期 季节项 + 趋势拟合，各自所有序列一次求解
+    """
+    params = ideapod_forecast.FORECAST_PARAMS
+    results = {}
+
+    # 各空间：从订单展开为每小时的使用时长，收入计入开始使用的整点
+    orders = space_df.dropna(subset=['预定开始时间', '预定结束时间', '订单商品名'])
+    pod_columns = ['订单商品名', '预测周', '使用时长', '使用时长_下限', '使用时长_上限', '收入', '收入_下限', '收入_上限']
+    if orders.empty:
+        results['各空间使用预测_table'] = pd.DataFrame(columns=pod_columns)
+    else:
+        first, end = ideapod_forecast.history_range(orders['预定开始时间'].max(), params['history_weeks'],
+                                                    orders['预定开始时间'].min())
+        # 各空间从自己第一个有预订的完整周开始拟合，之前的周不按 0 计
+        pod_first_days = orders.groupby('订单商品名')['预定开始时间'].min()
+        orders = orders[(orders['预定结束时间'] > first) & (orders['预定开始时间'] < end)]
+        keys, pods = pd.factorize(orders['订单商品名'], sort=True)
+        offsets = ideapod_forecast.start_week_offsets(pod_first_days.reindex(pods), first)
+        n_hours = (end - first) // pd.Timedelta(hours=1)
+        usage = ideapod_forecast.hourly_usage(keys, orders['预定开始时间'], orders['预定结束时间'], first, n_hours, len(pods))
+        revenue = np.zeros((n_hours, len(pods)))
+        start_hour = ((orders['预定开始时间'] - first) // pd.Timedelta(hours=1)).to_numpy()
+        in_range = start_hour >= 0
+        np.add.at(revenue, (start_hour[in_range], keys[in_range]), orders['实付金额'].fillna(0).to_numpy()[in_range])
+
+        names = pd.Index(pods).append(pd.Index(pods))
+        table = ideapod_forecast.forecast_table(np.hstack([usage, revenue]), names, end, ideapod_forecast.HOURS_PER_WEEK,
+                                                '订单商品名', params, non_negative=True, start_weeks=np.tile(offsets, 2))
+        usage_table, revenue_table = table.iloc[:len(table) // 2], table.iloc[len(table) // 2:]
+        pod_table = usage_table.rename(columns={'预测值': '使用时长', '下限': '使用时长_下限', '上限': '使用时长_上限'})
+        pod_table[['收入', '收入_下限', '收入_上限']] = revenue_table[['预测值', '下限', '上限']].to_numpy()
+        results['各空间使用预测_table'] = pod_table[pod_columns]
+
+    # 日度账本的各收入指标，从账本第一个完整周开始，其间缺失的日期按 0 计
+    ledger = finance['日度销售收入_table']
+    ledger = ledger.assign(订单日=pd.to_datetime(ledger['订单日'])).set_index('订单日').sort_index()
+    if ledger.empty:
+        results['收入指标预测_table'] = pd.DataFrame(columns=['指标', '预测周', '预测值', '下限', '上限'])
+    else:
+        first, end = ideapod_forecast.history_range(ledger.index.max(), params['history_weeks'], ledger.index.min())
+        daily = ledger.reindex(pd.date_range(first, end - pd.Timedelta(days=1), freq='D')).fillna(0)
+        results['收入指标预测_table'] = ideapod_forecast.forecast_table(
+            daily.to_numpy(dtype=float), daily.columns, end, 7, '指标', params)
+
+    return results
+
+# 活跃客户数的汇总粒度: (周期, 期间列名, 结果名)
+ACTIVE_USER_PERIODS = [
+    ('W-MON', '订单周', '周活跃客户数_line'),
+    ('M', '订单月', '月活跃客户数_line'),
+    ('Q', '季度', '季度活跃客户数_bar')
+]
+
+def analyze_active_users(sketches: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    各业务线及全业务的去重活跃客户数，由每日 HyperLogLog 草图合并估计（相对标准误差约 1.6%），
+    另按会员等级统计各季度全业务的活跃客户数
+    """
+    line_columns = [ideapod_hll.LINES['space'], ideapod_hll.LINES['catering'], ideapod_hll.ALL_LINES]
+    results = {}
+    for freq, period_col, key in ACTIVE_USER_PERIODS:
+        counts = ideapod_hll.distinct_counts(sketches, freq)
+        table = counts.pivot(index='期间', columns='业务', values='客户数').reindex(columns=line_columns)
+        results[key] = table.fillna(0).rename_axis(index=period_col, columns=None).reset_index()
+    levels = ideapod_hll.distinct_counts(sketches, 'Q', by_level=True)
+    levels = levels[levels['业务'] == ideapod_hll.ALL_LINES]
+    results['各等级季度活跃客户数_stacked'] = levels.pivot(index='期间', columns='等级', values='客户数') \
+        .fillna(0).rename_axis(index='季度', columns=None).reset_index()
+    return results
+
+def customer_keys(space_df: pd.DataFrame, catering_df: pd.DataFrame, identity: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    两条业务线订单的客户编号（客户维度表 ideapod_customer.read_identity），查不到时为 -1
+    场景订单按手机号对应客户，没有手机号时用会员号；餐饮订单按会员号
+    """
+    space_keys = ideapod_customer.customer_keys(identity, '手机号', space_df['手机号'])
+    if '会员号' in space_df.columns:
+        space_keys = np.where(space_keys >= 0, space_keys, ideapod_customer.customer_keys(identity, '会员号', space_df['会员号']))
+    return space_keys, ideapod_customer.customer_keys(identity, '会员号', catering_df['会员号'])
+
+def analyze_pod_dining(space_df: pd.DataFrame, catering_df: pd.DataFrame, identity: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    在舱餐饮消费：餐饮订单和空间预订都对应到客户编号，下单时间落在同一客户某个空间预订
+    [预定开始时间, 预定结束时间] 内的记为在舱订单，计入该预订
+    """
+    catering_df = catering_df[~catering_df['商品'].str.contains(NON_REVENUE_ITEMS, na=False)]
+    space_keys, catering_keys = customer_keys(space_df, catering_df, identity)
+    # 查不到客户的订单和预订不参与匹配
+    booking = ideapod_interval.interval_join(
+        pd.Series(catering_keys, dtype=float).where(catering_keys >= 0), catering_df['下单时间'],
+        pd.Series(space_keys, dtype=float).where(space_keys >= 0), space_df['预定开始时间'], space_df['预定结束时间']
+    )
+    in_pod = booking >= 0
+    revenue = pd.to_numeric(catering_df['实收'], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+    # 订单口径：按下单月份
+    orders = pd.DataFrame({
+        '订单月': catering_df['订单月'].to_numpy(),
+        '餐饮订单数': 1,
+        '在舱订单数': in_pod.astype(int),
+        '餐饮收入': revenue,
+        '在舱餐饮收入': np.where(in_pod, revenue, 0)
+    }).groupby('订单月').sum()
+
+    # 预订口径：按预订开始的月份和空间，在舱订单计入对应的预订
+    booking_spend = np.bincount(booking[in_pod], weights=revenue[in_pod], minlength=len(space_df))
+    booking_orders = np.bincount(booking[in_pod], minlength=len(space_df))
+    bookings = pd.DataFrame({
+        '订单月': space_df['订单月'].to_numpy(),
+        '订单商品名': space_df['订单商品名'].to_numpy(),
+        '预订数': 1,
+        '有餐饮消费的预订数': (booking_orders > 0).astype(int),
+        '在舱餐饮收入': booking_spend
+    })
+
+    def booking_metrics(table: pd.DataFrame) -> pd.DataFrame:
+        table['预订餐饮渗透率(%)'] = table['有餐饮消费的预订数'] / table['预订数'] * 100
+        table['每预订餐饮消费'] = table['在舱餐饮收入'] / table['预订数']
+        table['有消费预订的单均餐饮消费'] = (table['在舱餐饮收入'] / table['有餐饮消费的预订数'].replace(0, np.nan)).fillna(0)
+        return table.drop(columns='在舱餐饮收入')
+
+    monthly_bookings = booking_metrics(bookings.groupby('订单月')[['预订数', '有餐饮消费的预订数', '在舱餐饮收入']].sum())
+    monthly = orders.join(monthly_bookings, how='outer').fillna(0)
+    count_columns = ['餐饮订单数', '在舱订单数', '预订数', '有餐饮消费的预订数']
+    monthly[count_columns] = monthly[count_columns].astype(int)
+    monthly['在舱订单占比(%)'] = (monthly['在舱订单数'] / monthly['餐饮订单数'].replace(0, np.nan) * 100).fillna(0)
+    monthly['在舱收入占比(%)'] = (monthly['在舱餐饮收入'] / monthly['餐饮收入'].replace(0, np.nan) * 100).fillna(0)
+    monthly = monthly.reset_index()
+    monthly['订单月'] = monthly['订单月'].astype(str)
+    monthly = monthly[['订单月', '餐饮订单数', '在舱订单数', '在舱订单占比(%)', '餐饮收入', '在舱餐饮收入', '在舱收入占比(%)',
+                       '预订数', '有餐饮消费的预订数', '预订餐饮渗透率(%)', '每预订餐饮消费', '有消费预订的单均餐饮消费']]
+
+    by_space = bookings.groupby('订单商品名')[['预订数', '有餐饮消费的预订数', '在舱餐饮收入']].sum()
+    by_space = booking_metrics(by_space).reset_index()
+
+    return {
+        '在舱餐饮消费_table': monthly,
+        '各空间在舱餐饮消费_bar': by_space
+    }
+
+def analyze_cohort_ltv(space_df: pd.DataFrame, catering_df: pd.DataFrame, identity: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    客户生命周期价值：按首次消费月份分组（同期群），统计距首次消费第 N 个月时每位客户的累计收入
+    客户按客户维度表（ideapod_customer.read_identity）统一为客户编号，场景、餐饮各自按本业务线的首次消费分组，全业务按两条业务线中最早的一次
+    同期群 × 月龄矩阵由一次 bincount 得到，尚未到达的月龄为空
+    """
+    catering_df = catering_df[~catering_df['商品'].str.contains(NON_REVENUE_ITEMS, na=False)]
+    space_keys, catering_keys = customer_keys(space_df, catering_df, identity)
+
+    times = pd.concat([space_df['预定开始时间'], catering_df['下单时间']], ignore_index=True)
+    customers = np.concatenate([space_keys, catering_keys])
+    lines = np.repeat([0, 1], [len(space_df), len(catering_df)])
+    # 未选中的业务线为空表，列为 object 类型，金额统一转为浮点数
+    revenue = np.concatenate([pd.to_numeric(space_df['实付金额'], errors='coerce').fillna(0).to_numpy(dtype=float),
+                              pd.to_numeric(catering_df['实收'], errors='coerce').fillna(0).to_numpy(dtype=float)])
+    valid = (customers >= 0) & times.notna().to_numpy()
+    line_names = [LINE_NAMES['space'], LINE_NAMES['catering'], '全业务']
+    if not valid.any():
+        results = {f'{name}客户累计LTV_line': pd.DataFrame({'月龄': []}) for name in line_names}
+        results['各业务新客数_bar'] = pd.DataFrame({'首次消费月': [], **{name: [] for name in line_names}})
+        results['全业务同期群收入构成_stacked'] = pd.DataFrame(
+            {'首次消费月': [], f"{LINE_NAMES['space']}收入": [], f"{LINE_NAMES['catering']}收入": []})
+        return results
+
+    month = (times.dt.year * 12 + times.dt.month - 1).to_numpy()[valid].astype(np.int64)
+    customers, lines, revenue = customers[valid], lines[valid], revenue[valid]
+    first_month = month.min()
+    n_months = month.max() - first_month + 1
+    month = month - first_month
+
+    # 每笔订单按所在业务线和全业务各计一次：(业务线, 客户) 的首次消费月份即同期群
+    line = np.concatenate([lines, np.full(len(lines), 2)])
+    customer = np.concatenate([customers, customers])
+    month = np.concatenate([month, month])
+    amount = np.concatenate([revenue, revenue])
+    key = customer * 3 + line
+    cohort = pd.Series(month).groupby(key).transform('min').to_numpy()
+    age = month - cohort
+
+    cells = (line * n_months + cohort) * n_months + age
+    ltv = np.bincount(cells, weights=amount, minlength=3 * n_months * n_months).reshape(3, n_months, n_months).cumsum(axis=2)
+    first_orders = np.unique(key, return_index=True)[1]
+    sizes = np.bincount(line[first_orders] * n_months + cohort[first_orders], minlength=3 * n_months).reshape(3, n_months)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ltv = ltv / sizes[:, :, None]
+    # 同期群月份 + 月龄超过最后一个月的尚未观察到
+    ltv[:, np.add.outer(np.arange(n_months), np.arange(n_months)) >= n_months] = np.nan
+
+    start = pd.Period(year=int(first_month // 12), month=int(first_month % 12) + 1, freq='M')
+    month_labels = pd.period_range(start, periods=n_months, freq='M').astype(str)
+    age_labels = [f'第{i}月' for i in range(n_months)]
+    results = {}
+    for i, name in enumerate(line_names):
+        present = sizes[i] > 0
+        table = pd.DataFrame(ltv[i][present].T, columns=month_labels[present])
+        table.insert(0, '月龄', age_labels)
+        results[f'{name}客户累计LTV_line'] = table
+
+    results['各业务新客数_bar'] = pd.DataFrame({'首次消费月': month_labels, **dict(zip(line_names, sizes))})
+    # 全业务同期群至今的累计收入中各业务线的构成（后一半即按全业务计的订单，顺序与原订单相同）
+    all_rows = line == 2
+    composition = np.bincount(cohort[all_rows] * 2 + lines, weights=amount[all_rows], minlength=2 * n_months).reshape(n_months, 2)
+    present = sizes[2] > 0
+    results['全业务同期群收入构成_stacked'] = pd.DataFrame({
+        '首次消费月': month_labels[present],
+        f"{LINE_NAMES['space']}收入": composition[present, 0],
+        f"{LINE_NAMES['catering']}收入": composition[present, 1]
+    })
+    return results
+
+def prepare_data(space_df: pd.DataFrame, catering_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """预处理时间列，剔除未支付的空间订单，并添加订单月、订单周、订单日"""
+    # Preprocess datetime
+    catering_df = preprocess_datetime(catering_df)
+    space_df = preprocess_datetime(space_df)
+    
+    # 剔除支付时间为 NA 的记录
+    space_df = space_df[~space_df['支付时间'].isna()]
+    
+    # Add date columns
+    catering_df['订单月'] = catering_df['下单时间'].dt.to_period('M')
+    catering_df['订单周'] = catering_df['下单时间'].dt.to_period('W-MON').dt.start_time.dt.date
+    catering_df['订单日'] = catering_df['下单时间'].dt.strftime('%Y-%m-%d') 
+    space_df['订单月'] = space_df['预定开始时间'].dt.to_period('M')
+    space_df['订单周'] = space_df['预定开始时间'].dt.to_period('W-MON').dt.start_time.dt.date
+    space_df['订单日'] = space_df['预定开始时间'].dt.strftime('%Y-%m-%d') 
+    return space_df, catering_df
+
+# 集团业务线对应的数据表
+BUSINESS_LINES = {'space': 'Space', 'catering': 'Catering'}
+
+def analyze(conn, start_date=None, end_date=None, lines=None, stores=None):
+    """
+    主分析函数
+    start_date / end_date: 只分析该日期范围（含首尾）内的订单，默认全部历史
+    lines: 只计入指定业务线（'space' / 'catering'）的收入
+    stores: 只计入指定门店的收入，默认全部门店合并
+    """
     try:
-        catering_df = pd.read_sql_query("SELECT * FROM Catering", conn)
-        space_df = pd.read_sql_query("SELECT * FROM Space", conn)
+        tables = {}
+        for line, table in BUSINESS_LINES.items():
+            if lines and line not in lines:
+                # 未选中的业务线只保留表结构
+                tables[table] = pd.read_sql_query(f"SELECT * FROM {table} WHERE 0", conn)
+            else:
+                tables[table] = ideapod_db.read_table(conn, table, start_date, end_date,
+                                                      {ideapod_db.STORE_COLUMN: stores} if stores else None)
+        catering_df = tables['Catering']
+        space_df = tables['Space']
        
-        # Preprocess datetime
-        catering_df = preprocess_datetime(catering_df)
-        space_df = preprocess_datetime(space_df)
-        
-        # 剔除支付时间为 NA 的记录
-        space_df = space_df[~space_df['支付时间'].isna()]
-        
-        # Add date columns
-        catering_df['订单月'] = catering_df['下单时间'].dt.to_period('M')
-        catering_df['订单周'] = catering_df['下单时间'].dt.to_period('W-MON').apply(lambda x: x.start_time.date())
-        catering_df['订单日'] = catering_df['下单时间'].dt.strftime('%Y-%m-%d') 
-        space_df['订单月'] = space_df['预定开始时间'].dt.to_period('M')
-        space_df['订单周'] = space_df['预定开始时间'].dt.to_period('W-MON').apply(lambda x: x.start_time.date())
-        space_df['订单日'] = space_df['预定开始时间'].dt.strftime('%Y-%m-%d') 
-
-        financial_results = analyze_finance(space_df, catering_df)
-
-        # Process results for JSON serialization
-        processed_results = {}
-        for category, data in financial_results.items():
-            processed_results[category] = {key: convert_df_to_dict(value) for key, value in data.items()}
-
-        return processed_results
+        space_df, catering_df = prepare_data(space_df, catering_df)
+
+        identity = ideapod_customer.read_identity(conn)
+
+        results = analyze_finance(space_df, catering_df, ideapod_remark.classify(conn))
+        # 按日期范围、业务线或门店筛选时的账本与全量不同，不读写检测状态
+        full_history = not (start_date or end_date or lines or stores)
+        results['收入异常'] = analyze_revenue_anomaly(
+            results['集团财务'], ideapod_anomaly.STATE_FILE if full_history else None, data_as_of(space_df, catering_df))
+        results['经营预测'] = analyze_forecast(space_df, results['集团财务'])
+        # 草图表不区分门店，按门店分析时由订单直接计算
+        sketches = ideapod_hll.build_sketches(conn, start_date, end_date, lines, stores) if stores \
+            else ideapod_hll.read_sketches(conn, start_date, end_date, lines)
+        results['活跃客户'] = analyze_active_users(sketches)
+        results['在舱消费'] = analyze_pod_dining(space_df, catering_df, identity)
+        results['客户LTV'] = analyze_cohort_ltv(space_df, catering_df, identity)
+        return results
 
     except sqlite3.Error as e:
         logging.error(f"[Group] Database error: {e}")
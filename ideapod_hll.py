@@ -0,0 +1,198 @@
+import sqlite3
+import zlib
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Iterable, Optional, Tuple
+import ideapod_customer
+import ideapod_db
+
+# 每日活跃客户的 HyperLogLog 草图：每个 (日期, 业务, 等级) 一行，寄存器压缩后存为 BLOB
+# 任意日期范围、任意汇总粒度的去重客户数由草图逐寄存器取最大值合并后估计，不需要读取订单
+SKETCH_TABLE = 'UserSketch'
+# 寄存器数 2^PRECISION，相对标准误差约 1.04 / sqrt(2^PRECISION)
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+RELATIVE_ERROR = 1.04 / np.sqrt(REGISTERS)
+LINES = {'space': '场景', 'catering': '餐饮'}
+ALL_LINES = '全业务'
+UNKNOWN_LEVEL = '未注册用户'
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """uint64 的二进制位数：拆成高低 32 位，各自可精确转为浮点数，由 frexp 的指数得到"""
+    high, low = values >> np.uint64(32), values & np.uint64(0xFFFFFFFF)
+    return np.where(high > 0, np.frexp(high.astype(float))[1] + 32, np.frexp(low.astype(float))[1])
+
+def registers(groups: np.ndarray, hashes: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    按组建立草图：hashes 为每行用户的 64 位哈希，返回 (n_groups, REGISTERS) 的 uint8 寄存器
+    高 PRECISION 位选择寄存器，其余位的前导零个数 + 1 取最大值
+    """
+    index = (hashes >> np.uint64(64 - PRECISION)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - PRECISION)) - 1)
+    rank = (64 - PRECISION + 1 - _bit_length(rest)).astype(np.uint8)
+    sketch = np.zeros(n_groups * REGISTERS, dtype=np.uint8)
+    np.maximum.at(sketch, groups.astype(np.int64) * REGISTERS + index, rank)
+    return sketch.reshape(n_groups, REGISTERS)
+
+def estimate(sketches: np.ndarray) -> np.ndarray:
+    """各行草图的基数估计，基数较小（有空寄存器）时改用线性计数"""
+    sketches = np.atleast_2d(sketches)
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS ** 2 / np.exp2(-sketches.astype(float)).sum(axis=1)
+    zeros = (sketches == 0).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        linear = REGISTERS * np.log(REGISTERS / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * REGISTERS) & (zeros > 0), linear, raw)
+
+def merge(groups: np.ndarray, sketches: np.ndarray, n_groups: int) -> np.ndarray:
+    """同组的草图逐寄存器取最大值：按组排序后每组一段，用 reduceat 一次求出"""
+    merged = np.zeros((n_groups, REGISTERS), dtype=np.uint8)
+    if len(groups):
+        order = np.argsort(groups, kind='stable')
+        present, starts = np.unique(groups[order], return_index=True)
+        merged[present] = np.maximum.reduceat(sketches[order], starts, axis=0)
+    return merged
+
+def _users(identity: pd.DataFrame, id_columns: Tuple[str, ...], df: pd.DataFrame) -> pd.Series:
+    """
+    每行的用户统一为客户编号，使不同业务线的同一客户在合并后只计一次；
+    按 id_columns 的顺序依次查找，都查不到时用第一个有值的原始标识
+    """
+    users = pd.Series(None, index=df.index, dtype=object)
+    for id_type in id_columns:
+        if id_type not in df.columns:
+            continue
+        keys = ideapod_customer.customer_keys(identity, id_type, df[id_type])
+        raw = ideapod_customer.clean_ids(df[id_type])
+        users = users.fillna(pd.Series(np.where(keys >= 0, 'c' + keys.astype(str), None), index=df.index))
+        users = users.fillna(id_type + ':' + raw.dropna())
+    return users
+
+def _frame_sketches(df: pd.DataFrame, line: str, times: pd.Series, levels: pd.Series, users: pd.Series) -> pd.DataFrame:
+    valid = times.notna() & users.notna()
+    frame = pd.DataFrame({
+        '日期': times[valid].dt.strftime('%Y-%m-%d'),
+        '等级': levels[valid].fillna(UNKNOWN_LEVEL).astype(str),
+        '用户': users[valid]
+    })
+    if frame.empty:
+        return pd.DataFrame(columns=['日期', '业务', '等级', '寄存器'])
+    groups, keys = pd.factorize(pd.MultiIndex.from_frame(frame[['日期', '等级']]))
+    hashes = pd.util.hash_array(frame['用户'].to_numpy(dtype=object))
+    sketches = registers(groups, hashes, len(keys))
+    return pd.DataFrame({
+        '日期': keys.get_level_values(0),
+        '业务': line,
+        '等级': keys.get_level_values(1),
+        '寄存器': [zlib.compress(row.tobytes()) for row in sketches]
+    })
+
+def build_sketches(conn: sqlite3.Connection, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                   lines: Optional[Iterable[str]] = None, stores: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    由订单计算日期范围（含首尾）内各日的草图，列与草图表相同
+    lines / stores 给定时只计入这些业务线和门店的订单（草图表不区分门店，按门店查询时直接由订单计算）
+    """
+    identity = ideapod_customer.read_identity(conn)
+    member_levels = pd.read_sql_query('SELECT "会员号", "等级" FROM Member', conn) \
+        if {'会员号', '等级'} <= set(ideapod_db.table_columns(conn, 'Member')) else pd.DataFrame(columns=['会员号', '等级'])
+    member_levels = member_levels.assign(会员号=ideapod_customer.clean_ids(member_levels['会员号'])) \
+        .dropna(subset=['会员号']).drop_duplicates('会员号').set_index('会员号')['等级']
+
+    filters = {ideapod_db.STORE_COLUMN: list(stores)} if stores else None
+    parts = []
+    if ideapod_db.table_columns(conn, 'Space') and (not lines or 'space' in lines):
+        space_df = ideapod_db.read_table(conn, 'Space', start_date, end_date, filters)
+        space_df = space_df[space_df['支付时间'].notna()]
+        parts.append(_frame_sketches(
+            space_df, LINES['space'], pd.to_datetime(space_df['预定开始时间']),
+            space_df['等级'] if '等级' in space_df.columns else pd.Series(None, index=space_df.index),
+            _users(identity, ('手机号', '会员号'), space_df)))
+    if ideapod_db.table_columns(conn, 'Catering') and (not lines or 'catering' in lines):
+        catering_df = ideapod_db.read_table(conn, 'Catering', start_date, end_date, filters)
+        levels = ideapod_customer.clean_ids(catering_df['会员号']).map(member_levels)
+        parts.append(_frame_sketches(
+            catering_df, LINES['catering'], pd.to_datetime(catering_df['下单时间']), levels,
+            _users(identity, ('会员号',), catering_df)))
+    if not parts:
+        return pd.DataFrame(columns=['日期', '业务', '等级', '寄存器'])
+    return pd.concat(parts, ignore_index=True)
+
+def write_sketches(conn: sqlite3.Connection, start_date: Optional[date] = None) -> int:
+    """
+    重建 start_date（含）之后各日的草图，默认全部重建；在客户维度表更新之后调用
+    返回写入的草图数
+    """
+    # 草图全部算好后再建表并替换，中途出错不会留下空表
+    sketches = build_sketches(conn, start_date)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS "{SKETCH_TABLE}" (
+            "日期" TEXT NOT NULL,
+            "业务" TEXT NOT NULL,
+            "等级" TEXT NOT NULL,
+            "寄存器" BLOB NOT NULL,
+            PRIMARY KEY ("日期", "业务", "等级")
+        ) WITHOUT ROWID
+    ''')
+    if start_date is None:
+        conn.execute(f'DELETE FROM "{SKETCH_TABLE}"')
+    else:
+        conn.execute(f'DELETE FROM "{SKETCH_TABLE}" WHERE "日期" >= ?', (start_date.strftime('%Y-%m-%d'),))
+    conn.executemany(f'INSERT INTO "{SKETCH_TABLE}" VALUES (?, ?, ?, ?)', sketches.itertuples(index=False, name=None))
+    conn.commit()
+    ideapod_db.record_sources(conn, SKETCH_TABLE)
+    return len(sketches)
+
+def read_sketches(conn: sqlite3.Connection, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                  lines: Optional[Iterable[str]] = None, levels: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    读取日期范围（含首尾）、业务线（'space' / 'catering'）和等级范围内的草图；
+    草图表只在导入 / 更新时建立，不存在或与来源表不一致时报错
+    """
+    ideapod_db.check_derived(conn, SKETCH_TABLE)
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append('"日期" >= ?')
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date is not None:
+        conditions.append('"日期" <= ?')
+        params.append(end_date.strftime('%Y-%m-%d'))
+    for col, values in (('业务', [LINES[line] for line in lines] if lines else None), ('等级', levels)):
+        if values:
+            values = list(values)
+            conditions.append(f'"{col}" IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+    query = f'SELECT * FROM "{SKETCH_TABLE}"'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return pd.read_sql_query(query, conn, params=params)
+
+def distinct_counts(sketches: pd.DataFrame, freq: Optional[str] = None, by_level: bool = False) -> pd.DataFrame:
+    """
+    按 freq（pandas 周期，如 'W-MON'、'M'、'Q'；None 为整个范围）汇总的各业务线及全业务去重客户数
+    返回 (期间, [等级], 业务, 客户数, 标准误差)，标准误差 = 客户数 * RELATIVE_ERROR
+    """
+    columns = (['期间'] + (['等级'] if by_level else []) + ['业务', '客户数', '标准误差'])
+    if sketches.empty:
+        return pd.DataFrame(columns=columns)
+    dates = pd.to_datetime(sketches['日期'])
+    if not freq:
+        period = pd.Series('全部', index=sketches.index)
+    elif freq.startswith('W'):
+        # 周与订单周一致，以周的第一天表示
+        period = dates.dt.to_period(freq).dt.start_time.dt.strftime('%Y-%m-%d')
+    else:
+        period = dates.dt.to_period(freq).astype(str)
+    data = np.frombuffer(b''.join(zlib.decompress(blob) for blob in sketches['寄存器']), dtype=np.uint8).reshape(-1, REGISTERS)
+
+    keys = pd.DataFrame({'期间': period})
+    if by_level:
+        keys['等级'] = sketches['等级']
+    # 各业务线和全业务各合并一次：全业务的行与各业务线的行共用同一批草图
+    keys = pd.concat([keys.assign(业务=sketches['业务']), keys.assign(业务=ALL_LINES)], ignore_index=True)
+    groups, labels = pd.factorize(pd.MultiIndex.from_frame(keys))
+    merged = merge(groups, np.vstack([data, data]), len(labels))
+    counts = estimate(merged)
+    result = labels.set_names(list(keys.columns)).to_frame(index=False).assign(客户数=counts, 标准误差=counts * RELATIVE_ERROR)
+    return result.sort_values(columns[:-2], kind='stable').reset_index(drop=True)[columns]
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+def interval_join(keys: pd.Series, times: pd.Series, interval_keys: pd.Series,
+                  starts: pd.Series, ends: pd.Series) -> np.ndarray:
+    """
+    为每个时间点找到同一 key 下包含它的区间（start <= time <= end），返回区间的位置，没有时为 -1
+    区间按开始时间排序后累计每个 key 的最晚结束时间，时间点按 merge_asof 找到同一 key 下
+    最后一个已开始的区间，累计的最晚结束时间不早于该时间点即被包含；有多个区间包含时取结束最晚的
+    排序后为一次归并，不生成笛卡尔积
+    """
+    intervals = pd.DataFrame({
+        'key': interval_keys.to_numpy(),
+        'start': starts.to_numpy(),
+        'end': ends.to_numpy(),
+        'position': np.arange(len(starts))
+    }).dropna(subset=['key', 'start', 'end']).sort_values('start', kind='stable')
+    by_key = intervals.groupby('key', sort=False)
+    intervals['cover_end'] = by_key['end'].cummax()
+    # 累计最晚结束时间所属的区间：结束时间刷新累计值的区间向后填充
+    intervals['cover'] = intervals['position'].where(intervals['end'] == intervals['cover_end']).groupby(intervals['key'], sort=False).ffill()
+
+    points = pd.DataFrame({
+        'key': keys.to_numpy(),
+        'time': times.to_numpy(),
+        'row': np.arange(len(times))
+    }).dropna(subset=['key', 'time']).sort_values('time', kind='stable')
+    matched = pd.merge_asof(points, intervals[['key', 'start', 'cover_end', 'cover']],
+                            left_on='time', right_on='start', by='key', direction='backward')
+    inside = (matched['cover_end'] >= matched['time']).to_numpy()
+
+    result = np.full(len(times), -1, dtype=np.int64)
+    result[matched['row'].to_numpy()[inside]] = matched['cover'].to_numpy()[inside].astype(np.int64)
+    return result
@@ -0,0 +1,85 @@
+import json
+import os
+import datetime
+import numpy as np
+import pandas as pd
+from typing import Any, IO
+
+# 需要转成字符串输出的对象列类型（pd.api.types.infer_dtype 的返回值）
+TEMPORAL_INFERRED_TYPES = {'date', 'datetime', 'datetime64', 'period', 'time'}
+
+def _column_to_json(series: pd.Series) -> str:
+    """单列写成 JSON 数组：时间类转字符串，NaN/NaT 写为 null"""
+    if isinstance(series.dtype, pd.PeriodDtype) or pd.api.types.is_datetime64_any_dtype(series):
+        series = series.astype(str).where(series.notna(), None)
+    elif series.dtype == object:
+        inferred = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred in TEMPORAL_INFERRED_TYPES:
+            series = series.astype(str).where(series.notna(), None)
+        elif inferred.startswith('mixed'):
+            # 混合类型交给标准库逐值处理，只在极少数列上发生；缺失值（NaN/NA/NaT）先换成 None，写为 null
+            values = series.astype(object).where(series.notna(), None).tolist()
+            return json.dumps(values, ensure_ascii=False, default=_scalar_default, allow_nan=False)
+    # pandas 自带的 C 编码器按列输出，NaN 直接写为 null
+    return series.to_json(orient='values', force_ascii=False, double_precision=15)
+
+def _frame_to_json(df: pd.DataFrame) -> str:
+    """DataFrame 按列写成 {列名: [值, ...]}，不生成逐行的 Python 对象"""
+    parts = []
+    for position, col in enumerate(df.columns):
+        key = json.dumps(str(col), ensure_ascii=False)
+        parts.append(f'{key}:{_column_to_json(df.iloc[:, position])}')
+    return '{' + ','.join(parts) + '}'
+
+def _scalar_default(value: Any):
+    if isinstance(value, (pd.Timestamp, pd.Period, datetime.date, datetime.time)):
+        return str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _scalar_to_json(value: Any) -> str:
+    if value is None or (not isinstance(value, (str, bytes)) and pd.api.types.is_scalar(value) and pd.isna(value)):
+        return 'null'
+    return json.dumps(value, ensure_ascii=False, default=_scalar_default)
+
+def _write(data: Any, write) -> None:
+    if isinstance(data, pd.DataFrame):
+        write(_frame_to_json(data))
+    elif isinstance(data, pd.Series):
+        write(_column_to_json(data))
+    elif isinstance(data, dict):
+        write('{')
+        for i, (key, value) in enumerate(data.items()):
+            if i:
+                write(',')
+            write(json.dumps(str(key), ensure_ascii=False))
+            write(':')
+            _write(value, write)
+        write('}')
+    elif isinstance(data, (list, tuple)):
+        write('[')
+        for i, item in enumerate(data):
+            if i:
+                write(',')
+            _write(item, write)
+        write(']')
+    else:
+        write(_scalar_to_json(data))
+
+def dump_results(results: Any, fp: IO[str]) -> None:
+    """将分析结果（嵌套的 dict / list / DataFrame）直接写入 JSON 文件"""
+    _write(results, fp.write)
+
+def dumps_results(results: Any) -> str:
+    """将分析结果序列化为 JSON 字符串"""
+    parts = []
+    _write(results, parts.append)
+    return ''.join(parts)
+
+def save_results(results: Any, path: str) -> None:
+    """将分析结果保存到指定路径：先写临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        dump_results(results, f)
+    os.replace(tmp_path, path)
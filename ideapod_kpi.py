@@ -0,0 +1,68 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+from typing import Dict, Iterable
+
+# 对比口径：名称 -> 与前第几期比较。周度数据按 4 周为一个月、52 周为一年
+WEEKLY_COMPARISONS = {'wow': 1, 'mom': 4, 'yoy': 52}
+# 日度数据按 28 天为一个月、364 天为一年，保证对比的两天是同一个星期几
+DAILY_COMPARISONS = {'wow': 7, 'mom': 28, 'yoy': 364}
+
+def rolling_kpis(aggregates: pd.DataFrame, period_col: str, metrics: Dict[str, str],
+                 windows: Iterable[int] = (4,), comparisons: Dict[str, int] = WEEKLY_COMPARISONS,
+                 cutoffs: Dict[str, str] = None) -> pd.DataFrame:
+    """
+    按期汇总数据（周度或日度，每期一行、按时间排序）的滚动指标，期数按行计，缺失的期不补零
+    metrics: 指标名称 -> 汇总列名
+    windows: 滚动合计的期数，不足 N 期时合计已有的期
+    comparisons: 对比名称 -> 间隔期数，变化率 = (本期滚动合计 / 前第 k 期滚动合计 - 1) * 100，
+                 没有前第 k 期或其合计为 0 时记为 0
+    cutoffs: 指标名称 -> 起算日期，该日期及之前各期的变化率记为 0
+    返回每期一行：period_col、{名称}_trailing_{N}、{名称}_trailing_{N}_{对比名称}
+    """
+    names = list(metrics)
+    if aggregates.empty:
+        columns = [period_col] + [f'{name}_trailing_{window}{suffix}' for window in windows
+                                  for suffix in [''] + [f'_{comparison}' for comparison in comparisons] for name in names]
+        return pd.DataFrame(columns=columns, index=aggregates.index)
+    values = aggregates[[metrics[name] for name in names]].set_axis(names, axis=1)
+    periods = aggregates[period_col]
+    # 周期列（如 to_period 得到的订单周）按各期的开始时间比较
+    if isinstance(periods.dtype, pd.PeriodDtype):
+        periods = periods.dt.to_timestamp()
+    period_dates = pd.to_datetime(periods).to_numpy()
+    cutoffs = cutoffs or {}
+    # 各指标的起算日期，按列广播；未设置的指标不限制
+    cutoff_dates = np.array([pd.Timestamp(cutoffs.get(name, pd.Timestamp.min)).to_datetime64() for name in names],
+                            dtype='datetime64[ns]')
+    before_cutoff = period_dates[:, None] <= cutoff_dates[None, :]
+
+    result = {period_col: aggregates[period_col].to_numpy()}
+    for window in windows:
+        # 前面补 window 期 0 后按滑动窗口求和（去掉只含补零的第一个窗口）；
+        # 不用 rolling 的增量求和，全为 0 的窗口合计严格为 0
+        padded = np.vstack([np.zeros((window, len(names))), values.to_numpy(dtype=float)])
+        trailing = sliding_window_view(padded, window, axis=0).sum(axis=-1)[1:]
+        for name, column in zip(names, trailing.T):
+            result[f'{name}_trailing_{window}'] = column
+        for comparison, lag in comparisons.items():
+            previous = np.full_like(trailing, np.nan)
+            if lag < len(trailing):
+                previous[lag:] = trailing[:len(trailing) - lag]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = (trailing / previous - 1) * 100
+            change[np.isnan(previous) | (previous == 0) | before_cutoff] = 0
+            for name, column in zip(names, change.T):
+                result[f'{name}_trailing_{window}_{comparison}'] = column
+    return pd.DataFrame(result, index=aggregates.index)
+
+def trailing_change_table(aggregates: pd.DataFrame, period_col: str, metrics: Dict[str, str], weeks: int = 4,
+                          cutoffs: Dict[str, str] = None) -> pd.DataFrame:
+    """周度汇总中各指标过去 weeks 周滚动合计的周环比、月环比（%），列为 周、{名称}周环比、{名称}月环比"""
+    trailing = rolling_kpis(aggregates, period_col, metrics, windows=(weeks,),
+                            comparisons={'wow': 1, 'mom': weeks}, cutoffs=cutoffs)
+    table = pd.DataFrame({'周': aggregates[period_col].astype(str)}, index=aggregates.index)
+    for name in metrics:
+        table[f'{name}周环比'] = trailing[f'{name}_trailing_{weeks}_wow'].astype(float)
+        table[f'{name}月环比'] = trailing[f'{name}_trailing_{weeks}_mom'].astype(float)
+    return table.reset_index(drop=True)
@@ -0,0 +1,108 @@
+import logging
+import multiprocessing
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+import ideapod_db
+import ideapod_remark
+import ideapod_catering
+import ideapod_space
+import ideapod_group
+
+# 分区执行：按月（或任意 pandas 周期）读取数据，每个分区只生成可合并的部分聚合（和、计数、最值、去重集合），
+# 合并后生成与全量计算相同的结果表；每个进程同时只保存一个分区的原始数据，各分区可在多个进程中并行处理
+PARTITION_FREQ = 'M'
+# 合并规则：'distinct' 为按索引取并集，否则为 {列: 'sum' / 'min' / 'max'}，按索引分组合并
+DISTINCT = 'distinct'
+
+def _space_finance(frames: Dict[str, pd.DataFrame], context) -> Dict[str, pd.DataFrame]:
+    return ideapod_space.finance_partial(ideapod_space.prepare_data(frames['Space']))
+
+def _catering_finance(frames: Dict[str, pd.DataFrame], context) -> Dict[str, pd.DataFrame]:
+    return ideapod_catering.finance_partial(ideapod_catering.prepare_data(frames['Catering']))
+
+def _group_finance(frames: Dict[str, pd.DataFrame], categories: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    space_df, catering_df = ideapod_group.prepare_data(frames['Space'], frames['Catering'])
+    return ideapod_group.finance_partial(space_df, catering_df, categories)
+
+def _group_finance_tables(partial: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    return ideapod_group.finance_tables(partial)['集团财务']
+
+# 步骤名: (读取的表, 全部分区共用的数据（在主进程中读取一次）, 分区部分聚合, 合并规则, 由合并结果生成结果表)
+# 步骤名与 ideapod_pipeline.STAGES 一致，结果与全量计算相同
+AGGREGATES = {
+    'space.finance': (('Space',), None, _space_finance, ideapod_space.FINANCE_MERGE, ideapod_space.finance_tables),
+    'catering.finance': (('Catering',), None, _catering_finance, ideapod_catering.FINANCE_MERGE, ideapod_catering.finance_tables),
+    'group.finance': (('Space', 'Catering'), ideapod_remark.classify, _group_finance, ideapod_group.FINANCE_MERGE,
+                      _group_finance_tables),
+}
+
+def partition_ranges(conn: sqlite3.Connection, tables, freq: str = PARTITION_FREQ) -> List[Tuple[date, date]]:
+    """各表时间列从最早到最晚的日期按 freq 切分成 (开始, 结束) 区间（含首尾两天），没有数据时为空"""
+    bounds = []
+    for table in tables:
+        if not ideapod_db.table_columns(conn, table):
+            continue
+        time_col = ideapod_db.TIME_COLUMNS[table]
+        bounds.extend(conn.execute(f'SELECT MIN("{time_col}"), MAX("{time_col}") FROM "{table}"').fetchone())
+    bounds = pd.to_datetime(pd.Series([value for value in bounds if value], dtype=object), errors='coerce').dropna()
+    if bounds.empty:
+        return []
+    periods = pd.period_range(bounds.min(), bounds.max(), freq=freq)
+    return [(period.start_time.date(), period.end_time.date()) for period in periods]
+
+def combine(left: Optional[Dict[str, pd.DataFrame]], right: Dict[str, pd.DataFrame], rules: Dict) -> Dict[str, pd.DataFrame]:
+    """按规则合并两个部分聚合，结果仍是部分聚合，与合并顺序无关"""
+    if left is None:
+        return right
+    merged = {}
+    for name, rule in rules.items():
+        frames = pd.concat([left[name], right[name]])
+        if rule == DISTINCT:
+            merged[name] = frames[~frames.index.duplicated()].sort_index()
+        else:
+            merged[name] = frames.groupby(level=list(range(frames.index.nlevels))).agg(rule)
+    return merged
+
+def _partition_partial(name: str, start_date: date, end_date: date, context, db_path: str) -> Dict[str, pd.DataFrame]:
+    """在工作进程中读取一个分区并计算部分聚合，每个进程使用自己的连接"""
+    tables, _, partial, _, _ = AGGREGATES[name]
+    conn = ideapod_db.get_db_connection(db_path)
+    try:
+        frames = {table: ideapod_db.read_table(conn, table, start_date, end_date) for table in tables}
+    finally:
+        conn.close()
+    return partial(frames, context)
+
+def run(name: str, freq: str = PARTITION_FREQ, jobs: int = 1, db_path: str = ideapod_db.DB_PATH) -> Dict[str, pd.DataFrame]:
+    """
+    分区计算步骤 name 的结果：各分区的部分聚合按分区顺序依次合并，合并完即释放
+    jobs 大于 1 时各分区在 jobs 个进程中并行计算
+    """
+    tables, load_context, _, rules, finalize = AGGREGATES[name]
+    started = time.perf_counter()
+    conn = ideapod_db.get_db_connection(db_path)
+    try:
+        ranges = partition_ranges(conn, tables, freq)
+        context = load_context(conn) if load_context else None
+    finally:
+        conn.close()
+
+    merged = None
+    args = [(name, start, end, context, db_path) for start, end in ranges]
+    if jobs > 1 and len(ranges) > 1:
+        # 流水线在线程中调用，fork 会复制其他线程持有的锁，工作进程改用 spawn 启动
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            for partial in executor.map(_partition_partial, *zip(*args)):
+                merged = combine(merged, partial, rules)
+    else:
+        for arg in args:
+            merged = combine(merged, _partition_partial(*arg), rules)
+    if merged is None:
+        # 没有数据时按空表计算一次，得到与全量计算相同的空结果
+        merged = _partition_partial(name, date.max, date.min, context, db_path)
+    logging.info(f"[Partition] {name} 按 {freq} 分为 {len(ranges)} 个分区，用时 {time.perf_counter() - started:.2f}s")
+    return finalize(merged)
@@ -0,0 +1,416 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+import traceback
+import types
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+import ideapod_anomaly
+import ideapod_basket
+import ideapod_cache
+import ideapod_customer
+import ideapod_db
+import ideapod_forecast
+import ideapod_hll
+import ideapod_json
+import ideapod_partition
+import ideapod_remark
+import ideapod_catering
+import ideapod_space
+import ideapod_group
+
+def _load_table(table: str):
+    """读取整张表，每个读取步骤使用自己的连接，可在不同线程中运行"""
+    def load():
+        conn = ideapod_db.get_db_connection()
+        try:
+            return ideapod_db.read_table(conn, table)
+        finally:
+            conn.close()
+    return load
+
+def _load_identity():
+    """读取导入 / 更新时维护的客户维度表"""
+    conn = ideapod_db.get_db_connection()
+    try:
+        return ideapod_customer.read_identity(conn)
+    finally:
+        conn.close()
+
+def _load_remark_categories():
+    """按规则表通过备注索引查出订单类别；步骤以规则表命名，规则变化时缓存失效"""
+    conn = ideapod_db.get_db_connection()
+    try:
+        return ideapod_remark.classify(conn)
+    finally:
+        conn.close()
+
+def _load_sketches():
+    """读取每日活跃客户草图（导入 / 更新时建立）"""
+    conn = ideapod_db.get_db_connection()
+    try:
+        return ideapod_hll.read_sketches(conn)
+    finally:
+        conn.close()
+
+def _load_product_summaries():
+    """读取每日每小时的商品销量摘要（导入 / 更新时建立）"""
+    conn = ideapod_db.get_db_connection()
+    try:
+        return ideapod_catering.read_product_summaries(conn)
+    finally:
+        conn.close()
+
+def _group_finance(data, categories) -> Dict[str, pd.DataFrame]:
+    space_df, catering_df = data
+    return ideapod_group.analyze_finance(space_df, catering_df, categories)['集团财务']
+
+def _group_anomaly(data, finance) -> Dict[str, pd.DataFrame]:
+    space_df, catering_df = data
+    return ideapod_group.analyze_revenue_anomaly(finance, as_of=ideapod_group.data_as_of(space_df, catering_df))
+
+def _group_forecast(data, finance) -> Dict[str, pd.DataFrame]:
+    space_df, _ = data
+    return ideapod_group.analyze_forecast(space_df, finance)
+
+def _group_pod_dining(data, identity) -> Dict[str, pd.DataFrame]:
+    space_df, catering_df = data
+    return ideapod_group.analyze_pod_dining(space_df, catering_df, identity)
+
+def _group_cohort_ltv(data, identity) -> Dict[str, pd.DataFrame]:
+    space_df, catering_df = data
+    return ideapod_group.analyze_cohort_ltv(space_df, catering_df, identity)
+
+# 步骤名: (依赖的步骤, 函数, 输出的结果名)
+# 函数按依赖顺序接收各依赖步骤的结果；中间步骤（数据读取、预处理）不直接输出结果
+STAGES = {
+    # 数据读取
+    'Space': ((), _load_table('Space'), ()),
+    'Catering': ((), _load_table('Catering'), ()),
+    'Product': ((), _load_table('Product'), ()),
+    'CustomerIdentity': ((), _load_identity, ()),
+    'RemarkRule': ((), _load_remark_categories, ()),
+    'UserSketch': ((), _load_sketches, ()),
+    'ProductSummary': ((), _load_product_summaries, ()),
+
+    # 空间
+    'space.data': (('Space',), ideapod_space.prepare_data, ()),
+    'space.products': (('space.data',), ideapod_space.filter_space_products, ()),
+    'space.finance': (('space.data',), ideapod_space.analyze_finance, ('财务分析_bar', '过去四周环比(%)_line')),
+    'space.order': (('space.data',), ideapod_space.analyze_order, (
+        '月升舱订单量_bar', '月升舱金额_bar', '月升舱订单占比_bar',
+        '月加钟收入_bar', '月加钟总时长_bar', '预约订单占比_bar')),
+    'space.peak': (('space.products',), ideapod_space.analyze_peak_hours, ('高峰时段分析_bar',)),
+    'space.zones': (('space.products',), ideapod_space.analyze_space_metrics, (
+        '各区收入_bar', '各区订单量_bar', '各区总时长_bar', '各区单均时长_bar', '各区利用率_bar')),
+    'space.hourly': (('space.products',), ideapod_space.analyze_hourly_usage, ('周度日内使用率_bar',)),
+    'space.weekday': (('space.products',), ideapod_space.analyze_weekday_usage, ('周内使用率_bar',)),
+    'space.member': (('space.data',), ideapod_space.analyze_member, (
+        '留存与流失率_table', '月收入占比_stacked', '月单量占比_stacked')),
+    'space.users': (('space.data',), ideapod_space.analyze_users, ('用户价值分布（RFM模型）_bar', '用户价值分层_table')),
+
+    # 餐饮
+    'catering.data': (('Catering',), ideapod_catering.prepare_data, ()),
+    'catering.finance': (('catering.data',), ideapod_catering.analyze_finance, (
+        '财务分析_bar', '过去四周环比(%)_line', '周内收入分布_stacked', '周内单量分布_stacked',
+        '日内收入分布_stacked', '日内单量分布_stacked')),
+    'catering.order': (('catering.data',), ideapod_catering.analyze_order, (
+        '销售收入_服务方式_stacked', '订单量_服务方式_stacked', '订单单价_服务方式_bar')),
+    'catering.product': (('catering.data', 'Product'), ideapod_catering.analyze_product, ('产品销售量_bar',)),
+    'catering.user': (('catering.data', 'CustomerIdentity'), ideapod_catering.analyze_user, ('用户价值分布（RFM模型）_bar', '用户价值分层_table')),
+    'catering.marketing': (('catering.data',), ideapod_catering.analyze_marketing, ('促销优惠分析_bar', '单项优惠分析_bar')),
+    'catering.basket': (('catering.data',), ideapod_catering.analyze_basket, ('商品搭配_table', '三件组合_table')),
+    'catering.top': (('ProductSummary',), ideapod_catering.analyze_top_products, ('各月热销商品_table', '各时段热销产品类型_table')),
+
+    # 集团
+    'group.data': (('Space', 'Catering'), ideapod_group.prepare_data, ()),
+    'group.finance': (('group.data', 'RemarkRule'), _group_finance, (
+        '周度销售收入_stacked', '过去四周收入周环比(%)_line', '过去四周收入月环比(%)_line', '日度销售收入_table')),
+    'group.anomaly': (('group.data', 'group.finance'), _group_anomaly, ('日度收入异常_table', '周度收入异常_table')),
+    'group.forecast': (('group.data', 'group.finance'), _group_forecast, ('各空间使用预测_table', '收入指标预测_table')),
+    'group.active': (('UserSketch',), ideapod_group.analyze_active_users, (
+        '周活跃客户数_line', '月活跃客户数_line', '季度活跃客户数_bar', '各等级季度活跃客户数_stacked')),
+    'group.dining': (('group.data', 'CustomerIdentity'), _group_pod_dining, ('在舱餐饮消费_table', '各空间在舱餐饮消费_bar')),
+    'group.ltv': (('group.data', 'CustomerIdentity'), _group_cohort_ltv, (
+        '场景客户累计LTV_line', '餐饮客户累计LTV_line', '全业务客户累计LTV_line',
+        '各业务新客数_bar', '全业务同期群收入构成_stacked')),
+}
+
+# 页面: (结果文件, {分类: [输出结果的步骤]})，顺序即结果文件中的顺序
+PAGES = {
+    'space': ('static/space_results.json', {
+        '财务数据': ['space.finance'],
+        '订单分析': ['space.order'],
+        '空间产品': ['space.peak', 'space.zones', 'space.hourly', 'space.weekday'],
+        '会员分析': ['space.member'],
+        '用户价值': ['space.users']
+    }),
+    'catering': ('static/catering_results.json', {
+        '财务分析': ['catering.finance'],
+        '订单分析': ['catering.order'],
+        '餐饮产品': ['catering.product'],
+        '用户价值': ['catering.user'],
+        '促销分析': ['catering.marketing'],
+        '购物篮分析': ['catering.basket'],
+        '热销排行': ['catering.top']
+    }),
+    'group': ('static/group_results.json', {
+        '集团财务': ['group.finance'],
+        '收入异常': ['group.anomaly'],
+        '经营预测': ['group.forecast'],
+        '活跃客户': ['group.active'],
+        '在舱消费': ['group.dining'],
+        '客户LTV': ['group.ltv']
+    })
+}
+
+# 结果受模块级参数影响的步骤，参数计入缓存键
+STAGE_PARAMS = {
+    'space.users': ideapod_space.RFM_PARAMS,
+    'catering.user': ideapod_catering.RFM_PARAMS,
+    'catering.basket': ideapod_basket.BASKET_PARAMS,
+    'group.finance': ideapod_group.CUTOFF_DATES,
+    'group.anomaly': ideapod_anomaly.LEDGER_PARAMS,
+    'group.forecast': ideapod_forecast.FORECAST_PARAMS
+}
+
+# 除数据库外还读取文件的步骤，文件内容计入缓存键（文件不存在也是一种状态）
+STAGE_FILES = {
+    'group.finance': (ideapod_group.EXTERNAL_DATA_FILE,)
+}
+
+# 兼容原交互菜单的编号
+PAGE_ALIASES = {'1': 'space', '2': 'catering', '3': 'group'}
+
+def list_outputs() -> List[tuple]:
+    """所有结果：(页面, 分类, 结果名, 步骤)"""
+    outputs = []
+    for page, (_, categories) in PAGES.items():
+        for category, stages in categories.items():
+            for stage in stages:
+                for key in STAGES[stage][2]:
+                    outputs.append((page, category, key, stage))
+    return outputs
+
+def _target_forms(page: str, category: str, key: str) -> set:
+    return {(page,), (page, category), (page, category, key), (page, key),
+            (category,), (category, key), (key,)}
+
+def resolve_targets(targets: List[str]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    将命令行目标解析为 {页面: {分类: [结果名]}}
+    目标可以是 页面、页面/分类、分类/结果名、页面/分类/结果名 等，跨页面有歧义时抛出 ValueError
+    """
+    selected = set()
+    for target in targets:
+        parts = tuple(part for part in target.strip('/').split('/') if part)
+        if len(parts) >= 1 and parts[0] in PAGE_ALIASES:
+            parts = (PAGE_ALIASES[parts[0]],) + parts[1:]
+        matches = [output for output in list_outputs() if parts in _target_forms(*output[:3])]
+        if not matches:
+            raise ValueError(f"未知的分析目标: {target}（可用 --list 查看全部）")
+        pages = sorted({page for page, _, _, _ in matches})
+        if len(pages) > 1:
+            raise ValueError(f"分析目标 {target} 同时匹配 {', '.join(pages)}，请加上页面前缀，例如 {pages[0]}/{target}")
+        selected.update(output[:3] for output in matches)
+
+    selection = {}
+    for page, category, key, _ in list_outputs():
+        if (page, category, key) in selected:
+            selection.setdefault(page, {}).setdefault(category, []).append(key)
+    return selection
+
+def required_stages(stages, partitioned=frozenset()) -> List[str]:
+    """目标步骤及其全部依赖，按依赖顺序排列；partitioned 中的步骤分区计算，不需要其依赖"""
+    order, visiting = [], set()
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"步骤依赖存在循环: {name}")
+        visiting.add(name)
+        for dep in _deps(name, partitioned):
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+    for name in stages:
+        visit(name)
+    return order
+
+def _deps(name: str, partitioned=frozenset()):
+    return () if name in partitioned else STAGES[name][0]
+
+def _copy(value):
+    # 各步骤拿到的是独立副本，分析函数添加列不会影响并行的其他步骤
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    return value
+
+def _run_stage(name: str, args: list):
+    started = time.perf_counter()
+    result = STAGES[name][1](*args)
+    logging.info(f"[Pipeline] {name} 完成，用时 {time.perf_counter() - started:.2f}s")
+    return result
+
+def _project_modules(name: str, found: set = None) -> set:
+    """模块本身及其直接或间接引用的 ideapod_* 模块"""
+    found = set() if found is None else found
+    found.add(name)
+    for value in vars(sys.modules[name]).values():
+        if isinstance(value, types.ModuleType) and value.__name__.startswith('ideapod_') and value.__name__ not in found:
+            _project_modules(value.__name__, found)
+    return found
+
+def stage_cache_keys(stages) -> Dict[str, str]:
+    """
+    各步骤结果的缓存键：所依赖数据表的内容哈希、读取的其他文件（STAGE_FILES）的哈希、
+    所用分析模块源文件的哈希、参数以及 pandas / numpy 版本，任一变化即重新计算
+    """
+    chains = {name: required_stages([name]) for name in stages}
+    tables = sorted({dep for chain in chains.values() for dep in chain if not STAGES[dep][0]})
+    fingerprints = ideapod_cache.table_fingerprints(tables)
+    files = sorted({path for chain in chains.values() for dep in chain for path in STAGE_FILES.get(dep, ())})
+    file_hashes = {path: ideapod_cache.file_hash(path) if os.path.exists(path) else None for path in files}
+    code_hashes = {}
+    keys = {}
+    for name, chain in chains.items():
+        modules = sorted(set().union(*(_project_modules(STAGES[dep][1].__module__)
+                                       for dep in chain if STAGES[dep][0])))
+        for module in modules:
+            if module not in code_hashes:
+                code_hashes[module] = ideapod_cache.file_hash(sys.modules[module].__file__)
+        keys[name] = ideapod_cache.make_key({
+            'stage': name,
+            'tables': {dep: fingerprints[dep] for dep in chain if not STAGES[dep][0]},
+            'files': {path: file_hashes[path] for dep in chain for path in STAGE_FILES.get(dep, ())},
+            'code': {module: code_hashes[module] for module in modules},
+            'params': STAGE_PARAMS.get(name),
+            'versions': [pd.__version__, np.__version__]
+        })
+    return keys
+
+def _run_partitioned(name: str, freq: str, jobs: int):
+    started = time.perf_counter()
+    result = ideapod_partition.run(name, freq, jobs)
+    logging.info(f"[Pipeline] {name} 分区计算完成，用时 {time.perf_counter() - started:.2f}s")
+    return result
+
+def run_stages(targets, jobs: int = 1, refresh: bool = False, partition: str = None):
+    """
+    只运行目标步骤及其依赖，每个步骤运行一次；依赖都完成的步骤最多 jobs 个并行
+    中间结果在所有依赖它的步骤完成后释放。返回 (目标步骤的结果, 失败步骤的错误信息)
+    目标步骤的结果按缓存键保存，输入未变化时直接读取；refresh 为 True 时忽略已有缓存
+    partition 为 pandas 周期（如 'M'）时，ideapod_partition.AGGREGATES 中的步骤按该周期分区计算，
+    不读取整张表；结果与全量计算相同，共用缓存
+    """
+    partitioned = frozenset(ideapod_partition.AGGREGATES) if partition else frozenset()
+    targets = set(targets)
+    keys, cached = {}, {}
+    try:
+        keys = stage_cache_keys(targets)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"[Pipeline] 无法计算缓存键，本次不使用缓存: {e}")
+    if not refresh:
+        for name, key in keys.items():
+            value = ideapod_cache.get(key)
+            if value is not None:
+                cached[name] = value
+                logging.info(f"[Pipeline] {name} 使用缓存结果")
+
+    order = required_stages(sorted(targets - set(cached)), partitioned)
+    consumers = {name: sum(name in _deps(other, partitioned) for other in order) for name in order}
+    values, errors, futures = {}, {}, {}
+    remaining = list(order)
+
+    def release(name):
+        for dep in _deps(name, partitioned):
+            consumers[dep] -= 1
+            if consumers[dep] == 0 and dep not in targets:
+                values.pop(dep, None)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while remaining or futures:
+            for name in list(remaining):
+                deps = _deps(name, partitioned)
+                failed = [dep for dep in deps if dep in errors]
+                if failed:
+                    errors[name] = f"依赖的步骤 {', '.join(failed)} 失败"
+                    remaining.remove(name)
+                    release(name)
+                elif name in partitioned:
+                    futures[executor.submit(_run_partitioned, name, partition, jobs)] = name
+                    remaining.remove(name)
+                elif all(dep in values for dep in deps):
+                    futures[executor.submit(_run_stage, name, [_copy(values[dep]) for dep in deps])] = name
+                    remaining.remove(name)
+            if not futures:
+                continue
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    values[name] = future.result()
+                    if name in keys:
+                        ideapod_cache.put(keys[name], values[name])
+                except Exception as e:
+                    errors[name] = str(e)
+                    logging.error(f"[Pipeline] {name} 失败: {e}\n{traceback.format_exc()}")
+                release(name)
+
+    values.update(cached)
+    return {name: values[name] for name in targets if name in values}, errors
+
+def _load_existing(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {} if 'error' in results else results
+
+def run(targets=None, jobs: int = 1, refresh: bool = False, partition: str = None) -> Dict[str, str]:
+    """
+    计算选中的结果并写入各页面的结果文件，返回 {页面: 错误信息或 None}
+    只选了页面中部分结果时，合并到已有的结果文件中；页面中任一步骤失败则不写入该页面
+    partition 见 run_stages
+    """
+    selection = resolve_targets(targets or list(PAGES))
+    stage_keys = {}
+    for page, category, key, stage in list_outputs():
+        if key in selection.get(page, {}).get(category, []):
+            stage_keys.setdefault((page, stage), []).append(key)
+
+    values, errors = run_stages({stage for _, stage in stage_keys}, jobs, refresh, partition)
+
+    status = {}
+    for page, categories in selection.items():
+        results_file, layout = PAGES[page]
+        failed = {stage: errors[stage] for (p, stage) in stage_keys if p == page and stage in errors}
+        if failed:
+            status[page] = '; '.join(f"{stage}: {error}" for stage, error in failed.items())
+            continue
+
+        complete = all(categories.get(category) == [key for stage in stages for key in STAGES[stage][2]]
+                       for category, stages in layout.items())
+        existing = {} if complete else _load_existing(results_file)
+        results = {}
+        for category, stages in layout.items():
+            section = {}
+            for stage in stages:
+                for key in STAGES[stage][2]:
+                    if key in categories.get(category, []):
+                        section[key] = values[stage][key]
+                    elif key in existing.get(category, {}):
+                        section[key] = existing[category][key]
+            if section:
+                results[category] = section
+        ideapod_json.save_results(results, results_file)
+        status[page] = None
+    return status
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from typing import Tuple
+
+NO_PROMOTION = '无优惠'
+
+def _parse(promotions: pd.Series) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    只拆分不同的原始字符串：返回每行对应的字符串编号，以及每个字符串去重后的优惠
+    (编号, 序号, 优惠)，重复的优惠保留第一次出现的位置。空值视为无优惠
+    """
+    codes, uniques = pd.factorize(promotions.fillna(NO_PROMOTION))
+    parts = pd.Series(uniques, dtype=object).str.split(',').explode()
+    parts = parts.rename('优惠').rename_axis('编号').reset_index().drop_duplicates(['编号', '优惠'])
+    parts['序号'] = parts.groupby('编号').cumcount()
+    return codes, parts
+
+def promotion_tags(promotions: pd.Series) -> pd.DataFrame:
+    """
+    将使用优惠拆分为标签表：每个 (订单, 优惠) 一行，索引为订单所在行的索引，
+    列为 序号（在原字符串中的顺序）和 优惠（分类类型）
+    """
+    codes, parts = _parse(promotions)
+    rows = pd.DataFrame({'行': range(len(codes)), '编号': codes})
+    tags = rows.merge(parts, on='编号').sort_values(['行', '序号'], kind='stable')
+    return pd.DataFrame({
+        '序号': tags['序号'].to_numpy(),
+        '优惠': pd.Categorical(tags['优惠'])
+    }, index=promotions.index[tags['行'].to_numpy()])
+
+def promotion_combinations(promotions: pd.Series) -> pd.Series:
+    """每个订单去重后的优惠组合（按原顺序以逗号连接，分类类型）"""
+    codes, parts = _parse(promotions)
+    labels = parts.groupby('编号')['优惠'].agg(','.join).to_numpy()
+    return pd.Series(pd.Categorical(labels[codes]), index=promotions.index)
@@ -0,0 +1,139 @@
+import sqlite3
+import pandas as pd
+import ideapod_db
+
+# 备注全文索引（FTS5）：Space 和 Catering 每个订单一行，导入时建立，更新时只重建替换了数据的时间段
+REMARK_INDEX = 'RemarkIndex'
+# 各表的单号列、时间列（与 ideapod_update.replace_from 替换数据的时间列一致）和建立索引的文本列
+INDEXED_TABLES = {
+    'Space': ('订单编号', '创建时间', ['订单备注', '预定备注']),
+    'Catering': ('订单号', '下单时间', ['备注', '商品'])
+}
+TEXT_COLUMNS = [col for _, _, columns in INDEXED_TABLES.values() for col in columns]
+INDEX_COLUMNS = ['表', '单号', '时间'] + TEXT_COLUMNS
+
+# 关键词分类规则表：(类别, 表, 列, 关键词)，文本包含关键词即属于该类别
+# 表不存在时按默认规则建立，之后直接在表中增删关键词即可，不需要改代码（查询时读取，不需要重建索引）
+RULE_TABLE = 'RemarkRule'
+DEFAULT_RULES = [
+    ('场景活动', 'Space', '订单备注', '拍摄'),
+    ('场景活动', 'Space', '订单备注', '戴老师活动'),
+    ('吧台活动', 'Catering', '商品', '拍摄'),
+    ('吧台活动', 'Catering', '商品', '包场')
+]
+CATEGORY_COLUMNS = ['表', '单号', '类别', '列', '关键词']
+
+def _char_tokens(text: str) -> str:
+    return ' '.join(format(ord(char), 'x') for char in text)
+
+def _tokens(values: pd.Series) -> pd.Series:
+    """
+    每个字符（转小写后）按其码位写成一个词，关键词按相邻字符的短语查询，即为不区分大小写的子串匹配；
+    码位只含字母和数字，标点和空白也是词，不会被分词器丢弃
+    """
+    return values.fillna('').astype(str).str.lower().map(_char_tokens)
+
+def _phrase(keyword: str) -> str:
+    return f'"{_char_tokens(keyword.lower())}"'
+
+def ensure_rules(conn: sqlite3.Connection) -> None:
+    if ideapod_db.table_columns(conn, RULE_TABLE):
+        return
+    conn.execute(f'CREATE TABLE "{RULE_TABLE}" ("类别" TEXT NOT NULL, "表" TEXT NOT NULL, "列" TEXT NOT NULL, "关键词" TEXT NOT NULL)')
+    conn.executemany(f'INSERT INTO "{RULE_TABLE}" VALUES (?, ?, ?, ?)', DEFAULT_RULES)
+    conn.commit()
+
+def drop_outdated_index(conn: sqlite3.Connection) -> bool:
+    """索引结构与 INDEX_COLUMNS 不同（较早版本建立）时删除，之后按索引不存在全部重建；返回是否删除"""
+    columns = ideapod_db.table_columns(conn, REMARK_INDEX)
+    if not columns or columns == INDEX_COLUMNS:
+        return False
+    conn.execute(f'DROP TABLE "{REMARK_INDEX}"')
+    conn.commit()
+    return True
+
+def write_remark_index(conn: sqlite3.Connection, start_date=None) -> int:
+    """
+    重建 start_date（含）之后的订单（按各表的时间列）的备注索引，默认或索引结构不同时全部重建；返回写入的订单数
+    增量更新时各门店替换数据的起始时间不同，从其中最早的一天起对全部门店重建
+    """
+    if start_date is None or ideapod_db.table_columns(conn, REMARK_INDEX) != INDEX_COLUMNS:
+        start_date = None
+        conn.execute(f'DROP TABLE IF EXISTS "{REMARK_INDEX}"')
+        text_sql = ', '.join(f'"{col}"' for col in TEXT_COLUMNS)
+        conn.execute(f'CREATE VIRTUAL TABLE "{REMARK_INDEX}" USING fts5('
+                     f'"表" UNINDEXED, "单号" UNINDEXED, "时间" UNINDEXED, {text_sql})')
+    total = 0
+    for table, (key_col, time_col, columns) in INDEXED_TABLES.items():
+        existing = ideapod_db.table_columns(conn, table)
+        if key_col not in existing:
+            continue
+        selected = ', '.join(f'"{col}"' for col in [key_col, time_col] + [col for col in columns if col in existing])
+        query, params = f'SELECT {selected} FROM "{table}"', []
+        if start_date is not None:
+            start = start_date.strftime('%Y-%m-%d')
+            conn.execute(f'DELETE FROM "{REMARK_INDEX}" WHERE "表" = ? AND "时间" >= ?', (table, start))
+            query += f' WHERE "{time_col}" >= ?'
+            params.append(start)
+        df = pd.read_sql_query(query, conn, params=params)
+        rows = pd.DataFrame({'表': table, '单号': df[key_col].astype(str), '时间': df[time_col]})
+        for col in TEXT_COLUMNS:
+            rows[col] = _tokens(df[col]) if col in df.columns else ''
+        conn.executemany(f'INSERT INTO "{REMARK_INDEX}" VALUES ({", ".join("?" * len(rows.columns))})',
+                         rows.itertuples(index=False, name=None))
+        total += len(rows)
+    conn.commit()
+    ideapod_db.record_sources(conn, REMARK_INDEX)
+    return total
+
+def classify(conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    按规则表通过全文索引查出各规则匹配的订单：(表, 单号, 类别, 列, 关键词)
+    规则表和索引只在导入 / 更新时建立，不存在或索引过期时报错
+    """
+    if not ideapod_db.table_columns(conn, RULE_TABLE):
+        raise RuntimeError(f"{RULE_TABLE} 表不存在，请先运行 ideapod_fetch.py 或 ideapod_update.py 建立")
+    ideapod_db.check_derived(conn, REMARK_INDEX)
+    if ideapod_db.table_columns(conn, REMARK_INDEX) != INDEX_COLUMNS:
+        raise RuntimeError(f"{REMARK_INDEX} 表由较早版本建立，请运行 ideapod_update.py 重建")
+    rules = pd.read_sql_query(f'SELECT "类别", "表", "列", "关键词" FROM "{RULE_TABLE}"', conn)
+    rules = rules[rules['列'].isin(TEXT_COLUMNS) & (rules['关键词'].str.strip() != '')].drop_duplicates()
+    parts = []
+    for category, table, col, keyword in rules.itertuples(index=False, name=None):
+        keyword = keyword.strip()
+        keys = pd.read_sql_query(
+            f'SELECT DISTINCT "单号" FROM "{REMARK_INDEX}" WHERE "{REMARK_INDEX}" MATCH ? AND "表" = ?',
+            conn, params=(f'{{{col}}} : {_phrase(keyword)}', table))
+        parts.append(keys.assign(表=table, 类别=category, 列=col, 关键词=keyword))
+    if not parts:
+        return pd.DataFrame(columns=CATEGORY_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[CATEGORY_COLUMNS]
+
+def _contains(values: pd.Series, keyword: str) -> pd.Series:
+    return values.astype(str).str.lower().str.contains(keyword.lower(), regex=False)
+
+def _matches_rules(df: pd.DataFrame, table: str, category: str) -> pd.Series:
+    """没有索引查询结果时按默认规则逐行匹配子串"""
+    matched = pd.Series(False, index=df.index)
+    for rule_category, rule_table, col, keyword in DEFAULT_RULES:
+        if rule_category == category and rule_table == table and col in df.columns:
+            matched |= _contains(df[col], keyword)
+    return matched
+
+def category_flags(df: pd.DataFrame, table: str, category: str, categories: pd.DataFrame = None) -> pd.Series:
+    """
+    df 中每个订单是否属于该类别；categories 为 classify 的结果
+    索引按单号给出候选订单，候选行再按匹配到的关键词逐行核对子串，
+    单号重复（同一单号的其他行匹配）时结果仍与逐行子串匹配相同
+    """
+    if categories is None:
+        return _matches_rules(df, table, category)
+    key_col = INDEXED_TABLES[table][0]
+    keys = df[key_col].astype(str)
+    matched = categories[(categories['表'] == table) & (categories['类别'] == category)]
+    flags = pd.Series(False, index=df.index)
+    for (col, keyword), group in matched.groupby(['列', '关键词'], sort=False):
+        candidates = keys.isin(pd.Index(group['单号'])) & ~flags
+        if col in df.columns and candidates.any():
+            flags[candidates] = _contains(df.loc[candidates, col], keyword).to_numpy(dtype=bool)
+    return flags
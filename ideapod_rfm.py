@@ -0,0 +1,121 @@
+import itertools
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable
+
+# 默认同时计算的统计窗口（天）
+RFM_WINDOWS = (30, 90, 180, 365)
+
+# 用户分层：(最近消费高, 消费频次高, 消费力高) -> 分层名称，三个指数均以 50 分为界
+SEGMENTS = {
+    (True, True, True): '重要价值用户',
+    (True, False, True): '重要发展用户',
+    (False, True, True): '重要保持用户',
+    (False, False, True): '重要挽留用户',
+    (True, True, False): '一般价值用户',
+    (True, False, False): '一般发展用户',
+    (False, True, False): '一般保持用户',
+    (False, False, False): '一般挽留用户'
+}
+SEGMENT_THRESHOLD = 50
+
+def score_customers(customers: pd.Series, times: pd.Series, amounts: pd.Series, orders: pd.Series,
+                    params: Dict, windows: Iterable[int] = RFM_WINDOWS) -> pd.DataFrame:
+    """
+    按订单计算各统计窗口内每个用户的 RFM 指数，一次分组得到所有窗口的结果
+    customers / times / amounts / orders: 每个订单的用户、下单时间、金额、订单号
+    params: {'lambda': 最近消费指数的衰减系数, 'weight_monetary': 消费力权重}
+    返回每个 (窗口天数, 用户) 一行，窗口以全部订单中最晚的下单时间为终点
+    """
+    windows = np.array(sorted(set(windows)), dtype=int)
+    n = len(windows)
+    today = times.max()
+    valid = (customers.notna() & times.notna()).to_numpy()
+    codes, users = pd.factorize(customers[valid])
+    order_times = times.to_numpy()[valid]
+    # 订单落在的最小窗口：距最晚下单时间的天数 <= 窗口天数
+    window_edges = pd.to_timedelta(windows, unit='D').to_numpy()
+    tier = np.searchsorted(window_edges, today.to_datetime64() - order_times, side='left')
+    in_window = tier < n
+
+    # 按 (用户, 最小窗口) 一次分组聚合
+    per_tier = pd.DataFrame({
+        'key': codes[in_window] * n + tier[in_window],
+        '最近消费时间': order_times[in_window],
+        '总消费金额': amounts.to_numpy()[valid][in_window],
+        '消费次数': orders.notna().to_numpy()[valid][in_window].astype(int)
+    }).groupby('key').agg({'最近消费时间': 'max', '总消费金额': 'sum', '消费次数': 'sum'})
+    user_code, window_code = np.divmod(per_tier.index.to_numpy(), n)
+
+    # 小窗口的订单也属于所有更大的窗口：沿窗口方向累计；最近消费时间取最小的有订单的窗口
+    shape = (len(users), n)
+    amount = np.zeros(shape)
+    amount[user_code, window_code] = per_tier['总消费金额'].to_numpy()
+    count = np.zeros(shape, dtype=int)
+    count[user_code, window_code] = per_tier['消费次数'].to_numpy()
+    last_time = np.full(shape, np.datetime64('NaT'), dtype='datetime64[ns]')
+    last_time[user_code, window_code] = per_tier['最近消费时间'].to_numpy()
+    for i in range(1, n):
+        last_time[:, i] = np.where(np.isnat(last_time[:, i - 1]), last_time[:, i], last_time[:, i - 1])
+    amount = amount.cumsum(axis=1)
+    count = count.cumsum(axis=1)
+
+    user_index, window_index = np.nonzero(count > 0)
+    scored = pd.DataFrame({
+        '窗口天数': windows[window_index],
+        '用户': np.asarray(users, dtype=object)[user_index],
+        '最近消费时间': last_time[user_index, window_index],
+        '总消费金额': amount[user_index, window_index],
+        '消费次数': count[user_index, window_index]
+    })
+
+    # 最近购买时间指数: e^(-λ * Recency)
+    scored['Recency'] = (today - scored['最近消费时间']).dt.days
+    scored['最近一次消费指数'] = np.exp(-params['lambda'] * scored['Recency']) * 100
+    # 消费力和消费频次指数：取对数后以理论最小值 0 为基准，窗口内最大值拉到 100
+    monetary_raw = np.log(scored['总消费金额'] + 1)
+    frequency_raw = np.log(scored['消费次数'] + 1)
+    by_window = scored['窗口天数']
+    scored['消费力指数'] = monetary_raw / monetary_raw.groupby(by_window).transform('max') * 100
+    scored['消费频次指数'] = frequency_raw / frequency_raw.groupby(by_window).transform('max') * 100
+
+    weight_monetary = params['weight_monetary']
+    scored['用户价值'] = (
+        scored['最近一次消费指数'] *
+        (scored['消费力指数'] * weight_monetary + scored['消费频次指数'] * (1 - weight_monetary))
+    ) / 100
+
+    recent, frequent, monetary = (scored[col].to_numpy() >= SEGMENT_THRESHOLD
+                                  for col in ('最近一次消费指数', '消费频次指数', '消费力指数'))
+    segment_names = np.array([SEGMENTS[key] for key in itertools.product((False, True), repeat=3)], dtype=object)
+    scored['用户分层'] = segment_names[recent * 4 + frequent * 2 + monetary]
+
+    return scored[['窗口天数', '用户', '最近消费时间', '总消费金额', '消费次数', 'Recency',
+                   '最近一次消费指数', '消费力指数', '消费频次指数', '用户价值', '用户分层']]
+
+def score_histogram(scores: pd.Series) -> np.ndarray:
+    """
+    0-100 分按 1 分一档统计人数，分档与 pd.cut(bins=range(0, 101), include_lowest=True) 相同：
+    [0, 1], (1, 2], ..., (99, 100]，超出范围和 NaN 不计
+    """
+    values = scores.to_numpy(dtype=float)
+    values = values[(values >= 0) & (values <= 100)]
+    bins = np.maximum(np.ceil(values).astype(int) - 1, 0)
+    return np.bincount(bins, minlength=100)
+
+def score_distribution(scored: pd.DataFrame) -> pd.DataFrame:
+    """单个窗口内四个指数的分布"""
+    return pd.DataFrame({
+        '分数区间': pd.Series(range(1, 101), name='分数区间'),
+        '用户价值分布': score_histogram(scored['用户价值']),
+        '最近一次消费指数分布': score_histogram(scored['最近一次消费指数']),
+        '消费力指数分布': score_histogram(scored['消费力指数']),
+        '消费频次指数分布': score_histogram(scored['消费频次指数'])
+    })
+
+def segment_table(scored: pd.DataFrame) -> pd.DataFrame:
+    """各窗口内每个用户分层的人数"""
+    counts = scored.groupby(['用户分层', '窗口天数']).size().unstack('窗口天数', fill_value=0)
+    counts = counts.reindex(index=list(SEGMENTS.values()), fill_value=0)
+    counts.columns = [f'近{days}天' for days in counts.columns]
+    return counts.rename_axis('用户分层').reset_index()
@@ -4,7 +4,9 @@ import logging
 from pandas import Timestamp, Period
 from typing import Dict, Tuple
 import numpy as np
-from datetime import timedelta, time
+import ideapod_db
+import ideapod_kpi
+import ideapod_rfm
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,6 +16,27 @@ logging.basicConfig(
     ]
 )
 
+WEEKDAY_ORDER = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+WEEKDAY_MAP = {
+    'Monday': '周一', 'Tuesday': '周二', 'Wednesday': '周三', 
+    'Thursday': '周四', 'Friday': '周五', 'Saturday': '周六', 'Sunday': '周日'
+}
+
+# 用户价值（RFM）模型参数：统计天数，最近消费指数的衰减系数 λ（60天下降到50分），消费力权重
+RFM_PARAMS = {'days': 180, 'lambda': 0.0115, 'weight_monetary': 0.6}
+
+# 流失窗口：名称 -> (距统计日至少天数, 不足天数)，不足天数为 None 表示不设上限
+CHURN_WINDOWS = {
+    '流失预警_30_60天': (30, 60),
+    '流失预警_60_90天': (60, 90),
+    '长期未活跃_120天以上': (120, None)
+}
+# 重新激活：本期有消费，且在本期开始前 [180, 90) 天内有过消费
+REACTIVATION_WINDOW = (90, 180)
+# 财务分析中计算滚动环比的周数和指标（名称: 周度财务表的列）
+TRAILING_WEEKS = 4
+TRAILING_METRICS = {'销售收入': '销售收入', '订单量': '订单量'}
+
 def connect_to_db(db_path: str) -> sqlite3.Connection:
     """Efficiently connect to SQLite database"""
     return sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
@@ -35,93 +58,45 @@ def calculate_user_intervals(orders_df: pd.DataFrame) -> pd.DataFrame:
 
 def analyze_order(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     """合并的订单优化和升舱分析"""
-    # 确保时间列是datetime格式并提取月份
-    space_df['月份'] = space_df['预定开始时间'].dt.strftime('%Y-%m')
-    space_df['升舱标记'] = (space_df['升舱'] == '是').astype(int)
-    
-    # 1. 升舱分析 - 按月和订单商品名统计
-    # 升舱订单量表
-    upgrade_count = pd.pivot_table(
-        space_df,
-        values='升舱标记',
-        index='月份',
-        columns='订单商品名',
-        aggfunc='sum',
-        fill_value=0
-    ).reset_index()
-    
-    # 升舱金额表
-    upgrade_amount = pd.pivot_table(
-        space_df[space_df['升舱标记'] == 1],
-        values='实付金额',
-        index='月份',
-        columns='订单商品名',
-        aggfunc='sum',
-        fill_value=0
-    ).reset_index()
-    
-    # 升舱订单量占比表
-    upgrade_temp = pd.pivot_table(
-        space_df,
-        values=['升舱标记', '订单编号'],
-        index=['月份', '订单商品名'],
-        aggfunc={
-            '升舱标记': 'sum',
-            '订单编号': 'count'
-        },
-        fill_value=0
-    ).reset_index()
-    
-    upgrade_ratio = pd.pivot_table(
-        upgrade_temp,
-        values='升舱标记',
-        index='月份',
-        columns='订单商品名',
-        aggfunc=lambda x: (x / upgrade_temp.loc[x.index, '订单编号'] * 100).round(1),
-        fill_value=0
-    ).reset_index()
-    
-    # 2. 加钟分析 - 时长总计表
-    overtime_duration = pd.pivot_table(
-        space_df[space_df['加钟数'] > 0],
-        values='加钟数',
-        index='月份',
-        columns='订单商品名',
-        aggfunc='sum',
-        fill_value=0
-    ).reset_index()
-    
-    # 加钟收入总计表
-    overtime_revenue = pd.pivot_table(
-        space_df[space_df['加钟数'] > 0],
-        values='实付金额',
-        index='月份',
-        columns='订单商品名',
-        aggfunc='sum',
-        fill_value=0
-    ).reset_index()
-    
+    upgraded = space_df['升舱'] == '是'
+    overtime = space_df['加钟数'] > 0
+    booked = space_df['临时/预约'] == '预约'
+
+    # 按 (月份, 订单商品名) 一次分组聚合所有指标
+    # 只统计升舱 / 加钟订单的金额和时长乘以对应标记，其余订单计为 0，保留原列的数据类型
+    monthly = pd.DataFrame({
+        '月份': space_df['预定开始时间'].dt.to_period('M'),
+        '订单商品名': space_df['订单商品名'],
+        '订单量': space_df['订单编号'].notna().astype(int),
+        '升舱订单量': upgraded.astype(int),
+        '升舱金额': space_df['实付金额'] * upgraded,
+        '加钟订单量': overtime.astype(int),
+        '加钟总时长': space_df['加钟数'] * overtime,
+        '加钟收入': space_df['实付金额'] * overtime,
+        '预约订单量': booked.astype(int)
+    }).groupby(['月份', '订单商品名']).sum()
+    # 先按月份 Period 分组，聚合后再格式化，避免逐行 strftime
+    monthly.index = monthly.index.set_levels(monthly.index.levels[0].strftime('%Y-%m'), level='月份')
+
+    def to_table(values: pd.Series) -> pd.DataFrame:
+        """展开为 月份 × 订单商品名 的表，缺少的组合填 0"""
+        return values.unstack('订单商品名', fill_value=0).reset_index()
+
+    # 金额和时长表只包含有升舱 / 加钟订单的月份和商品
+    has_upgrade = monthly['升舱订单量'] > 0
+    has_overtime = monthly['加钟订单量'] > 0
+
+    # 1. 升舱分析 - 升舱订单量、升舱金额、升舱订单量占比
+    upgrade_count = to_table(monthly['升舱订单量'])
+    upgrade_amount = to_table(monthly.loc[has_upgrade, '升舱金额'])
+    upgrade_ratio = to_table((monthly['升舱订单量'] / monthly['订单量'] * 100).round(1))
+
+    # 2. 加钟分析 - 时长总计表、收入总计表
+    overtime_duration = to_table(monthly.loc[has_overtime, '加钟总时长'])
+    overtime_revenue = to_table(monthly.loc[has_overtime, '加钟收入'])
+
     # 3. 预约分析
-    space_df['预约标记'] = (space_df['临时/预约'] == '预约').astype(int)
-    booking_temp = pd.pivot_table(
-        space_df,
-        values=['预约标记', '订单编号'],
-        index=['月份', '订单商品名'],
-        aggfunc={
-            '预约标记': 'sum',
-            '订单编号': 'count'
-        },
-        fill_value=0
-    ).reset_index()
-    
-    booking_analysis = pd.pivot_table(
-        booking_temp,
-        values='预约标记',
-        index='月份',
-        columns='订单商品名',
-        aggfunc=lambda x: (x / booking_temp.loc[x.index, '订单编号'] * 100).round(1),
-        fill_value=0
-    ).reset_index()
+    booking_analysis = to_table((monthly['预约订单量'] / monthly['订单量'] * 100).round(1))
     
     return {
         '月升舱订单量_bar': upgrade_count,
@@ -133,68 +108,95 @@ def analyze_order(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     }
 
 
-def analyze_member(member_df: pd.DataFrame, db_path: str) -> Dict[str, pd.DataFrame]:
+def period_positions(times: np.ndarray, starts: pd.DatetimeIndex, ends: pd.DatetimeIndex) -> np.ndarray:
+    """每个时间所在统计期的位置（starts[i] <= t <= ends[i]），统计期按开始时间排序且互不重叠，不在任何统计期内为 -1"""
+    starts = starts.to_numpy()
+    position = np.searchsorted(starts, times, side='right') - 1
+    inside = position >= 0
+    inside[inside] = times[inside] <= ends.to_numpy()[position[inside]]
+    return np.where(inside, position, -1)
+
+def churn_counts(last_times: np.ndarray, period_ends: pd.DatetimeIndex, windows: Dict = CHURN_WINDOWS) -> pd.DataFrame:
+    """
+    每个统计日各流失窗口内的用户数。last_times 为排序后的每个用户最后消费时间，
+    窗口 (a, b) 统计最后消费时间在 [统计日 - b 天, 统计日 - a 天) 内的用户，
+    每个窗口对所有统计日各做一次二分查找，统计日可以是月末、周末等任意时间点
+    """
+    ends = period_ends.to_numpy()
+    counts = {}
+    for name, (min_days, max_days) in windows.items():
+        upper = np.searchsorted(last_times, ends - np.timedelta64(min_days, 'D'), side='left')
+        lower = 0 if max_days is None else np.searchsorted(last_times, ends - np.timedelta64(max_days, 'D'), side='left')
+        counts[name] = upper - lower
+    return pd.DataFrame(counts, index=period_ends)
+
+def reactivated_counts(users: np.ndarray, times: np.ndarray, period_starts: pd.DatetimeIndex,
+                       period_ends: pd.DatetimeIndex, window: Tuple[int, int] = REACTIVATION_WINDOW) -> np.ndarray:
+    """
+    每个统计期重新激活的用户数：本期有消费，且在本期开始前 [window[1], window[0]) 天内有过消费。
+    一个订单能激活的统计期，开始时间落在 (下单时间 + window[0] 天, 下单时间 + window[1] 天]，
+    在排序的开始时间上二分查找得到统计期区间，再与本期活跃的 (用户, 统计期) 取交集
+    """
+    n = len(period_starts)
+    starts = period_starts.to_numpy()
+    period = period_positions(times, period_starts, period_ends)
+    active = np.unique(users[period >= 0].astype(np.int64) * n + period[period >= 0])
+
+    first = np.searchsorted(starts, times + np.timedelta64(window[0], 'D'), side='right')
+    last = np.searchsorted(starts, times + np.timedelta64(window[1], 'D'), side='right')
+    lengths = last - first
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    candidates = np.repeat(users.astype(np.int64) * n + first, lengths) + offsets
+
+    reactivated = np.intersect1d(active, candidates)
+    return np.bincount(reactivated % n, minlength=n)
+
+def analyze_member(member_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     """合并后的会员分析函数"""
     member_df = calculate_user_intervals(member_df)
     unique_months = sorted(member_df['订单月'].unique())
-    last_order_dates = member_df.groupby('手机号')['预定开始时间'].max().reset_index()
+    month_starts = pd.DatetimeIndex([month.to_timestamp() for month in unique_months])
+    month_ends = pd.DatetimeIndex([month.to_timestamp('M') for month in unique_months])
     first_order_dates = member_df.groupby('手机号')['预定开始时间'].min().reset_index()
-    
-    # 初始化结果列表
-    monthly_metrics = []
-    
-    for period_month in unique_months:
-        month_start = period_month.to_timestamp()
-        month_end = period_month.to_timestamp('M')
-        
-        # 当前月数据
-        current_month_orders = member_df[(member_df['预定开始时间'] >= month_start) & 
-                                       (member_df['预定开始时间'] <= month_end)]
-        active_users = current_month_orders['手机号'].nunique()
-        
-        # 新增用户
-        new_users = len(first_order_dates[(first_order_dates['预定开始时间'] >= month_start) &
-                                        (first_order_dates['预定开始时间'] <= month_end)]['手机号'].unique())
-        
-        # 流失相关
-        churn_30_60 = len(last_order_dates[(last_order_dates['预定开始时间'] < month_end - timedelta(days=30)) &
-                                         (last_order_dates['预定开始时间'] >= month_end - timedelta(days=60))]['手机号'].unique())
-        churn_60_90 = len(last_order_dates[(last_order_dates['预定开始时间'] < month_end - timedelta(days=60)) &
-                                         (last_order_dates['预定开始时间'] >= month_end - timedelta(days=90))]['手机号'].unique())
-        churn_long = len(last_order_dates[last_order_dates['预定开始时间'] < month_end - timedelta(days=120)]['手机号'].unique())
-        
-        # 重新激活用户
-        prev_users = member_df[(member_df['预定开始时间'] < month_start - timedelta(days=90)) &
-                             (member_df['预定开始时间'] >= month_start - timedelta(days=180))]['手机号'].unique()
-        reactivated = len(current_month_orders[current_month_orders['手机号'].isin(prev_users)]['手机号'].unique())
-        
-        # 计算回购用户
-        # 老用户：本月前有消费记录且本月有消费
-        past_users = member_df[member_df['预定开始时间'] < month_start]['手机号'].unique()
-        old_active_users = current_month_orders[current_month_orders['手机号'].isin(past_users)]['手机号'].unique()
-
-        # 新用户：本月两单以上且间隔1天
-        new_users_set = member_df[member_df['预定开始时间'] >= month_start]['手机号'].unique()
-        new_orders = current_month_orders[current_month_orders['手机号'].isin(new_users_set)]
-        new_repurchase_users = new_orders.groupby('手机号').filter(
-            lambda x: len(x) > 1 and (x['预定开始时间'].max() - x['预定开始时间'].min()).days >= 1
-        )['手机号'].unique()
-
-        # 回购用户总数
-        repurchase_users = len(set(old_active_users) | set(new_repurchase_users))
-        
-        monthly_metrics.append({
-            '订单月': str(period_month),
-            '活跃用户': active_users,
-            '新增用户': new_users,
-            '流失预警_30_60天': churn_30_60,
-            '流失预警_60_90天': churn_60_90,
-            '长期未活跃_120天以上': churn_long,
-            '重新激活用户': reactivated,
-            '回购用户': repurchase_users
-        })
-    
-    counts_df = pd.DataFrame(monthly_metrics)
+
+    users = member_df['手机号']
+    times = member_df['预定开始时间']
+    codes, _ = pd.factorize(users)
+    valid = codes >= 0
+    codes = codes[valid]
+    order_times = times.to_numpy()[valid]
+    per_user = pd.Series(order_times).groupby(codes)
+    first_times = per_user.min().to_numpy()
+    last_times = np.sort(per_user.max().to_numpy())
+
+    # 每个订单所在的统计月：月初 0 点到月末当天 0 点（与 to_timestamp('M') 相同）
+    period = period_positions(order_times, month_starts, month_ends)
+    in_period = period >= 0
+    current = pd.DataFrame({
+        'period': period[in_period],
+        'user': codes[in_period],
+        'time': order_times[in_period]
+    })
+    per_period_user = current.groupby(['period', 'user'])['time'].agg(['size', 'min', 'max']).reset_index()
+    n = len(unique_months)
+
+    # 回购用户：本月前有消费记录（老用户），或本月两单以上且首末单间隔 1 天以上
+    old_user = first_times[per_period_user['user']] < month_starts.to_numpy()[per_period_user['period']]
+    repeat_user = ((per_period_user['size'] > 1) &
+                   (per_period_user['max'] - per_period_user['min'] >= pd.Timedelta(days=1)))
+    first_period = period_positions(first_times, month_starts, month_ends)
+
+    counts_df = pd.DataFrame({
+        '订单月': [str(month) for month in unique_months],
+        '活跃用户': np.bincount(per_period_user['period'], minlength=n),
+        '新增用户': np.bincount(first_period[first_period >= 0], minlength=n)
+    })
+    # 流失相关：所有月末在排序后的最后消费时间上二分查找
+    churn = churn_counts(last_times, month_ends)
+    for name in CHURN_WINDOWS:
+        counts_df[name] = churn[name].to_numpy()
+    counts_df['重新激活用户'] = reactivated_counts(codes, order_times, month_starts, month_ends)
+    counts_df['回购用户'] = np.bincount(per_period_user['period'][old_user | repeat_user], minlength=n)
     
     # 计算按月和会员等级的统计
     monthly_level_stats = member_df.groupby(['订单月', '等级']).agg({
@@ -243,109 +245,94 @@ def analyze_member(member_df: pd.DataFrame, db_path: str) -> Dict[str, pd.DataFr
 
 
 def analyze_users(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-    # 设置时间范围
-    today = space_df['预定开始时间'].max()
-    begin_day = today - timedelta(days=180)  # 统计关注6个月的用户
-    # 过滤过去6个月的数据
-    df_filtered = space_df[space_df['预定开始时间'] >= begin_day].copy()
-    
-    # 按手机号聚合计算所需指标
-    rfm_analysis = df_filtered.groupby('手机号').agg({
-        '预定开始时间': 'max',  # 最近一次消费时间
-        '实付金额': 'sum',  # 总消费金额
-        '订单编号': 'count'  # 消费次数
-    }).reset_index()
-    
-    # 重命名列
-    rfm_analysis.columns = ['手机号', '最近消费时间', '总消费金额', '消费次数']
-    rfm_analysis['Recency'] = (today - rfm_analysis['最近消费时间']).dt.days
-    # 计算最近购买时间指数: e^(-λ * Recency), λ=0.0115，对应60天指数下降到50分位
-    lambda_param = 0.0115
-    rfm_analysis['最近一次消费指数'] = np.exp(-lambda_param * rfm_analysis['Recency']) * 100
-    
-    # 计算原始的消费力和消费频次指数
-    rfm_analysis['monetary_raw'] = np.log(rfm_analysis['总消费金额'] + 1)
-    rfm_analysis['frequency_raw'] = np.log(rfm_analysis['消费次数'] + 1)
+    """用户价值（RFM模型）：按手机号统计，分布图使用近 RFM_PARAMS['days'] 天的数据"""
+    scored = ideapod_rfm.score_customers(
+        space_df['手机号'], space_df['预定开始时间'], space_df['实付金额'], space_df['订单编号'],
+        RFM_PARAMS, windows=set(ideapod_rfm.RFM_WINDOWS) | {RFM_PARAMS['days']}
+    )
+    distribution_result = ideapod_rfm.score_distribution(scored[scored['窗口天数'] == RFM_PARAMS['days']])
+    distribution_result = distribution_result.rename(columns={'最近一次消费指数分布': '最后一次消费指数分布'})
+        
+    return {
+        '用户价值分布（RFM模型）_bar': distribution_result,
+        '用户价值分层_table': ideapod_rfm.segment_table(scored)
+    }
 
-    # 新算法：以理论最小值 0 为基准，最大值拉到 100
-    monetary_max = rfm_analysis['monetary_raw'].max()
-    rfm_analysis['消费力指数'] = (rfm_analysis['monetary_raw'] / monetary_max) * 100
-    
-    frequency_max = rfm_analysis['frequency_raw'].max()
-    rfm_analysis['消费频次指数'] = (rfm_analysis['frequency_raw'] / frequency_max) * 100
-     
-    # 加权计算user_value
-    weight_monetary = 0.6  
-    weight_frequency = 1 - weight_monetary
-    
-    rfm_analysis['用户价值'] = (
-        rfm_analysis['最近一次消费指数'] * 
-        (rfm_analysis['消费力指数'] * weight_monetary + 
-         rfm_analysis['消费频次指数'] * weight_frequency)
-    ) / 100
-
-    # 创建0-100的区间（以1为间隔）
-    bins = np.arange(0, 101, 1)
-    
-    # 对四个指标进行分布统计
-    value_dist = pd.cut(rfm_analysis['用户价值'], bins=bins, include_lowest=True).value_counts().sort_index()
-    recency_dist = pd.cut(rfm_analysis['最近一次消费指数'], bins=bins, include_lowest=True).value_counts().sort_index()
-    monetary_dist = pd.cut(rfm_analysis['消费力指数'], bins=bins, include_lowest=True).value_counts().sort_index()
-    frequency_dist = pd.cut(rfm_analysis['消费频次指数'], bins=bins, include_lowest=True).value_counts().sort_index()
-    
-    # 创建包含0-99的第一列（匹配100个区间）
-    score_range = pd.Series(range(1, 101), name='分数区间')
-    
-    # 创建结果DataFrame
-    distribution_result = pd.DataFrame({
-        '分数区间': score_range,
-        '用户价值分布': value_dist.values,
-        '最后一次消费指数分布': recency_dist.values,
-        '消费力指数分布': monetary_dist.values,
-        '消费频次指数分布': frequency_dist.values
+# 周度财务的部分聚合合并规则：各周的和与计数相加，(订单周, 手机号) 取并集
+FINANCE_MERGE = {
+    'weekly': {'订单量': 'sum', '销售收入': 'sum', '实付笔数': 'sum', '总使用时长': 'sum', '时长笔数': 'sum'},
+    'members': 'distinct'
+}
+
+def finance_partial(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """周度财务的部分聚合：各周的和与计数，以及各周出现过的手机号，可按 FINANCE_MERGE 合并"""
+    weekly = space_df.groupby('订单周').agg(
+        订单量=('订单编号', 'count'),
+        销售收入=('实付金额', 'sum'),
+        实付笔数=('实付金额', 'count'),
+        总使用时长=('实际时长', 'sum'),
+        时长笔数=('实际时长', 'count')
+    )
+    members = space_df[['订单周', '手机号']].dropna().drop_duplicates().set_index(['订单周', '手机号'])
+    return {'weekly': weekly, 'members': members}
+
+def finance_tables(partial: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """由（合并后的）部分聚合生成周度财务表：均值 = 和 / 非空计数"""
+    weekly = partial['weekly']
+    active = partial['members'].index.get_level_values('订单周').value_counts()
+    weekly_analysis = pd.DataFrame({
+        '订单周': weekly.index.astype(str),
+        '销售收入': weekly['销售收入'].to_numpy(),
+        '订单量': weekly['订单量'].to_numpy(),
+        '平均订单金额': (weekly['销售收入'] / weekly['实付笔数']).to_numpy(),
+        '活跃会员数': active.reindex(weekly.index, fill_value=0).to_numpy(),
+        '总使用时长': weekly['总使用时长'].to_numpy(),
+        '平均使用时长': (weekly['总使用时长'] / weekly['时长笔数']).to_numpy()
     })
-        
     return {
-        '用户价值分布（RFM模型）_bar': distribution_result
+        '财务分析_bar': weekly_analysis,
+        '过去四周环比(%)_line': ideapod_kpi.trailing_change_table(weekly_analysis, '订单周', TRAILING_METRICS, TRAILING_WEEKS)
     }
 
 def analyze_finance(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     """周度财务分析"""
-    
-    weekly_analysis = space_df.groupby('订单周').agg({
-        '订单编号': 'count',  
-        '实付金额': ['sum', 'mean'],
-        '手机号': 'nunique',
-        '实际时长': ['sum', 'mean']
-    })
-    
-    weekly_analysis.columns = ['订单量', '销售收入', '平均订单金额', '活跃会员数', '总使用时长', '平均使用时长']
-    weekly_analysis = weekly_analysis.reset_index()
-    weekly_analysis['订单周'] = weekly_analysis['订单周'].astype(str)
-    weekly_analysis = weekly_analysis[['订单周', '销售收入', '订单量', '平均订单金额', '活跃会员数', '总使用时长', '平均使用时长']]
-    return {'财务分析_bar': weekly_analysis}
+    return finance_tables(finance_partial(space_df))
 
-def analyze_space(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-    """空间分析"""
+# 有效时间段和每日可用时长：心流舱 7:00 - 24:00 (17小时)，其他空间 9:00 - 20:00 (11小时)
+def _is_flow_pod(products: pd.Series) -> pd.Series:
+    return products.astype(object).str.contains('心流舱', na=False, regex=False)
+
+def product_daily_hours(products: pd.Series) -> np.ndarray:
+    """各商品每日可用时长"""
+    return np.where(_is_flow_pod(products), 17, 11)
+
+def product_valid_hours(products: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """各商品可用的第一个和最后一个整点（含）"""
+    flow_pod = _is_flow_pod(products)
+    return np.where(flow_pod, 7, 9), np.where(flow_pod, 23, 20)
 
-    # 过滤时间和商品名
-    filtered_space_df = space_df[
+def weekday_day_counts(months: pd.Series) -> pd.Series:
+    """各月份中周一到周日各有几天，索引为 (订单月, weekday)"""
+    months = months.dropna()
+    if months.empty:
+        return pd.Series(dtype='int64', index=pd.MultiIndex.from_arrays([[], []], names=['订单月', 'weekday']))
+    days = pd.date_range(months.min().start_time, months.max().end_time.normalize())
+    calendar = pd.DataFrame({
+        '订单月': days.to_period('M'),
+        'weekday': days.day_name().map(WEEKDAY_MAP)
+    })
+    return calendar.groupby(['订单月', 'weekday']).size()
+
+def filter_space_products(space_df: pd.DataFrame) -> pd.DataFrame:
+    """空间产品分析使用的订单：2023-09-19 之后，不含丛林小剧院和丛林心流舱"""
+    return space_df[
         (space_df['预定开始时间'] >= '2023-09-19') & 
         (~space_df['订单商品名'].isin(['丛林小剧院', '丛林心流舱']))
     ]
-    # 定义有效时间段和每日可用时长
-    def get_valid_time_range(product_name):
-        if isinstance(product_name, str) and '心流舱' in product_name:
-            return (time(7, 0), time(23, 59, 59))  # 7:00 - 24:00 (17小时)
-        return (time(9, 0), time(20, 0))  # 9:00 - 20:00 (11小时)
-    
-    def get_daily_hours(product_name):
-        if isinstance(product_name, str) and '心流舱' in product_name:
-            return 17  # 7:00 - 24:00 (17小时)
-        return 11  # 9:00 - 20:00 (11小时)
 
-    # 高峰时段分析
-    peak_analysis = filtered_space_df.groupby('开始使用时刻').agg({
+def analyze_peak_hours(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """高峰时段分析"""
+    peak_analysis = space_df.groupby('开始使用时刻').agg({
         '订单编号': 'count',
         '实付金额': 'sum'
     }).reset_index()
@@ -354,126 +341,87 @@ def analyze_space(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     peak_analysis['收入占比'] = np.where(total_revenue == 0, 0, peak_analysis['实付金额'] / total_revenue * 100)
     peak_analysis['订单占比'] = np.where(total_orders == 0, 0, peak_analysis['订单编号'] / total_orders * 100)
     peak_analysis.columns = ['开始使用时刻', '订单量', '收入', '收入占比', '订单占比']
-    
-    results = {'高峰时段分析_bar': peak_analysis}
+    return {'高峰时段分析_bar': peak_analysis}
+
+def analyze_space_metrics(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """各区基本指标 (订单量, 收入, 总时长, 单均时长，利用率)"""
+    results = {}
+    weekly = space_df.groupby(['订单周', '订单商品名']).agg(
+        收入=('实付金额', 'sum'),
+        订单量=('订单编号', 'count'),
+        总时长=('实际时长', 'sum'),
+        单均时长=('实际时长', 'mean')
+    )
+    # 利用率(%) = 实际时长 / (每日可用时长 * 7天)，最高 100
+    max_weekly_hours = product_daily_hours(weekly.index.get_level_values('订单商品名').to_series()) * 7
+    weekly['利用率'] = (weekly['总时长'] / max_weekly_hours * 100).clip(upper=100)
+    weekly = weekly.reset_index().rename(columns={'订单商品名': '空间类型'})
+    # 转换周为字符串格式
+    weekly['订单周'] = weekly['订单周'].astype(str)
 
-    # 基本指标分析 (订单量, 收入, 总时长, 单均时长，利用率)
     for metric in ['收入', '订单量','总时长', '单均时长', '利用率']:
         try:
-            if metric == '订单量':
-                df = filtered_space_df.groupby(['订单周', '订单商品名'])['订单编号'].count().reset_index()
-                df.columns = ['订单周', '空间类型', '订单量']
-            elif metric == '收入':
-                df = filtered_space_df.groupby(['订单周', '订单商品名'])['实付金额'].sum().reset_index()
-                df.columns = ['订单周', '空间类型', '收入']
-            elif metric == '总时长':
-                df = filtered_space_df.groupby(['订单周', '订单商品名'])['实际时长'].sum().reset_index()
-                df.columns = ['订单周', '空间类型', '总时长']
-            elif metric == '单均时长':
-                df = filtered_space_df.groupby(['订单周', '订单商品名'])['实际时长'].mean().reset_index()
-                df.columns = ['订单周', '空间类型', '单均时长']
-            elif metric == '利用率':
-                # 利用率计算 - 每周每个空间类型的利用率
-                weekly_products = []
-                
-                for (week, product_name), group in filtered_space_df.groupby(['订单周', '订单商品名']):
-                    daily_hours = get_daily_hours(product_name)
-                    max_weekly_hours = daily_hours * 7
-                    actual_hours = group['实际时长'].sum()
-                    
-                    # 计算利用率(%)
-                    utilization = min(100, (actual_hours / max_weekly_hours) * 100) if max_weekly_hours > 0 else 0
-
-                    weekly_products.append({
-                        '订单周': week,
-                        '空间类型': product_name,
-                        '利用率': utilization
-                    })
-                
-                df = pd.DataFrame(weekly_products)
-            
-            # 转换周为字符串格式
-            df['订单周'] = df['订单周'].astype(str)
-            
             # 透视表转换结果
-            pivot_df = df.pivot(index='订单周', columns='空间类型', values=df.columns[-1])
+            pivot_df = weekly.pivot(index='订单周', columns='空间类型', values=metric)
             results[f'各区{metric}_bar'] = pivot_df.reset_index().rename_axis(None, axis=1)
         
         except Exception as e:
             logging.error(f"[Space] Error in '{metric}' calculation: {str(e)}")
             # 如果出错，创建一个空的DataFrame作为结果
             results[f'各区{metric}_bar'] = pd.DataFrame(columns=['订单周'])
+    return results
 
-    # 周度日内使用率_bar (按分钟计算使用率)
+def analyze_hourly_usage(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    周度日内使用率_bar (按分钟计算使用率)
+    每周每个整点（7-23点）各商品在该周7天内的使用分钟 / (60 * 7)，再对该整点在营业时间内的商品取平均
+    """
+    results = {}
     try:
-        # 按周整理数据并计算
-        hourly_usage_data = []
-        
-        for week, week_df in filtered_space_df.groupby('订单周'):
-            # 获取该周的所有日期
-            week_start = pd.Timestamp(week)
-            week_dates = [week_start + timedelta(days=i) for i in range(7)]
-            # 收集有订单的商品类型
-            products = week_df['订单商品名'].unique()
-            
-            # 遍历每个小时 (7-23点)
-            for hour in range(7, 24):
-                product_usage = {}
-                valid_products = 0
-                
-                # 对每种商品分别计算
-                for product in products:
-                    # 检查该小时是否在商品的有效时间范围内
-                    valid_start, valid_end = get_valid_time_range(product)
-                    if hour < valid_start.hour or hour > valid_end.hour:
-                        continue
-                    
-                    # 找出该商品在该周的所有订单
-                    product_orders = week_df[week_df['订单商品名'] == product]
-                    
-                    # 计算该商品在这个小时的总使用分钟
-                    total_minutes_used = 0
-                    
-                    # 遍历该周的每一天
-                    for date in week_dates:
-                        # 当天该小时的开始和结束时间
-                        hour_start = pd.Timestamp(date.year, date.month, date.day, hour, 0, 0)
-                        hour_end = pd.Timestamp(date.year, date.month, date.day, hour, 59, 59)
-                        
-                        # 遍历订单，检查是否有订单在这个时间段内
-                        for _, order in product_orders.iterrows():
-                            start_time = order['预定开始时间']
-                            end_time = order['预定结束时间']
-                            
-                            # 检查订单是否与当前小时有重叠
-                            if start_time <= hour_end and end_time >= hour_start:
-                                # 计算重叠的分钟数
-                                overlap_start = max(start_time, hour_start)
-                                overlap_end = min(end_time, hour_end)
-                                overlap_minutes = (overlap_end - overlap_start).total_seconds() / 60
-                                total_minutes_used += overlap_minutes
-                    
-                    # 该商品这个小时在整周的总可用分钟 = 60分钟 * 7天
-                    total_available_minutes = 60 * 7
-                    
-                    # 计算使用率
-                    usage_rate = min(100, (total_minutes_used / total_available_minutes) * 100)
-                    product_usage[product] = usage_rate
-                    valid_products += 1
-                
-                # 所有有效商品的平均使用率
-                avg_usage = sum(product_usage.values()) / valid_products if valid_products > 0 else 0
-                
-                hourly_usage_data.append({
-                    '订单周': str(week),
-                    '小时': f"{hour}点",
-                    '使用率': avg_usage
-                })
-        
-        # 创建DataFrame并透视
-        hourly_df = pd.DataFrame(hourly_usage_data)
+        space_df = space_df[space_df['订单周'].notna()]
+        hours = np.arange(7, 24)
+
+        # 每周有订单的商品，在各自营业时间内的每个整点使用率默认为 0
+        products = space_df[['订单周', '订单商品名']].drop_duplicates()
+        first_hour, last_hour = product_valid_hours(products['订单商品名'])
+        grid = products.loc[products.index.repeat(len(hours))].reset_index(drop=True)
+        grid['小时'] = np.tile(hours, len(products))
+        grid = grid[(grid['小时'] >= np.repeat(first_hour, len(hours))) &
+                    (grid['小时'] <= np.repeat(last_hour, len(hours)))]
+
+        # 每个订单展开为它覆盖的整点（限制在所属订单周的7天内），计算与每个整点的重叠秒数
+        orders = space_df.dropna(subset=['预定开始时间', '预定结束时间'])
+        week_start = pd.to_datetime(orders['订单周'])
+        first_slot = np.maximum(orders['预定开始时间'].dt.floor('h'), week_start)
+        last_slot = np.minimum(orders['预定结束时间'].dt.floor('h'), week_start + pd.Timedelta(days=7) - pd.Timedelta(hours=1))
+        slot_counts = ((last_slot - first_slot) // pd.Timedelta(hours=1) + 1).clip(lower=0).astype(int)
+        position = np.repeat(np.arange(len(orders)), slot_counts)
+        offsets = np.arange(len(position)) - np.repeat(slot_counts.cumsum().to_numpy() - slot_counts.to_numpy(), slot_counts)
+        slot_start = first_slot.to_numpy()[position] + offsets * np.timedelta64(1, 'h')
+        slot_end = slot_start + np.timedelta64(3599, 's')  # 到 hh:59:59
+        start_time = orders['预定开始时间'].to_numpy()[position]
+        end_time = orders['预定结束时间'].to_numpy()[position]
+        overlap = (np.minimum(end_time, slot_end) - np.maximum(start_time, slot_start)) / np.timedelta64(1, 's')
+        slots = pd.DataFrame({
+            '订单周': orders['订单周'].to_numpy()[position],
+            '订单商品名': orders['订单商品名'].to_numpy()[position],
+            '小时': pd.DatetimeIndex(slot_start).hour,
+            '使用秒数': np.where((start_time <= slot_end) & (end_time >= slot_start), overlap, 0)
+        })
+        used = slots.groupby(['订单周', '订单商品名', '小时'])['使用秒数'].sum()
+
+        # 该商品这个小时在整周的总可用分钟 = 60分钟 * 7天；营业时间外的使用不计入
+        grid = grid.join(used, on=['订单周', '订单商品名', '小时'])
+        grid['使用率'] = (grid['使用秒数'].fillna(0) / 60 / (60 * 7) * 100).clip(upper=100)
+
+        # 所有有效商品的平均使用率，没有有效商品的整点为 0
+        hourly_df = grid.groupby(['订单周', '小时'])['使用率'].mean().reset_index()
         if not hourly_df.empty:
-            hourly_pivot = hourly_df.pivot(index='订单周', columns='小时', values='使用率').fillna(0)
+            hourly_df['订单周'] = hourly_df['订单周'].astype(str)
+            hourly_df['小时'] = hourly_df['小时'].astype(str) + '点'
+            hourly_pivot = hourly_df.pivot(index='订单周', columns='小时', values='使用率')
+            # 补齐每周 7-23 点
+            hourly_pivot = hourly_pivot.reindex(columns=sorted(f"{hour}点" for hour in hours)).fillna(0)
             results['周度日内使用率_bar'] = hourly_pivot.reset_index()
         else:
             # 空结果
@@ -482,133 +430,82 @@ def analyze_space(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     except Exception as e:
         logging.error(f"[Space] Error in hourly utilization calculation: {str(e)}")
         results['周度日内使用率_bar'] = pd.DataFrame(columns=['订单周'])
+    return results
 
-    # 周内使用率_bar (按星期几分析)
+def analyze_weekday_usage(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    周内使用率_bar (按星期几分析)
+    每月每个星期几各商品的实际时长 / (每日可用时长 * 该月该星期几的天数)，再对有订单的商品取平均
+    """
+    results = {}
     try:
-        
-        weekday_order = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-        
-        weekday_map = {
-            'Monday': '周一', 'Tuesday': '周二', 'Wednesday': '周三', 
-            'Thursday': '周四', 'Friday': '周五', 'Saturday': '周六', 'Sunday': '周日'
-        }
-        # 周内使用率数据
-        weekday_usage_data = []
-        
-        for month, month_df in filtered_space_df.groupby('订单月'):
-            month_str = str(month)
-            month_data = {'月份': month_str}
-            
-            # 获取该月每个星期的天数
-            month_start = pd.Period(month).start_time
-            month_end = pd.Period(month).end_time
-            days_in_month = pd.date_range(start=month_start, end=month_end)
-            weekday_counts = {day: 0 for day in weekday_order}
-            
-            for day in days_in_month:
-                day_name = weekday_map.get(day.day_name())
-                if day_name:
-                    weekday_counts[day_name] += 1
-            
-            # 计算每个星期的使用率
-            for weekday in weekday_order:
-                # 筛选该星期的数据
-                weekday_df = month_df[month_df['weekday'] == weekday]
-                
-                if weekday_df.empty or weekday_counts[weekday] == 0:
-                    month_data[weekday] = 0
-                    continue
-                
-                # 收集该星期不同商品的使用率
-                product_usages = []
-                products = weekday_df['订单商品名'].unique()
-                
-                for product in products:
-                    # 筛选该商品的订单
-                    product_df = weekday_df[weekday_df['订单商品名'] == product]
-                    
-                    # 计算该商品在该星期的使用率
-                    daily_hours = get_daily_hours(product)
-                    total_available_hours = daily_hours * weekday_counts[weekday]
-                    total_used_hours = product_df['实际时长'].sum()
-                    
-                    # 计算使用率
-                    usage_rate = min(100, (total_used_hours / total_available_hours) * 100) if total_available_hours > 0 else 0
-                    product_usages.append(usage_rate)
-                
-                # 所有商品的平均使用率
-                avg_usage = sum(product_usages) / len(product_usages) if product_usages else 0
-                month_data[weekday] = avg_usage
-            
-            weekday_usage_data.append(month_data)
-        
-        # 创建DataFrame
-        weekday_df = pd.DataFrame(weekday_usage_data)
+        usage = space_df.groupby(['订单月', 'weekday', '订单商品名'])['实际时长'].sum()
+        # 可用时长表：商品每日可用时长 × 日历中的天数
+        day_counts = weekday_day_counts(space_df['订单月'])
+        day_counts = day_counts.reindex(usage.index.droplevel('订单商品名')).to_numpy()
+        total_available_hours = product_daily_hours(usage.index.get_level_values('订单商品名').to_series()) * day_counts
+        usage_rate = (usage / total_available_hours * 100).clip(upper=100)
+
+        # 所有商品的平均使用率，没有订单的星期几为 0
+        months = pd.Index(space_df['订单月'].dropna().unique()).sort_values()
+        weekday_df = usage_rate.groupby(['订单月', 'weekday']).mean().unstack('weekday')
+        weekday_df = weekday_df.reindex(index=months, columns=WEEKDAY_ORDER).fillna(0)
         if not weekday_df.empty:
-            # 确保列顺序正确 (月份, 周一, 周二, ...)
-            column_order = ['月份'] + weekday_order 
-            weekday_df = weekday_df.reindex(columns=column_order, fill_value=0)
+            # 列顺序 (月份, 周一, 周二, ...)
+            weekday_df.index = weekday_df.index.astype(str)
+            weekday_df = weekday_df.rename_axis('月份').rename_axis(None, axis=1).reset_index()
             results['周内使用率_bar'] = weekday_df
         else:
             # 空结果
-            empty_df = pd.DataFrame(columns=['月份'] + weekday_order)
-            results['周内使用率_bar'] = empty_df
+            results['周内使用率_bar'] = pd.DataFrame(columns=['月份'] + WEEKDAY_ORDER)
     
     except Exception as e:
         logging.error(f"[Space] Error in weekday utilization calculation: {str(e)}")
-        results['周内使用率_bar'] = pd.DataFrame(columns=['月份'] + ['周一', '周二', '周三', '周四', '周五', '周六', '周日'])
+        results['周内使用率_bar'] = pd.DataFrame(columns=['月份'] + WEEKDAY_ORDER)
+    return results
 
+def analyze_space(space_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """空间分析"""
+    filtered_space_df = filter_space_products(space_df)
+    results = {}
+    results.update(analyze_peak_hours(filtered_space_df))
+    results.update(analyze_space_metrics(filtered_space_df))
+    results.update(analyze_hourly_usage(filtered_space_df))
+    results.update(analyze_weekday_usage(filtered_space_df))
     return results
 
-def convert_keys_to_str(data):
-    if isinstance(data, dict):
-        return {str(k) if isinstance(k, tuple) else k: convert_keys_to_str(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_keys_to_str(item) for item in data]
-    return data
-
-def convert_df_to_dict(data):
-    if isinstance(data, pd.DataFrame):
-        df = data.copy()
-        # 处理时间类型列
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]) or pd.api.types.is_period_dtype(df[col]):
-                df[col] = df[col].astype(str)
-        # 处理时间类型的索引
-        if pd.api.types.is_datetime64_any_dtype(df.index) or pd.api.types.is_period_dtype(df.index):
-            df.index = df.index.astype(str)
-        # 将 NaN 替换为 None，确保 JSON 中为 null
-        return df.replace({np.nan: None}).to_dict(orient='records')
-    elif isinstance(data, dict):
-        return {k: convert_df_to_dict(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_df_to_dict(item) for item in data]
-    elif isinstance(data, (pd.Timestamp, pd.Period)) or pd.isna(data):
-        return str(data) if not pd.isna(data) else None
-    return data
-
-def analyze(conn):
-    try:
-        space_df = pd.read_sql_query("SELECT * FROM Space", conn)
+def prepare_data(space_df: pd.DataFrame) -> pd.DataFrame:
+    """预处理时间列并添加订单月、订单周、开始使用时刻和星期"""
+    # 内部用户付费的也算外部消费
+    # space_df = space_df[space_df['等级'] != 'ideapod']
+    
+    # 预处理数据，不填充数值列的 NaN，保留为 None
+    space_df = preprocess_datetime(space_df)
 
-        # 内部用户付费的也算外部消费
-        # space_df = space_df[space_df['等级'] != 'ideapod']
-        
-        # 预处理数据，不填充数值列的 NaN，保留为 None
-        space_df = preprocess_datetime(space_df)
-
-        space_df['订单月'] = space_df['预定开始时间'].dt.to_period('M')
-        space_df['订单周'] = space_df['预定开始时间'].dt.to_period('W-MON').apply(lambda x: x.start_time.date())
-        space_df['开始使用时刻'] = pd.to_datetime(space_df['预定开始时间'], errors='coerce').dt.hour
-        space_df['weekday'] = space_df['预定开始时间'].dt.day_name()
-        weekday_map = {
-            'Monday': '周一', 'Tuesday': '周二', 'Wednesday': '周三', 
-            'Thursday': '周四', 'Friday': '周五', 'Saturday': '周六', 'Sunday': '周日'
-        }
-        space_df['weekday'] = space_df['weekday'].map(weekday_map)
+    space_df['订单月'] = space_df['预定开始时间'].dt.to_period('M')
+    space_df['订单周'] = space_df['预定开始时间'].dt.to_period('W-MON').dt.start_time.dt.date
+    space_df['开始使用时刻'] = pd.to_datetime(space_df['预定开始时间'], errors='coerce').dt.hour
+    space_df['weekday'] = space_df['预定开始时间'].dt.day_name().map(WEEKDAY_MAP)
+    return space_df
+
+def analyze(conn, start_date=None, end_date=None, lines=None, stores=None):
+    """
+    主分析函数
+    start_date / end_date: 只分析该日期范围（含首尾）内开始的预订，默认全部历史
+    lines: 只分析指定的订单商品名
+    stores: 只分析指定门店的预订，默认全部门店
+    """
+    try:
+        filters = {}
+        if lines:
+            filters['订单商品名'] = lines
+        if stores:
+            filters[ideapod_db.STORE_COLUMN] = stores
+        space_df = ideapod_db.read_table(conn, 'Space', start_date, end_date, filters)
+        space_df = prepare_data(space_df)
 
         order_results = analyze_order(space_df)
-        member_results = analyze_member(space_df, conn)
+        member_results = analyze_member(space_df)
         user_results = analyze_users(space_df)
         financial_results = analyze_finance(space_df)
         space_results = analyze_space(space_df)
@@ -621,12 +518,7 @@ def analyze(conn):
             '用户价值': user_results
         }
 
-        processed_results = {}
-        for category, data in all_results.items():
-            processed_results[category] = {key: convert_df_to_dict(value) for key, value in data.items()}
-        
-        processed_results = convert_keys_to_str(processed_results)
-        return processed_results
+        return all_results
 
     except sqlite3.Error as e:
         return {'error': f"Database error: {e}"}
@@ -0,0 +1,138 @@
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+import pandas as pd
+import ideapod_db
+import ideapod_json
+import ideapod_catering
+import ideapod_space
+import ideapod_group
+
+# 门店维度：Space 和 Catering 的每个订单记录所属门店（ideapod_db.STORE_COLUMN），
+# 导入、更新和各页面分析按门店拆分，在进程池中并行处理，总用时取决于核数而不是门店数
+STORE_COLUMN = ideapod_db.STORE_COLUMN
+STORE_TABLES = ('Space', 'Catering')
+# 没有门店信息的历史订单都属于第一家门店
+DEFAULT_STORE = '上海洛克外滩店'
+# 原始数据中门店列缺失时依次使用的列
+FALLBACK_COLUMNS = ('入账门店',)
+# 订单商品名前的门店前缀，如 '上海洛克外滩店-心流舱·巴赫'
+STORE_PREFIX = r'^\s*(?P<store>[^-\s]+店)-'
+
+# 各门店的结果文件：static/stores/<门店>/<页面>_results.json，整体结果仍为 static/<页面>_results.json
+STORE_RESULTS_DIR = 'static/stores'
+# 页面: (分析函数, 结果文件名)
+ANALYSES = {
+    'space': (ideapod_space.analyze, 'space_results.json'),
+    'catering': (ideapod_catering.analyze, 'catering_results.json'),
+    'group': (ideapod_group.analyze, 'group_results.json')
+}
+
+def _executor(jobs: int) -> ProcessPoolExecutor:
+    # 调用方可能在线程中运行，fork 会复制其他线程持有的锁，工作进程用 spawn 启动
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'))
+
+def _jobs(jobs: Optional[int]) -> int:
+    return max(1, jobs or os.cpu_count() or 1)
+
+def strip_store_prefix(names: pd.Series) -> pd.Series:
+    """去掉订单商品名前的门店前缀，门店另存在门店列中"""
+    return names.str.replace(STORE_PREFIX, '', regex=True)
+
+def assign_store(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    补全门店列：依次使用门店列、FALLBACK_COLUMNS、订单商品名的门店前缀，都没有时为 DEFAULT_STORE
+    """
+    stores = df[STORE_COLUMN].astype(object) if STORE_COLUMN in df.columns else pd.Series(None, index=df.index, dtype=object)
+    candidates = [df[col] for col in FALLBACK_COLUMNS if col in df.columns]
+    if '订单商品名' in df.columns:
+        candidates.append(df['订单商品名'].astype(str).str.extract(STORE_PREFIX)['store'])
+    for candidate in candidates:
+        stores = stores.where(stores.notna() & (stores.astype(str).str.strip() != ''), candidate)
+    df[STORE_COLUMN] = stores.fillna(DEFAULT_STORE).astype(str).str.strip().replace('', DEFAULT_STORE)
+    return df
+
+def ensure_store_column(conn: sqlite3.Connection, table: str) -> bool:
+    """已有的表没有门店列时补上并记为 DEFAULT_STORE（单门店时期的数据），返回是否修改了表"""
+    columns = ideapod_db.table_columns(conn, table)
+    if not columns or STORE_COLUMN in columns:
+        return False
+    conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{STORE_COLUMN}" TEXT')
+    conn.execute(f'UPDATE "{table}" SET "{STORE_COLUMN}" = ?', (DEFAULT_STORE,))
+    conn.commit()
+    logging.info(f"[Store] {table} 表已添加门店列")
+    return True
+
+def list_stores(conn: sqlite3.Connection) -> List[str]:
+    """Space 和 Catering 中出现过的全部门店"""
+    stores = set()
+    for table in STORE_TABLES:
+        if STORE_COLUMN in ideapod_db.table_columns(conn, table):
+            stores.update(row[0] for row in conn.execute(f'SELECT DISTINCT "{STORE_COLUMN}" FROM "{table}"') if row[0])
+    return sorted(stores)
+
+def map_stores(func: Callable[[pd.DataFrame], pd.DataFrame], df: pd.DataFrame, jobs: Optional[int] = 1) -> pd.DataFrame:
+    """
+    按门店拆分后对每个门店的数据调用 func 再拼接，jobs 大于 1 且有多个门店时在进程池中并行
+    func 必须是模块级函数（工作进程中按名称导入），且只做逐行处理，不依赖其他门店的数据
+    """
+    df = assign_store(df)
+    parts = [part for _, part in df.groupby(STORE_COLUMN, sort=True)]
+    jobs = _jobs(jobs)
+    if jobs > 1 and len(parts) > 1:
+        with _executor(min(jobs, len(parts))) as executor:
+            results = list(executor.map(func, parts))
+    else:
+        results = [func(part) for part in parts]
+    return pd.concat(results) if results else func(df)
+
+def results_file(page: str, store: str) -> str:
+    return os.path.join(STORE_RESULTS_DIR, store, ANALYSES[page][1])
+
+def _analyze_store(page: str, store: str, db_path: str) -> Optional[str]:
+    """在工作进程中分析一个门店的一个页面并写入结果文件，返回错误信息或 None"""
+    analyze, _ = ANALYSES[page]
+    conn = ideapod_db.get_db_connection(db_path)
+    try:
+        results = analyze(conn, stores=[store])
+    finally:
+        conn.close()
+    if 'error' in results:
+        return results['error']
+    path = results_file(page, store)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ideapod_json.save_results(results, path)
+    return None
+
+def analyze_stores(pages: Iterable[str] = None, stores: Iterable[str] = None, jobs: Optional[int] = None,
+                   db_path: str = ideapod_db.DB_PATH) -> Dict[tuple, Optional[str]]:
+    """
+    计算各门店的页面结果：每个 (页面, 门店) 为一个任务，在 jobs 个进程（默认为核数）中并行，
+    结果写入 results_file；返回 {(页面, 门店): 错误信息或 None}
+    """
+    pages = [page for page in ANALYSES if page in set(pages or ANALYSES)]
+    if stores is None:
+        conn = ideapod_db.get_db_connection(db_path)
+        try:
+            stores = list_stores(conn)
+        finally:
+            conn.close()
+    tasks = [(page, store) for store in stores for page in pages]
+    started = time.perf_counter()
+    status = {}
+    with _executor(min(_jobs(jobs), max(1, len(tasks)))) as executor:
+        futures = {executor.submit(_analyze_store, page, store, db_path): (page, store) for page, store in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                status[task] = future.result()
+            except Exception as e:
+                status[task] = str(e)
+            if status[task]:
+                logging.error(f"[Store] {task[1]} {task[0]} 分析失败: {status[task]}")
+    logging.info(f"[Store] {len(stores)} 个门店、{len(pages)} 个页面分析完成，用时 {time.perf_counter() - started:.2f}s")
+    return status
@@ -0,0 +1,106 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Iterable, Optional
+
+# 商品销量摘要（Space-Saving）：每个 (日期, 小时, 维度) 只保留销量最高的 CAPACITY 项，
+# 任意时期、任意时段的热销排行由摘要合并得到，不需要重新解析订单
+SUMMARY_TABLE = 'ProductSummary'
+CAPACITY = 64
+DIMENSIONS = ('商品', '产品类型')
+SUMMARY_COLUMNS = ['日期', '小时', '维度', '项', '数量', '误差', '未记录上限']
+TOP_COLUMNS = ['排名', '项', '数量', '误差', '数量下限', '确定入选']
+
+def summarize(groups: pd.DataFrame, items: pd.Series, quantities: pd.Series, capacity: int = CAPACITY) -> pd.DataFrame:
+    """
+    按 groups 的各列分组建立摘要：组内各项销量求和后保留前 capacity 项（数量准确，误差为 0），
+    未记录上限为未保留项中的最大销量（全部保留时为 0），即任一未保留项的销量都不超过它
+    """
+    keys = list(groups.columns)
+    totals = pd.concat([groups, pd.DataFrame({'项': items, '数量': quantities})], axis=1) \
+        .groupby(keys + ['项'], sort=False)['数量'].sum().reset_index()
+    totals = totals.sort_values(keys + ['数量'], ascending=[True] * len(keys) + [False], kind='stable')
+    rank = totals.groupby(keys, sort=False).cumcount()
+    floor = totals['数量'].where(rank == capacity).groupby([totals[key] for key in keys], sort=False).transform('max')
+    summary = totals[rank < capacity].assign(误差=0.0, 未记录上限=floor[rank < capacity].fillna(0))
+    return summary.reset_index(drop=True)
+
+def merge(summaries: pd.DataFrame, capacity: Optional[int] = None, summary_keys=('日期', '小时', '维度')) -> pd.DataFrame:
+    """
+    合并多个摘要（每行一个保留项，summary_keys 相同的行属于同一摘要，未记录上限相同）：
+    某项的销量 = 各摘要中记录的数量 + 未记录它的摘要的未记录上限，误差同样累加，
+    即真实销量在 [数量 - 误差, 数量] 之间；合并后未记录上限为全部摘要的上限之和
+    capacity 给定时合并后只保留前 capacity 项（被舍弃的最大销量计入未记录上限）
+    """
+    columns = ['项', '数量', '误差', '未记录上限']
+    if summaries.empty:
+        return pd.DataFrame(columns=columns)
+    floors = summaries.drop_duplicates(list(summary_keys))['未记录上限'].sum()
+    merged = summaries.groupby('项', sort=False).agg(数量=('数量', 'sum'), 误差=('误差', 'sum'), 已记录上限=('未记录上限', 'sum'))
+    unrecorded = floors - merged['已记录上限']
+    merged = pd.DataFrame({
+        '项': merged.index,
+        '数量': (merged['数量'] + unrecorded).to_numpy(),
+        '误差': (merged['误差'] + unrecorded).to_numpy()
+    }).sort_values(['数量', '项'], ascending=[False, True], kind='stable').reset_index(drop=True)
+    merged['未记录上限'] = floors
+    if capacity is not None and len(merged) > capacity:
+        merged['未记录上限'] = max(floors, merged['数量'].iloc[capacity])
+        merged = merged.iloc[:capacity]
+    return merged[columns]
+
+def top_items(merged: pd.DataFrame, n: int) -> pd.DataFrame:
+    """
+    合并后的前 n 项及误差范围：数量下限 = 数量 - 误差；数量下限不低于其余所有项可能的最大销量时
+    该项确定属于真实的前 n 项
+    """
+    if merged.empty:
+        return pd.DataFrame(columns=TOP_COLUMNS)
+    floor = merged['未记录上限'].iloc[0]
+    rest = merged['数量'].iloc[n] if len(merged) > n else 0
+    top = merged.iloc[:n].copy()
+    top.insert(0, '排名', np.arange(1, len(top) + 1))
+    top['数量下限'] = top['数量'] - top['误差']
+    top['确定入选'] = top['数量下限'] >= max(floor, rest)
+    return top[TOP_COLUMNS]
+
+def write_summaries(conn: sqlite3.Connection, summaries: pd.DataFrame, start_date: Optional[date] = None) -> int:
+    """替换 start_date（含）之后各日的摘要，默认全部替换；summaries 为 summarize 的结果"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS "{SUMMARY_TABLE}" (
+            "日期" TEXT NOT NULL,
+            "小时" INTEGER NOT NULL,
+            "维度" TEXT NOT NULL,
+            "项" TEXT NOT NULL,
+            "数量" REAL NOT NULL,
+            "误差" REAL NOT NULL,
+            "未记录上限" REAL NOT NULL,
+            PRIMARY KEY ("日期", "小时", "维度", "项")
+        ) WITHOUT ROWID
+    ''')
+    if start_date is None:
+        conn.execute(f'DELETE FROM "{SUMMARY_TABLE}"')
+    else:
+        conn.execute(f'DELETE FROM "{SUMMARY_TABLE}" WHERE "日期" >= ?', (start_date.strftime('%Y-%m-%d'),))
+    rows = summaries[SUMMARY_COLUMNS].astype({'小时': int, '数量': float, '误差': float, '未记录上限': float})
+    conn.executemany(f'INSERT INTO "{SUMMARY_TABLE}" VALUES ({", ".join("?" * len(SUMMARY_COLUMNS))})',
+                     rows.itertuples(index=False, name=None))
+    conn.commit()
+    return len(rows)
+
+def read_summaries(conn: sqlite3.Connection, dimension: str, start_date: Optional[date] = None,
+                   end_date: Optional[date] = None, hours: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """读取某个维度在日期范围（含首尾）和小时范围内的摘要"""
+    conditions, params = ['"维度" = ?'], [dimension]
+    if start_date is not None:
+        conditions.append('"日期" >= ?')
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date is not None:
+        conditions.append('"日期" <= ?')
+        params.append(end_date.strftime('%Y-%m-%d'))
+    if hours:
+        hours = [int(hour) for hour in hours]
+        conditions.append(f'"小时" IN ({", ".join("?" * len(hours))})')
+        params.extend(hours)
+    return pd.read_sql_query(f'SELECT * FROM "{SUMMARY_TABLE}" WHERE ' + ' AND '.join(conditions), conn, params=params)
@@ -1,6 +1,13 @@
 import pandas as pd
 import sqlite3
 import os
+import ideapod_catering
+import ideapod_customer
+import ideapod_db
+import ideapod_hll
+import ideapod_remark
+import ideapod_store
+import ideapod_topn
 from datetime import datetime
 
 def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
@@ -19,7 +26,7 @@ def preprocess_datetime(df: pd.DataFrame) -> pd.DataFrame:
 def clean_catering_data(catering_df):
     """Clean and preprocess catering data"""
     catering_df.drop(columns=[
-        "号牌", "FLIPOS版本", "状态", "代金券", "下单门店", "门店编号", "门店区域", 
+        "号牌", "FLIPOS版本", "状态", "代金券", "门店编号", "门店区域", 
         "入账门店", "ERP流水号", "第三方外卖平台单号", "配送平台", 
         "配送平台订单编号", "包装费", "配送费", "积分", "收银备注"
     ], inplace=True, errors='ignore')
@@ -32,6 +39,8 @@ def clean_space_data(space_df):
     """Clean and preprocess space data"""
     space_df.drop(columns=["用户昵称"], inplace=True, errors='ignore')
     space_df["订单备注"] = space_df["订单备注"].str.replace("\n", ",", regex=False)
+    # 门店前缀已记入门店列，名称与全量导入一致
+    space_df["订单商品名"] = ideapod_store.strip_store_prefix(space_df["订单商品名"].fillna('').str.strip())
     space_df["会员号"] = space_df["会员号"].astype(str)
     if "手机号" in space_df.columns:
         space_df["手机号"] = space_df["手机号"].astype(str)
@@ -54,37 +63,39 @@ def clean_member_data(member_df):
     member_df.set_index("会员号", inplace=True)
     return member_df
 
-def update_catering_table(conn, new_file):
+def replace_from(conn, table, new_df, time_col):
+    """
+    各门店的增量文件覆盖的时间范围不同，只删除各门店在其新数据最早时间（含）之后的旧记录
+    库中时间以文本存储，按同样格式比较（sqlite3 不能直接绑定 Timestamp）
+    """
+    ideapod_store.ensure_store_column(conn, table)
+    starts = new_df.groupby(ideapod_store.STORE_COLUMN)[time_col].min().dropna()
+    cursor = conn.cursor()
+    for store, min_time in starts.items():
+        cursor.execute(f"""
+            DELETE FROM {table} 
+            WHERE {ideapod_store.STORE_COLUMN} = ? AND {time_col} >= ?
+        """, (store, min_time.strftime('%Y-%m-%d %H:%M:%S')))
+
+def update_catering_table(conn, new_file, jobs=None):
     """Update catering table with new data"""
     new_df = pd.read_csv(new_file)
-    new_df = clean_catering_data(new_df)
-    
-    min_time = new_df['下单时间'].min()
-    
-    cursor = conn.cursor()
-    cursor.execute("""
-        DELETE FROM Catering 
-        WHERE 下单时间 >= ?
-    """, (min_time,))
+    new_df = ideapod_store.map_stores(clean_catering_data, new_df, jobs)
+    replace_from(conn, 'Catering', new_df, '下单时间')
     
     new_df.to_sql("Catering", conn, if_exists="append", index=True)
     print(f"Catering table updated with data from {new_file}")
+    return new_df['下单时间'].min().date()
 
-def update_space_table(conn, new_file):
+def update_space_table(conn, new_file, jobs=None):
     """Update space table with new data"""
     new_df = pd.read_csv(new_file)
-    new_df = clean_space_data(new_df)
-    
-    min_time = new_df['创建时间'].min()
-    
-    cursor = conn.cursor()
-    cursor.execute("""
-        DELETE FROM Space 
-        WHERE 创建时间 >= ?
-    """, (min_time,))
+    new_df = ideapod_store.map_stores(clean_space_data, new_df, jobs)
+    replace_from(conn, 'Space', new_df, '创建时间')
     
     new_df.to_sql("Space", conn, if_exists="append", index=True)
     print(f"Space table updated with data from {new_file}")
+    return new_df['创建时间'].min().date()
 
 def preprocess_existing_tables(database_path):
     """Preprocess datetime columns in existing database tables"""
@@ -133,8 +144,25 @@ def load_static_tables(database_path, member_file, product_file):
     finally:
         conn.close()
 
-def update_database():
-    """Main function to update database"""
+def rebuild_derived(conn, table, write, updated_from):
+    """
+    按来源表的变化重建派生表（ideapod_db.DERIVED_TABLES）：只有增量更新的表（updated_from: 表 -> 替换数据的最早日期）
+    变化时从其中最早的日期起重建，其他来源表也有变化或没有记录时全部重建，都未变化时不重建
+    write(conn, start_date) 重建并记录来源表，返回写入的行数
+    """
+    stale = ideapod_db.stale_sources(conn, table)
+    if not stale:
+        print(f"{table} is up to date")
+        return
+    start_date = min(updated_from[source] for source in stale) if set(stale) <= set(updated_from) else None
+    count = write(conn, start_date)
+    print(f"{table} rebuilt from {start_date or 'the beginning'}: {count} rows")
+
+def update_database(update_catering=True, update_space=True, jobs=None):
+    """
+    Main function to update database
+    jobs: 增量订单按门店拆分后清洗的并行进程数，默认为核数
+    """
     database_path = "db/ideapod.db"
     member_file = "db/raw_membership.csv"
     product_file = "db/ideapod_product.csv"
@@ -147,18 +175,37 @@ def update_database():
     
     # 更新动态表
     conn = sqlite3.connect(database_path)
+    # 各表被替换数据的最早日期，派生表只需从这天起重建
+    updated_from = {}
     try:
-        if os.path.exists(new_catering_file):
-            update_catering_table(conn, new_file=new_catering_file)
+        if not update_catering:
+            print("Catering update not requested, skipping")
+        elif os.path.exists(new_catering_file):
+            updated_from['Catering'] = update_catering_table(conn, new_file=new_catering_file, jobs=jobs)
         else:
             print("No new_flipos.csv found, skipping catering update")
             
-        if os.path.exists(new_space_file):
-            update_space_table(conn, new_file=new_space_file)
+        if not update_space:
+            print("Space update not requested, skipping")
+        elif os.path.exists(new_space_file):
+            updated_from['Space'] = update_space_table(conn, new_file=new_space_file, jobs=jobs)
         else:
             print("No new_space.csv found, skipping space update")
             
         conn.commit()
+        ideapod_remark.ensure_rules(conn)
+        ideapod_remark.drop_outdated_index(conn)
+        rebuild_derived(conn, ideapod_remark.REMARK_INDEX, ideapod_remark.write_remark_index, updated_from)
+        # Member 表每次整体重写，总是全部读取；Space / Catering 只读新数据
+        inserted, changed = ideapod_customer.update_identity(conn, updated_from)
+        print(f"{ideapod_customer.IDENTITY_TABLE} updated: {inserted} new identifiers, {changed} merged")
+        rebuild_derived(conn, ideapod_topn.SUMMARY_TABLE, ideapod_catering.write_product_summaries, updated_from)
+        # 新增的标识只出现在新订单中，按增量重建草图即可；已有标识的客户编号被合并时历史各日都受影响，全部重建
+        sketch_from = dict(updated_from)
+        if updated_from and not changed:
+            sketch_from[ideapod_customer.IDENTITY_TABLE] = min(updated_from.values())
+        rebuild_derived(conn, ideapod_hll.SKETCH_TABLE, ideapod_hll.write_sketches, sketch_from)
+        ideapod_db.create_indexes(conn)
     finally:
         conn.close()
 
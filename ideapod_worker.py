@@ -0,0 +1,274 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows 上只用于单进程的开发服务器，不加锁
+    fcntl = None
+import ideapod_db
+import ideapod_json
+import ideapod_store
+import ideapod_update
+import ideapod_catering
+import ideapod_space
+import ideapod_group
+
+# 分析模块: (分析函数, 结果文件)
+ANALYSES = {
+    'space': (ideapod_space.analyze, 'static/space_results.json'),
+    'catering': (ideapod_catering.analyze, 'static/catering_results.json'),
+    'group': (ideapod_group.analyze, 'static/group_results.json')
+}
+
+# 监视的增量文件及其影响的分析模块
+WATCHED_FILES = {
+    'db/new_flipos.csv': ('catering', 'group'),
+    'db/new_space.csv': ('space', 'group')
+}
+STATE_FILE = 'db/worker_state.json'
+# 多个进程（如 gunicorn 的各 worker）都会调用 start：只有取得 WATCH_LOCK 的进程监视增量文件，
+# 各进程的任务在 JOB_LOCK 下依次执行，不会同时导入同一个增量文件或同时写状态文件
+WATCH_LOCK = 'db/worker.lock'
+JOB_LOCK = 'db/job.lock'
+POLL_INTERVAL = 30  # 秒
+MAX_JOB_HISTORY = 50
+
+_queue = queue.Queue()
+_jobs = deque(maxlen=MAX_JOB_HISTORY)
+_lock = threading.Lock()
+_job_ids = itertools.count(1)
+_threads = []
+_submitted_mtimes = {}
+# 持有 WATCH_LOCK 的文件，进程退出时自动释放
+_watch_lock = None
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _file_mtimes() -> dict:
+    return {path: os.stat(path).st_mtime_ns for path in WATCHED_FILES if os.path.exists(path)}
+
+def _load_state():
+    """上次处理完成时各增量文件的修改时间，不存在时返回 None"""
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _save_state(mtimes: dict) -> None:
+    tmp_path = STATE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(mtimes, f)
+    os.replace(tmp_path, STATE_FILE)
+
+def _try_lock(path: str):
+    """以非阻塞方式取得文件锁，返回打开的文件（保持打开即持有锁），已被其他进程持有时返回 None"""
+    f = open(path, 'a')
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+@contextmanager
+def _locked(path: str):
+    """在文件锁下执行，其他进程持有时等待"""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def submit(modules, update_files=(), reason='manual') -> dict:
+    """
+    提交重算任务。update_files 为需要先导入数据库的增量文件。
+    若已有排队中（尚未开始）的任务，则合并到该任务中，避免重复计算。
+    """
+    # 后台线程尚未启动时先启动，提交的任务总会被执行
+    start()
+    modules = [m for m in ANALYSES if m in set(modules)]
+    update_files = [f for f in WATCHED_FILES if f in set(update_files)]
+    with _lock:
+        for job in _jobs:
+            if job['state'] == 'queued':
+                job['modules'] = [m for m in ANALYSES if m in set(job['modules']) | set(modules)]
+                job['update_files'] = [f for f in WATCHED_FILES if f in set(job['update_files']) | set(update_files)]
+                job['reason'] = f"{job['reason']}; {reason}"
+                return dict(job)
+        job = {
+            'id': next(_job_ids),
+            'state': 'queued',
+            'reason': reason,
+            'update_files': update_files,
+            'modules': modules,
+            'stage': None,
+            'progress': 0,
+            'total': 0,
+            'created_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None
+        }
+        _jobs.append(job)
+    _queue.put(job)
+    logging.info(f"[Worker] 任务 {job['id']} 已加入队列: {reason}")
+    return dict(job)
+
+def _set(job: dict, **fields) -> None:
+    with _lock:
+        job.update(fields)
+
+def _run_job(job: dict) -> None:
+    with _locked(JOB_LOCK):
+        _run_locked(job)
+
+def _run_locked(job: dict) -> None:
+    mtimes = _file_mtimes()
+    state = _load_state() or {}
+    with _lock:
+        # 排队期间可能有新的请求合并进来，开始时再确定具体步骤；
+        # 等待锁期间已由其他进程导入的增量文件不再导入（replace_from 重复执行会重复追加）
+        job['update_files'] = [path for path in job['update_files'] if path not in mtimes or state.get(path) != mtimes[path]]
+        steps = (['update'] if job['update_files'] else []) + list(job['modules'])
+        update_files = list(job['update_files'])
+        job.update(state='running', started_at=_now(), total=len(steps))
+
+    for i, step in enumerate(steps):
+        _set(job, stage=step, progress=i)
+        if step == 'update':
+            ideapod_update.update_database(
+                update_catering='db/new_flipos.csv' in update_files,
+                update_space='db/new_space.csv' in update_files
+            )
+            continue
+        analyze, results_file = ANALYSES[step]
+        conn = ideapod_db.get_db_connection()
+        try:
+            results = analyze(conn)
+        finally:
+            conn.close()
+        if 'error' in results:
+            raise RuntimeError(f"{step} 分析错误: {results['error']}")
+        ideapod_json.save_results(results, results_file)
+
+    # 有多个门店时再按门店重算各模块，(模块, 门店) 在进程池中并行
+    conn = ideapod_db.get_db_connection()
+    try:
+        stores = ideapod_store.list_stores(conn)
+    finally:
+        conn.close()
+    modules = [step for step in steps if step != 'update']
+    if len(stores) > 1 and modules:
+        _set(job, stage='stores')
+        failed = {task: error for task, error in ideapod_store.analyze_stores(modules, stores).items() if error}
+        if failed:
+            raise RuntimeError('; '.join(f"{store} {page} 分析错误: {error}" for (page, store), error in failed.items()))
+
+    if update_files:
+        state = _load_state() or {}
+        state.update({path: mtimes[path] for path in update_files if path in mtimes})
+        _save_state(state)
+    _set(job, state='done', stage=None, progress=len(steps), finished_at=_now())
+
+def _worker_loop() -> None:
+    while True:
+        job = _queue.get()
+        try:
+            _run_job(job)
+            logging.info(f"[Worker] 任务 {job['id']} 完成")
+        except Exception as e:
+            _set(job, state='failed', finished_at=_now(), error=str(e))
+            logging.error(f"[Worker] 任务 {job['id']} 失败: {e}\n{traceback.format_exc()}")
+        finally:
+            _queue.task_done()
+
+def check_watched_files() -> dict:
+    """检查增量文件是否有变化，有变化则提交导入和重算任务"""
+    with _locked(JOB_LOCK):
+        state = _load_state()
+        mtimes = _file_mtimes()
+        if state is None:
+            # 首次运行只记录当前状态，不触发重算
+            _save_state(mtimes)
+            return None
+    # 已提交过的版本不再重复提交（包括失败的任务，避免每次轮询都重试）
+    changed = [path for path, mtime in mtimes.items()
+               if state.get(path) != mtime and _submitted_mtimes.get(path) != mtime]
+    if not changed:
+        return None
+    _submitted_mtimes.update({path: mtimes[path] for path in changed})
+    modules = {m for path in changed for m in WATCHED_FILES[path]}
+    return submit(modules, update_files=changed, reason=f"文件更新: {', '.join(changed)}")
+
+def _watch_loop(interval: int) -> None:
+    while True:
+        try:
+            check_watched_files()
+        except Exception as e:
+            logging.error(f"[Worker] 检查增量文件时出错: {e}")
+        time.sleep(interval)
+
+def start(interval: int = POLL_INTERVAL) -> None:
+    """
+    启动后台工作线程（重复调用无效）；文件监视线程只在取得 WATCH_LOCK 的一个进程中启动，
+    其他进程只执行本进程提交的任务
+    """
+    global _watch_lock
+    with _lock:
+        if _threads:
+            return
+        targets = [(_worker_loop, ())]
+        _watch_lock = _try_lock(WATCH_LOCK)
+        if _watch_lock is not None:
+            targets.append((_watch_loop, (interval,)))
+        for target, args in targets:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            _threads.append(thread)
+    logging.info(f"[Worker] 后台重算任务已启动{'，监视增量文件' if _watch_lock is not None else '（增量文件由其他进程监视）'}")
+
+def get_job(job_id: int):
+    with _lock:
+        for job in _jobs:
+            if job['id'] == job_id:
+                return dict(job)
+    return None
+
+def is_busy() -> bool:
+    with _lock:
+        return any(job['state'] in ('queued', 'running') for job in _jobs)
+
+def status() -> dict:
+    with _lock:
+        jobs = [dict(job) for job in reversed(_jobs)]
+    return {
+        'running': bool(_threads),
+        'watching': _watch_lock is not None,
+        'queued': sum(1 for job in jobs if job['state'] == 'queued'),
+        'watched_files': {path: os.path.exists(path) for path in WATCHED_FILES},
+        'jobs': jobs
+    }
+
+def main():
+    """作为独立进程运行：监视增量文件并在后台重算"""
+    start()
+    print(f"后台重算任务已启动，每 {POLL_INTERVAL} 秒检查 {', '.join(WATCHED_FILES)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("已停止")
+
+if __name__ == "__main__":
+    main()
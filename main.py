@@ -1,72 +1,78 @@
-import sqlite3
-import json
-import ideapod_catering
-import ideapod_space
-import ideapod_group
+import argparse
+import sys
+import pandas as pd
+import ideapod_cache
+import ideapod_partition
+import ideapod_pipeline
+import ideapod_store
 
-def get_db_connection():
-    conn = sqlite3.connect('db/ideapod.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+def print_outputs():
+    current = None
+    for page, category, key, stage in ideapod_pipeline.list_outputs():
+        if (page, category) != current:
+            print(f"{page}/{category}")
+            current = (page, category)
+        print(f"    {key}  ({stage})")
 
-def save_analysis_results(choices=None):
-    # 如果没有指定选择，默认执行所有分析
-    if choices is None:
-        choices = {1, 2, 3}
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="计算分析结果并保存到 static 下对应的 json 文件")
+    parser.add_argument('targets', nargs='*',
+                        help="分析目标：页面（space / catering / group，兼容 1 / 2 / 3）、页面/分类、"
+                             "分类/结果名 或 页面/分类/结果名，例如 空间产品/各区利用率_bar；默认执行全部")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="同时运行的分析步骤数（默认 1）")
+    parser.add_argument('--list', action='store_true', help="列出所有可选的分析结果")
+    parser.add_argument('--dry-run', action='store_true', help="只显示需要运行的步骤，不执行")
+    parser.add_argument('--partition', metavar='FREQ',
+                        help="数据量超出内存时使用：财务分析按周期（如 M 为按月、W-MON 为按周）分区读取后合并，"
+                             "各分区用 -j 个进程并行计算")
+    parser.add_argument('--stores', action='store_true',
+                        help=f"同时按门店计算所选页面的结果（保存到 {ideapod_store.STORE_RESULTS_DIR}/<门店>/），"
+                             "各 (页面, 门店) 用 -j 个进程并行")
+    parser.add_argument('--refresh', action='store_true', help="忽略已缓存的结果，全部重新计算")
+    parser.add_argument('--clear-cache', action='store_true', help=f"清空 {ideapod_cache.CACHE_DIR} 中的结果缓存后退出")
+    args = parser.parse_args(argv)
 
-    with get_db_connection() as conn:
-        try:
-            if 3 in choices:
-                group_result = ideapod_group.analyze(conn)
-                if 'error' not in group_result:
-                    with open('static/group_results.json', 'w', encoding='utf-8') as f:
-                        json.dump(group_result, f, ensure_ascii=False, indent=4)
-                    print("集团分析结果保存成功")
-                else:
-                    print(f"集团分析错误: {group_result['error']}")
+    if args.clear_cache:
+        print(f"已删除 {ideapod_cache.clear()} 个缓存文件")
+        return 0
 
-            if 2 in choices:
-                catering_result = ideapod_catering.analyze(conn)
-                if 'error' not in catering_result:
-                    with open('static/catering_results.json', 'w', encoding='utf-8') as f:
-                        json.dump(catering_result, f, ensure_ascii=False, indent=4)
-                    print("餐饮分析结果保存成功")
-                else:
-                    print(f"餐饮分析错误: {catering_result['error']}")
-            
-            if 1 in choices:
-                space_result = ideapod_space.analyze(conn)
-                if 'error' not in space_result:
-                    with open('static/space_results.json', 'w', encoding='utf-8') as f:
-                        json.dump(space_result, f, ensure_ascii=False, indent=4)
-                    print("空间分析结果保存成功")
-                else:
-                    print(f"空间分析错误: {space_result['error']}")
-        except Exception as e:
-            print(f"保存分析结果时出错: {e}")
-            import traceback
-            traceback.print_exc()
+    if args.list:
+        print_outputs()
+        return 0
 
-if __name__ == "__main__":
-    print("请选择要需要的分析 (用逗号分隔):")
-    print("1 - 空间分析")
-    print("2 - 餐饮分析")
-    print("3 - 集团分析")
-    user_input = input("请输入选择 (例如: 1,2,3)，默认执行全部: ").strip()
-    
-    if user_input:
+    try:
+        selection = ideapod_pipeline.resolve_targets(args.targets or list(ideapod_pipeline.PAGES))
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.partition:
         try:
-            choices = set(int(x.strip()) for x in user_input.split(',') if x.strip())
-            # 验证输入是否有效
-            if not choices.issubset({1, 2, 3}):
-                print("错误：请输入有效的选项 (1,2,3)")
-            elif not choices:
-                print("错误：输入为空，请重新输入")
-            else:
-                save_analysis_results(choices)
+            pd.Period('2024-01-01', freq=args.partition)
         except ValueError:
-            print("错误：请输入有效的数字，用逗号分隔 (例如: 1,2,3)")
-    else:
-        save_analysis_results()  # 留空时执行全部
-        
-    print("分析完成，结果已保存到对应的json文件中")
\ No newline at end of file
+            parser.error(f"无效的分区周期: {args.partition}")
+
+    if args.dry_run:
+        stages = {stage for page, category, key, stage in ideapod_pipeline.list_outputs()
+                  if key in selection.get(page, {}).get(category, [])}
+        partitioned = frozenset(ideapod_partition.AGGREGATES) if args.partition else frozenset()
+        for name in ideapod_pipeline.required_stages(sorted(stages), partitioned):
+            print(name)
+        return 0
+
+    status = ideapod_pipeline.run(args.targets, jobs=args.jobs, refresh=args.refresh, partition=args.partition)
+    for page, error in status.items():
+        if error:
+            print(f"{page} 分析错误: {error}")
+        else:
+            print(f"{page} 分析结果已保存到 {ideapod_pipeline.PAGES[page][0]}")
+
+    store_status = ideapod_store.analyze_stores(selection, jobs=args.jobs) if args.stores else {}
+    for (page, store), error in sorted(store_status.items()):
+        if error:
+            print(f"{store} {page} 分析错误: {error}")
+        else:
+            print(f"{store} {page} 分析结果已保存到 {ideapod_store.results_file(page, store)}")
+    return 1 if any(status.values()) or any(store_status.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,16 +8,15 @@ const lineColors = barColors;
 document.addEventListener('DOMContentLoaded', function() {
     console.log('DOM loaded');
     
-    // 从JSON文件加载数据
-    const jsonFile = document.body.dataset.jsonFile;
+    // 从JSON文件加载数据：导出版本使用分标签的manifest，否则读取完整的结果文件
+    const { manifest, jsonFile } = document.body.dataset;
     
-    if (!jsonFile) {
-        console.error('No JSON file specified in data-json-file attribute');
+    if (!manifest && !jsonFile) {
+        console.error('No data-manifest or data-json-file attribute specified');
         return; // 停止执行
     }
 
-    fetch(jsonFile)
-        .then(response => response.json())
+    loadResults(manifest, jsonFile)
         .then(data => {
             const tabButtons = document.getElementById('tabButtons');
             const tabContents = document.getElementById('tabContents');
@@ -44,7 +43,11 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 // 遍历每个数据集并创建图表和表格
                 for (const [key, value] of Object.entries(categoryData)) {
-                    if (!value || value.length === 0) continue;
+                    // 数据按列存储：{列名: [值, ...]}
+                    const headers = Object.keys(value || {});
+                    const columns = Object.values(value || {});
+                    const rowCount = columns.length > 0 ? columns[0].length : 0;
+                    if (rowCount === 0) continue;
                     
                     // 判断图表类型
                     const isIgnore = key.endsWith('_ignore');
@@ -103,7 +106,6 @@ document.addEventListener('DOMContentLoaded', function() {
                             columnSelect.className = 'column-select';
                             
                             // 添加表头为选项（跳过第一列）
-                            const headers = Object.keys(value[0]);
                             headers.forEach((header, index) => {
                                 if (index > 0) {
                                     const option = document.createElement('option');
@@ -144,7 +146,6 @@ document.addEventListener('DOMContentLoaded', function() {
                     const thead = document.createElement('thead');
                     const headerRow = document.createElement('tr');
                     
-                    const headers = Object.keys(value[0]);
                     headers.forEach(header => {
                         const th = document.createElement('th');
                         th.textContent = header;
@@ -156,10 +157,11 @@ document.addEventListener('DOMContentLoaded', function() {
                     
                     // 创建表格内容
                     const tbody = document.createElement('tbody');
-                    value.forEach(row => {
+                    for (let rowIndex = 0; rowIndex < rowCount; rowIndex++) {
                         const tr = document.createElement('tr');
                         
-                        Object.values(row).forEach(cellValue => {
+                        columns.forEach(column => {
+                            const cellValue = column[rowIndex];
                             const td = document.createElement('td');
                             // 如果是数字，则保留两位小数
                             if (!isNaN(parseFloat(cellValue)) && isFinite(cellValue)) {
@@ -171,7 +173,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         });
                         
                         tbody.appendChild(tr);
-                    });
+                    }
                     
                     table.appendChild(tbody);
                     tableContainer.appendChild(table);
@@ -231,6 +233,24 @@ document.addEventListener('DOMContentLoaded', function() {
         .catch(error => console.error('Error loading data:', error));
 });
 
+function loadResults(manifest, jsonFile) {
+    if (!manifest) {
+        return fetch(jsonFile).then(response => response.json());
+    }
+    // manifest每次都向服务器确认，各标签的数据文件名带内容哈希，可长期缓存
+    return fetch(manifest, { cache: 'no-cache' })
+        .then(response => response.json())
+        .then(index => Promise.all(
+            index.tabs.map(tab => fetch(tab.file).then(response => response.json()))
+        ).then(parts => {
+            const data = {};
+            index.tabs.forEach((tab, i) => {
+                data[tab.name] = parts[i];
+            });
+            return data;
+        }));
+}
+
 function openTab(evt, tabName) {
     var i, tabcontent, tabbuttons;
     tabcontent = document.getElementsByClassName("tab-content");
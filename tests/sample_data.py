@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+import ideapod_catering
+import ideapod_customer
+import ideapod_db
+import ideapod_hll
+import ideapod_remark
+
+# 测试用的小型数据库：结构与 ideapod_fetch 导入后的数据库相同，数据由固定随机种子生成
+PRODUCTS = {
+    '美式咖啡': '咖啡', '拿铁': '咖啡', '抹茶拿铁': '茶饮', '提拉米苏': '甜品', '可颂': '烘焙',
+    '三明治': '食品', '柠檬茶': '茶饮', '气泡水': '饮料', '拍摄套餐': '活动', '押金': '押金'
+}
+PODS = ['心流舱·巴赫', '心流舱·牛顿', '心流舱·荣格', '会议室A', '图书馆专注区', '蘑菇半帘区']
+LEVELS = ['普通会员', '银卡', '金卡']
+STORE = '上海洛克外滩店'
+START = pd.Timestamp('2024-01-01')
+DAYS = 120
+
+def _times(rng: np.random.Generator, n: int) -> pd.Series:
+    days = rng.integers(0, DAYS, n)
+    minutes = rng.integers(9 * 60, 21 * 60, n)
+    return pd.Series(START + pd.to_timedelta(days, unit='D') + pd.to_timedelta(minutes, unit='min')).sort_values(ignore_index=True)
+
+def _text(times: pd.Series) -> pd.Series:
+    return times.dt.strftime('%Y-%m-%d %H:%M:%S')
+
+def sample_frames(n_members: int = 60, n_space: int = 400, n_catering: int = 800, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    members = pd.DataFrame({
+        '会员号': [str(100000 + i) for i in range(n_members)],
+        '手机号': [str(13800000000 + i) for i in range(n_members)],
+        '等级': rng.choice(LEVELS, n_members),
+        '加入时间': _text(pd.Series(START - pd.to_timedelta(rng.integers(0, 365, n_members), unit='D')))
+    })
+
+    start = _times(rng, n_space)
+    hours = rng.choice([1.0, 1.5, 2.0, 3.0], n_space)
+    end = start + pd.to_timedelta(hours, unit='h')
+    who = rng.integers(0, n_members, n_space)
+    paid = rng.random(n_space) > 0.05
+    space = pd.DataFrame({
+        '手机号': members['手机号'].to_numpy()[who],
+        '订单编号': [f'S{i:07d}' for i in range(n_space)],
+        '创建时间': _text(start - pd.Timedelta(hours=2)),
+        '预定开始时间': _text(start),
+        '预定结束时间': _text(end),
+        '实际结束时间': _text(end),
+        '支付时间': _text(start - pd.Timedelta(hours=1)).where(paid, None),
+        '实付金额': np.round(hours * rng.choice([20.0, 30.0, 45.0], n_space), 2),
+        '升舱': rng.choice(['否', '是'], n_space, p=[0.9, 0.1]),
+        '加钟数': rng.integers(0, 2, n_space),
+        '临时/预约': rng.choice(['预约', '临时'], n_space),
+        '订单商品名': rng.choice(PODS, n_space),
+        '实际时长': hours,
+        '支付方式1': '',
+        '支付方式2': rng.choice(['flipos', '月结', '大众点评'], n_space),
+        '场景实收_flipos': None,
+        '场景实收_non_flipos': None,
+        '订单备注': '',
+        '预定备注': rng.choice(['', '靠窗'], n_space),
+        ideapod_db.STORE_COLUMN: STORE,
+        '会员号': members['会员号'].to_numpy()[who],
+        '等级': members['等级'].to_numpy()[who]
+    })
+
+    names = list(PRODUCTS)[:-1]
+    items = [','.join(f'{name}x{count}' for name, count in zip(rng.choice(names, k, replace=False), rng.integers(1, 3, k)))
+             for k in rng.integers(1, 4, n_catering)]
+    buyer = rng.integers(-n_members // 2, n_members, n_catering)
+    catering = pd.DataFrame({
+        '会员号': [members['会员号'].iloc[i] if i >= 0 else None for i in buyer],
+        '订单号': [f'C{i:08d}' for i in range(n_catering)],
+        '下单时间': _text(_times(rng, n_catering)),
+        '实收': np.round(rng.uniform(8, 90, n_catering), 2),
+        '服务方式': rng.choice(['堂食', '外带', '外卖', '报损'], n_catering, p=[0.6, 0.2, 0.15, 0.05]),
+        '商品': items,
+        '使用优惠': rng.choice(['无优惠', '会员折扣', '第二杯半价', '满减,会员折扣'], n_catering),
+        '打折': np.round(rng.uniform(0, 10, n_catering), 2),
+        '备注': rng.choice(['', '少冰'], n_catering),
+        ideapod_db.STORE_COLUMN: STORE
+    })
+    product = pd.DataFrame({'商品名': list(PRODUCTS), '产品类型': list(PRODUCTS.values())})
+    return {'Member': members, 'Space': space, 'Catering': catering, 'Product': product}
+
+def build_db(path: str, frames: dict = None) -> str:
+    """写入各表并建立导入时生成的派生表和索引（与 ideapod_fetch 相同）"""
+    frames = frames or sample_frames()
+    conn = sqlite3.connect(path)
+    try:
+        for table, df in frames.items():
+            df.to_sql(table, conn, if_exists='replace', index=False)
+        ideapod_catering.write_product_summaries(conn)
+        ideapod_customer.update_identity(conn)
+        ideapod_hll.write_sketches(conn)
+        ideapod_remark.ensure_rules(conn)
+        ideapod_remark.write_remark_index(conn)
+        ideapod_db.create_indexes(conn)
+    finally:
+        conn.close()
+    return path
+
+def temp_db() -> str:
+    """在临时目录中建立样例数据库，返回路径"""
+    return build_db(os.path.join(tempfile.mkdtemp(prefix='ideapod_test_'), 'ideapod.db'))
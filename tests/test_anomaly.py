@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+import pandas as pd
+import ideapod_anomaly
+
+def _ledger(days: int, partial: float = None) -> pd.DataFrame:
+    """每天收入 100 左右的日度账本，partial 给出时最后一天（尚未结束）为该值"""
+    rng = np.random.default_rng(0)
+    values = 100 + rng.normal(0, 5, days)
+    if partial is not None:
+        values[-1] = partial
+    dates = pd.date_range('2024-01-01', periods=days, freq='D').strftime('%Y-%m-%d')
+    return pd.DataFrame({'订单日': dates, '收入': values})
+
+class IncompletePeriodTest(unittest.TestCase):
+    params = ideapod_anomaly.LEDGER_PARAMS['daily']
+
+    def test_trailing_day_not_scored(self):
+        # 截止时间所在的一天未结束，数值偏低也不记为异常，也不计入状态
+        as_of = pd.Timestamp('2024-03-10 09:30')
+        flags, state = ideapod_anomaly.detect(_ledger(70, partial=5.0), '订单日', self.params, as_of=as_of)
+        self.assertNotIn('2024-03-10', flags['日期'].tolist())
+        self.assertEqual(state['last_date'], '2024-03-09')
+
+    def test_next_run_incremental(self):
+        # 下次运行时多一个完整的期，只检测这一期
+        _, state = ideapod_anomaly.detect(_ledger(70, partial=5.0), '订单日', self.params,
+                                          as_of=pd.Timestamp('2024-03-10 09:30'))
+        full = _ledger(71, partial=5.0)
+        full.loc[69, '收入'] = _ledger(70)['收入'].iloc[69]
+        flags, state = ideapod_anomaly.detect(full, '订单日', self.params, state, as_of=pd.Timestamp('2024-03-11 09:30'))
+        self.assertEqual(state['scored'], 1)
+        self.assertEqual(state['last_date'], '2024-03-10')
+        rescanned, _ = ideapod_anomaly.detect(full, '订单日', self.params, as_of=pd.Timestamp('2024-03-11 09:30'))
+        pd.testing.assert_frame_equal(flags, rescanned)
+
+    def test_weekly_current_week_dropped(self):
+        # 周度账本按各周开始日期标记，截止时间所在的周未结束
+        weeks = pd.date_range('2024-01-02', periods=10, freq='7D')
+        ledger = pd.DataFrame({'订单周': weeks.strftime('%Y-%m-%d'), '收入': 700.0})
+        _, state = ideapod_anomaly.detect(ledger, '订单周', ideapod_anomaly.LEDGER_PARAMS['weekly'],
+                                          as_of=weeks[-1] + pd.Timedelta(days=3))
+        self.assertEqual(state['last_date'], weeks[-2].strftime('%Y-%m-%d'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+import pandas as pd
+import ideapod_availability
+import ideapod_db
+
+class BuildIndexTest(unittest.TestCase):
+    def test_same_pod_in_two_stores(self):
+        # 不同门店的同名空间各自建立索引
+        space_df = pd.DataFrame({
+            ideapod_db.STORE_COLUMN: ['上海洛克外滩店', '北京三里屯店', '北京三里屯店'],
+            '订单商品名': ['心流舱·巴赫'] * 3,
+            '预定开始时间': ['2024-03-01 10:00:00', '2024-03-01 10:30:00', '2024-03-01 14:00:00'],
+            '预定结束时间': ['2024-03-01 11:00:00', '2024-03-01 11:30:00', '2024-03-01 15:00:00'],
+            '支付时间': ['2024-03-01 09:00:00'] * 3
+        })
+        index = ideapod_availability.build_index(space_df)
+        self.assertEqual(sorted(index), [('上海洛克外滩店', '心流舱·巴赫'), ('北京三里屯店', '心流舱·巴赫')])
+        moment = ideapod_availability._seconds([pd.Timestamp('2024-03-01 10:45')])[0]
+        self.assertEqual(index['上海洛克外滩店', '心流舱·巴赫'].active(moment), 1)
+        self.assertEqual(index['北京三里屯店', '心流舱·巴赫'].busy_seconds(moment, moment + 6 * 3600), 2700 + 3600)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import pandas as pd
+import ideapod_catering
+import ideapod_customer
+
+def _partition(identity: pd.DataFrame) -> set:
+    """客户编号对应的标识集合（与编号的具体取值无关）"""
+    return {frozenset(zip(group['类型'], group['标识'])) for _, group in identity.groupby('客户编号')}
+
+class BuildIdentityTest(unittest.TestCase):
+    LINKS = pd.DataFrame({
+        '会员号': ['m1', 'm2', 'm3', 'm1', 'm4', 'm3', None],
+        '手机号': ['p1', 'p2', 'p3', 'p9', None, 'p2', 'p5']
+    })
+
+    def test_incremental_matches_full(self):
+        # 分批加入对应关系（只传新的一批）与一次性计算得到相同的客户分组，已有编号不变
+        full = ideapod_customer.build_identity(self.LINKS)
+        first = ideapod_customer.build_identity(self.LINKS.iloc[:4])
+        update = ideapod_customer.build_identity(self.LINKS.iloc[4:], first)
+        merged = pd.concat([first, update]).drop_duplicates(['类型', '标识'], keep='last')
+        self.assertEqual(_partition(merged), _partition(full))
+        unchanged = first[~first['客户编号'].isin(first.loc[first['标识'].isin(['m2', 'm3']), '客户编号'])]
+        pd.testing.assert_frame_equal(
+            merged.merge(unchanged, on=['类型', '标识'])[['客户编号_x']].rename(columns={'客户编号_x': '客户编号'}),
+            unchanged[['客户编号']].reset_index(drop=True))
+
+    def test_only_related_returned(self):
+        # 只返回新对应关系涉及的客户；m3-p2 连通两个已有客户，两者的全部标识都取较小的编号
+        first = ideapod_customer.build_identity(self.LINKS.iloc[:4])
+        update = ideapod_customer.build_identity(self.LINKS.iloc[5:6], first)
+        self.assertEqual(set(update['标识']), {'m2', 'p2', 'm3', 'p3'})
+        self.assertEqual(update['客户编号'].nunique(), 1)
+
+class CateringUserTest(unittest.TestCase):
+    def test_customer_ids(self):
+        # 同一客户的多个会员号合为一位用户，非会员订单不计为用户
+        identity = ideapod_customer.build_identity(pd.DataFrame({'会员号': ['m1', 'm2'], '手机号': ['p1', 'p1']}))
+        ids = ideapod_catering.customer_ids(pd.DataFrame({'会员号': ['m1', 'm2', None, '']}), identity)
+        self.assertEqual(ids.iloc[0], ids.iloc[1])
+        self.assertTrue(ids.iloc[2:].isna().all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import unittest
+from unittest import mock
+from datetime import date
+import pandas as pd
+import ideapod_catering
+import ideapod_db
+import ideapod_hll
+import ideapod_remark
+import ideapod_topn
+import ideapod_update
+import sample_data
+
+class DerivedTableTest(unittest.TestCase):
+    def setUp(self):
+        self.db_path = sample_data.temp_db()
+        self.conn = ideapod_db.get_db_connection(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(os.path.dirname(self.db_path), ignore_errors=True)
+
+    def test_fresh_after_build(self):
+        for table in ideapod_db.DERIVED_TABLES:
+            self.assertEqual(ideapod_db.stale_sources(self.conn, table), [])
+        self.assertFalse(ideapod_catering.read_product_summaries(self.conn).empty)
+        self.assertFalse(ideapod_hll.read_sketches(self.conn).empty)
+
+    def test_fingerprint_shared(self):
+        # 同一数据版本中每个来源表只读一次，各派生表的检查共用
+        ideapod_db._checked.clear()
+        ideapod_db._fingerprints.clear()
+        os.remove(os.path.splitext(self.db_path)[0] + ideapod_db.FINGERPRINT_SUFFIX)
+        with mock.patch('ideapod_db.table_fingerprint', wraps=ideapod_db.table_fingerprint) as fingerprint:
+            for table in ideapod_db.DERIVED_TABLES:
+                ideapod_db.check_derived(self.conn, table)
+        sources = {source for sources in ideapod_db.DERIVED_TABLES.values() for source in sources}
+        self.assertEqual(sorted(call.args[1] for call in fingerprint.call_args_list), sorted(sources))
+
+    def test_source_change_detected(self):
+        self.conn.execute('UPDATE Catering SET "商品" = \'拿铁x5\' WHERE "下单时间" >= \'2024-04-01\'')
+        self.conn.commit()
+        self.assertEqual(ideapod_db.stale_sources(self.conn, ideapod_topn.SUMMARY_TABLE), ['Catering'])
+        self.assertEqual(ideapod_db.stale_sources(self.conn, ideapod_hll.SKETCH_TABLE), ['Catering'])
+        with self.assertRaises(RuntimeError):
+            ideapod_catering.read_product_summaries(self.conn)
+
+        # 只有增量更新的表变化时从其最早日期起重建
+        ideapod_update.rebuild_derived(self.conn, ideapod_topn.SUMMARY_TABLE, ideapod_catering.write_product_summaries,
+                                       {'Catering': date(2024, 4, 1)})
+        self.assertEqual(ideapod_db.stale_sources(self.conn, ideapod_topn.SUMMARY_TABLE), [])
+        summaries = ideapod_catering.read_product_summaries(self.conn, start_date=date(2024, 4, 1))
+        products = summaries[summaries['维度'] == '商品']
+        self.assertEqual(set(products['项']), {'拿铁'})
+
+    def test_missing_table_not_created_on_read(self):
+        # 读取时不建表（建表会改变数据版本），提示运行导入 / 更新
+        for table, read in [(ideapod_topn.SUMMARY_TABLE, ideapod_catering.read_product_summaries),
+                            (ideapod_hll.SKETCH_TABLE, ideapod_hll.read_sketches),
+                            (ideapod_remark.REMARK_INDEX, ideapod_remark.classify)]:
+            with self.subTest(table=table):
+                self.conn.execute(f'DROP TABLE "{table}"')
+                self.conn.commit()
+                with self.assertRaises(RuntimeError):
+                    read(self.conn)
+                self.assertEqual(ideapod_db.table_columns(self.conn, table), [])
+
+    def test_catering_without_summaries(self):
+        # 摘要表缺失时热销排行由订单直接计算，结果与读取摘要相同，页面其他部分不受影响
+        expected = ideapod_catering.analyze(self.conn)['热销排行']
+        self.conn.execute(f'DROP TABLE "{ideapod_topn.SUMMARY_TABLE}"')
+        self.conn.commit()
+        results = ideapod_catering.analyze(self.conn)
+        self.assertNotIn('error', results)
+        for name, table in expected.items():
+            pd.testing.assert_frame_equal(results['热销排行'][name], table)
+
+if __name__ == '__main__':
+    unittest.main()
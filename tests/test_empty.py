@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+import ideapod_catering
+import ideapod_db
+import ideapod_group
+import ideapod_space
+import sample_data
+
+PAGES = {'space': ideapod_space.analyze, 'catering': ideapod_catering.analyze, 'group': ideapod_group.analyze}
+
+class EmptyRangeTest(unittest.TestCase):
+    """日期范围内没有订单时各页面仍返回结果（各表为空），不返回错误"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_path = sample_data.temp_db()
+        cls.conn = ideapod_db.get_db_connection(cls.db_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        shutil.rmtree(os.path.dirname(cls.db_path), ignore_errors=True)
+
+    def test_future_range(self):
+        for page, analyze in PAGES.items():
+            with self.subTest(page=page):
+                results = analyze(self.conn, start_date=date(2030, 1, 1))
+                self.assertNotIn('error', results)
+
+    def test_range_before_data(self):
+        for page, analyze in PAGES.items():
+            with self.subTest(page=page):
+                results = analyze(self.conn, start_date=date(2023, 1, 1), end_date=date(2023, 12, 31))
+                self.assertNotIn('error', results)
+
+    def test_store_filter(self):
+        # 按门店筛选时餐饮热销排行由订单直接建立摘要
+        for page, analyze in PAGES.items():
+            with self.subTest(page=page):
+                results = analyze(self.conn, start_date=date(2030, 1, 1), stores=[sample_data.STORE])
+                self.assertNotIn('error', results)
+
+    def test_parse_order_items(self):
+        catering_df = ideapod_db.read_table(self.conn, 'Catering').iloc[:0]
+        items = ideapod_catering.parse_order_items(catering_df)
+        self.assertTrue(items.empty)
+        self.assertEqual(list(items.columns), ['订单号', 'product', 'quantity', '订单日期'])
+
+class NewProductTest(unittest.TestCase):
+    def test_error_instead_of_exit(self):
+        # Product 表中没有的商品名使分析返回错误信息，不退出进程（按需计算在请求线程中运行）
+        db_path = sample_data.temp_db()
+        conn = ideapod_db.get_db_connection(db_path)
+        new_file = os.path.join(tempfile.mkdtemp(prefix='ideapod_test_'), 'ideapod_product_new.csv')
+        try:
+            conn.execute("DELETE FROM Product WHERE \"商品名\" = '拿铁'")
+            conn.commit()
+            with mock.patch.object(ideapod_catering, 'NEW_PRODUCTS_FILE', new_file):
+                results = ideapod_catering.analyze(conn, start_date=date(2024, 1, 1))
+            self.assertIn('新商品名', results['error'])
+            self.assertTrue(os.path.exists(new_file))
+        finally:
+            conn.close()
+            shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+            shutil.rmtree(os.path.dirname(new_file), ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
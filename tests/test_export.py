@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import ideapod_export
+
+class PruneTest(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='ideapod_test_')
+        self.source_dir = os.path.join(root, 'source')
+        self.output_dir = os.path.join(root, 'output')
+        os.makedirs(self.source_dir)
+        os.makedirs(self.output_dir)
+        self._write(self.source_dir, 'index.html', '<link href="styles.css">')
+        self._write(self.output_dir, 'notes.txt', '手动放入的文件')
+
+    def _write(self, directory: str, name: str, text: str) -> None:
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def _export(self) -> dict:
+        with mock.patch.dict(ideapod_export.PAGES, clear=True):
+            return ideapod_export.export_site(self.source_dir, self.output_dir)
+
+    def test_only_exported_files_removed(self):
+        self._write(self.source_dir, 'styles.css', 'body {}')
+        first = self._export()
+        self.assertEqual(first['removed'], [])
+        old_css = next(name for name in first['files'] if name.endswith('.css'))
+
+        self._write(self.source_dir, 'styles.css', 'body { margin: 0 }')
+        second = self._export()
+        self.assertEqual(second['removed'], [old_css])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'notes.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, old_css)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+import pandas as pd
+import ideapod_forecast
+
+class HistoryRangeTest(unittest.TestCase):
+    def test_clamped_to_first_full_week(self):
+        # 2024-01-02 为周二，是 W-MON 周的第一天
+        first, end = ideapod_forecast.history_range(pd.Timestamp('2024-03-04'), 26, pd.Timestamp('2024-01-03'))
+        self.assertEqual(first, pd.Timestamp('2024-01-09'))
+        self.assertEqual(end, pd.Timestamp('2024-03-05'))
+        first, _ = ideapod_forecast.history_range(pd.Timestamp('2024-03-04'), 26, pd.Timestamp('2024-01-02'))
+        self.assertEqual(first, pd.Timestamp('2024-01-02'))
+
+    def test_no_full_week(self):
+        first, end = ideapod_forecast.history_range(pd.Timestamp('2024-01-05'), 26, pd.Timestamp('2024-01-03'))
+        self.assertEqual(first, end)
+
+class ForecastTableTest(unittest.TestCase):
+    def test_short_series_skipped(self):
+        params = dict(ideapod_forecast.FORECAST_PARAMS, horizon_weeks=2)
+        series = np.tile([[1.0, 5.0]], (7 * 6, 1))
+        series[:7 * 5, 1] = 0
+        origin = pd.Timestamp('2024-01-02')
+        offsets = ideapod_forecast.start_week_offsets([origin, origin + pd.Timedelta(days=7 * 5 - 1)], origin)
+        self.assertEqual(offsets.tolist(), [0, 5])
+        table = ideapod_forecast.forecast_table(series, pd.Index(['a', 'b']), origin + pd.Timedelta(weeks=6), 7,
+                                                '指标', params, start_weeks=offsets)
+        self.assertEqual(table['指标'].tolist(), ['a', 'a'])
+        np.testing.assert_allclose(table['预测值'], 7.0)
+
+    def test_leading_weeks_not_zero(self):
+        params = dict(ideapod_forecast.FORECAST_PARAMS, horizon_weeks=1)
+        series = np.full((7 * 8, 1), 2.0)
+        series[:7 * 4] = 0
+        table = ideapod_forecast.forecast_table(series, pd.Index(['a']), pd.Timestamp('2024-02-27'), 7, '指标', params,
+                                                start_weeks=[4])
+        self.assertAlmostEqual(table['预测值'].iloc[0], 14.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import unittest
+import pandas as pd
+import ideapod_customer
+import ideapod_db
+import ideapod_group
+import sample_data
+
+class GroupAnalyzeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db_path = sample_data.temp_db()
+        cls.conn = ideapod_db.get_db_connection(cls.db_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        shutil.rmtree(os.path.dirname(cls.db_path), ignore_errors=True)
+
+    def test_single_line(self):
+        # 未选中的业务线读为只有表结构的空表
+        for line in ideapod_group.BUSINESS_LINES:
+            with self.subTest(line=line):
+                results = ideapod_group.analyze(self.conn, lines=[line])
+                self.assertNotIn('error', results)
+                ltv = results['客户LTV']['各业务新客数_bar']
+                other = ideapod_group.LINE_NAMES['catering' if line == 'space' else 'space']
+                self.assertGreater(ltv[ideapod_group.LINE_NAMES[line]].sum(), 0)
+                self.assertEqual(ltv[other].sum(), 0)
+
+class PodDiningTest(unittest.TestCase):
+    def test_member_linked_through_space_order(self):
+        # 会员号和手机号只在场景订单上出现过（Member 表中没有），仍按客户编号匹配到预订
+        space_df = pd.DataFrame({
+            '手机号': ['13900000000', '13900000001'], '会员号': ['200000', None],
+            '预定开始时间': pd.to_datetime(['2024-03-01 10:00', '2024-03-01 10:00']),
+            '预定结束时间': pd.to_datetime(['2024-03-01 12:00', '2024-03-01 12:00']),
+            '订单月': pd.PeriodIndex(['2024-03'] * 2, freq='M'), '订单商品名': ['心流舱·巴赫', '心流舱·牛顿']
+        })
+        catering_df = pd.DataFrame({
+            '会员号': ['200000', '200001'], '下单时间': pd.to_datetime(['2024-03-01 11:00', '2024-03-01 11:00']),
+            '实收': [30.0, 20.0], '商品': ['拿铁x1', '拿铁x1'], '订单月': pd.PeriodIndex(['2024-03'] * 2, freq='M')
+        })
+        identity = ideapod_customer.build_identity(pd.concat(
+            [ideapod_customer.frame_links(df) for df in (space_df, catering_df)], ignore_index=True))
+        monthly = ideapod_group.analyze_pod_dining(space_df, catering_df, identity)['在舱餐饮消费_table']
+        self.assertEqual(monthly['在舱订单数'].tolist(), [1])
+        self.assertEqual(monthly['在舱餐饮收入'].tolist(), [30.0])
+
+if __name__ == '__main__':
+    unittest.main()
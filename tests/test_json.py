@@ -0,0 +1,15 @@
+import json
+import unittest
+import numpy as np
+import pandas as pd
+import ideapod_json
+
+class ColumnToJsonTest(unittest.TestCase):
+    def test_mixed_column_missing_values(self):
+        df = pd.DataFrame({'值': pd.Series([1, 'a', np.nan, pd.NA, np.float64('nan'), None, pd.NaT], dtype=object)})
+        text = ideapod_json.dumps_results({'table': df})
+        self.assertNotIn('NaN', text)
+        self.assertEqual(json.loads(text), {'table': {'值': [1, 'a', None, None, None, None, None]}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+import pandas as pd
+import ideapod_kpi
+
+class RollingKpisTest(unittest.TestCase):
+    def test_empty(self):
+        weekly = pd.DataFrame({'订单周': pd.Series([], dtype='period[W-MON]'), '收入': pd.Series([], dtype=float)})
+        result = ideapod_kpi.rolling_kpis(weekly, '订单周', {'收入': '收入'}, comparisons={'wow': 1})
+        self.assertTrue(result.empty)
+        self.assertEqual(list(result.columns), ['订单周', '收入_trailing_4', '收入_trailing_4_wow'])
+
+    def test_period_column(self):
+        weeks = pd.period_range('2024-01-01', periods=6, freq='W-MON')
+        weekly = pd.DataFrame({'订单周': weeks, '收入': [1.0, 1, 1, 1, 2, 2]})
+        by_period = ideapod_kpi.rolling_kpis(weekly, '订单周', {'收入': '收入'}, cutoffs={'收入': '2024-01-10'})
+        by_date = ideapod_kpi.rolling_kpis(weekly.assign(订单周=weeks.start_time), '订单周', {'收入': '收入'},
+                                           cutoffs={'收入': '2024-01-10'})
+        pd.testing.assert_frame_equal(by_period.drop(columns='订单周'), by_date.drop(columns='订单周'))
+        self.assertAlmostEqual(by_period['收入_trailing_4_wow'].iloc[4], 25.0)
+
+    def test_trailing_change_table(self):
+        weekly = pd.DataFrame({'订单周': ['2024-01-01', '2024-01-08'], '销售收入': [10.0, 20.0]})
+        table = ideapod_kpi.trailing_change_table(weekly, '订单周', {'销售收入': '销售收入'})
+        self.assertEqual(list(table.columns), ['周', '销售收入周环比', '销售收入月环比'])
+        self.assertEqual(table['销售收入周环比'].tolist(), [0.0, 200.0])
+        self.assertTrue(ideapod_kpi.trailing_change_table(weekly.iloc[:0], '订单周', {'销售收入': '销售收入'}).empty)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import unittest
+from datetime import date
+import pandas as pd
+import ideapod_db
+import ideapod_remark
+import ideapod_update
+import sample_data
+
+# 替换前的逐行子串匹配（正则），索引查询的结果应与之相同
+SUBSTRING_RULES = {
+    ('Space', '场景活动'): lambda df: df['订单备注'].astype(str).str.lower().str.contains('拍摄|戴老师活动', regex=True),
+    ('Catering', '吧台活动'): lambda df: df['商品'].str.contains('拍摄|包场', na=False)
+}
+
+class RemarkIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.db_path = sample_data.temp_db()
+        self.conn = ideapod_db.get_db_connection(self.db_path)
+        # 标点分隔的关键词、单号重复（其中一行匹配）和空备注
+        rows = [('S9000001', '2024-02-01 10:00:00', '拍,摄'), ('S9000002', '2024-02-01 11:00:00', '预约拍摄'),
+                ('S9000003', '2024-02-02 10:00:00', '普通'), ('S9000003', '2024-02-02 12:00:00', '戴老师活动'),
+                ('S9000004', '2024-04-20 10:00:00', None), ('S9000005', '2024-04-21 10:00:00', 'Xpai拍摄')]
+        self.conn.executemany('INSERT INTO Space ("订单编号", "创建时间", "预定开始时间", "订单备注") VALUES (?, ?, ?, ?)',
+                              [(key, time, time, remark) for key, time, remark in rows])
+        self.conn.executemany('INSERT INTO Catering ("订单号", "下单时间", "商品") VALUES (?, ?, ?)',
+                              [('C9000001', '2024-02-01 10:00:00', '包 场x1'), ('C9000002', '2024-02-01 10:00:00', '包场x1')])
+        self.conn.commit()
+        ideapod_remark.write_remark_index(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(os.path.dirname(self.db_path), ignore_errors=True)
+
+    def assert_matches_substring(self):
+        categories = ideapod_remark.classify(self.conn)
+        for (table, category), contains in SUBSTRING_RULES.items():
+            with self.subTest(table=table, category=category):
+                df = ideapod_db.read_table(self.conn, table)
+                flags = ideapod_remark.category_flags(df, table, category, categories)
+                pd.testing.assert_series_equal(flags, contains(df).astype(bool), check_names=False)
+                self.assertTrue(flags.any())
+
+    def test_matches_substring(self):
+        self.assert_matches_substring()
+        flagged = ideapod_remark.classify(self.conn)
+        self.assertNotIn('S9000001', set(flagged['单号']))
+        self.assertNotIn('C9000001', set(flagged['单号']))
+
+    def test_incremental_rebuild(self):
+        # 只重建替换了数据的时间段，结果与全部重建相同
+        self.conn.execute('UPDATE Space SET "订单备注" = \'拍摄\' WHERE "创建时间" >= \'2024-04-01\'')
+        self.conn.commit()
+        ideapod_update.rebuild_derived(self.conn, ideapod_remark.REMARK_INDEX, ideapod_remark.write_remark_index,
+                                       {'Space': date(2024, 4, 1)})
+        self.assertEqual(ideapod_db.stale_sources(self.conn, ideapod_remark.REMARK_INDEX), [])
+        count = self.conn.execute(f'SELECT COUNT(*) FROM "{ideapod_remark.REMARK_INDEX}"').fetchone()[0]
+        self.assertEqual(count, sum(self.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                                    for table in ideapod_remark.INDEXED_TABLES))
+        self.assert_matches_substring()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import ideapod_worker
+
+@unittest.skipIf(ideapod_worker.fcntl is None, '需要 fcntl')
+class WatchLockTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='ideapod_test_')
+        self.lock_path = os.path.join(self.dir, 'worker.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_single_holder(self):
+        # 同一时间只有一个持有者（gunicorn 的其他 worker 取不到锁，不启动文件监视）
+        first = ideapod_worker._try_lock(self.lock_path)
+        self.assertIsNotNone(first)
+        self.assertIsNone(ideapod_worker._try_lock(self.lock_path))
+        first.close()
+        second = ideapod_worker._try_lock(self.lock_path)
+        self.assertIsNotNone(second)
+        second.close()
+
+    def test_imported_file_not_reimported(self):
+        # 等待任务锁期间其他进程已导入的增量文件不再导入
+        watched = os.path.join(self.dir, 'new_flipos.csv')
+        with open(watched, 'w') as f:
+            f.write('')
+        state_file = os.path.join(self.dir, 'worker_state.json')
+        with mock.patch.object(ideapod_worker, 'WATCHED_FILES', {watched: ('catering',)}), \
+                mock.patch.object(ideapod_worker, 'STATE_FILE', state_file), \
+                mock.patch.object(ideapod_worker, 'JOB_LOCK', os.path.join(self.dir, 'job.lock')), \
+                mock.patch.object(ideapod_worker.ideapod_update, 'update_database') as update, \
+                mock.patch.object(ideapod_worker.ideapod_store, 'list_stores', return_value=[]), \
+                mock.patch.object(ideapod_worker.ideapod_db, 'get_db_connection'):
+            ideapod_worker._save_state({watched: os.stat(watched).st_mtime_ns})
+            job = {'update_files': [watched], 'modules': []}
+            ideapod_worker._run_job(job)
+        update.assert_not_called()
+        self.assertEqual(job['update_files'], [])
+        self.assertEqual(job['state'], 'done')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# 从项目根目录运行：python tools/bench_json.py [space] [catering] [group]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ideapod_json
+
+def legacy_convert_df_to_dict(data):
+    """旧版序列化：逐行生成 dict，作为对比基准"""
+    if isinstance(data, pd.DataFrame):
+        df = data.copy()
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]) or isinstance(df[col].dtype, pd.PeriodDtype):
+                df[col] = df[col].astype(str)
+        return df.replace({np.nan: None}).to_dict(orient='records')
+    elif isinstance(data, dict):
+        return {k: legacy_convert_df_to_dict(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [legacy_convert_df_to_dict(item) for item in data]
+    return data
+
+def legacy_convert_keys_to_str(data):
+    if isinstance(data, dict):
+        return {str(k) if isinstance(k, tuple) else k: legacy_convert_keys_to_str(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [legacy_convert_keys_to_str(item) for item in data]
+    return data
+
+def legacy_save(results, path):
+    processed = legacy_convert_keys_to_str(legacy_convert_df_to_dict(results))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(processed, f, ensure_ascii=False, indent=4, default=str)
+
+def measure(func, results, path, repeat=3):
+    """返回 (最短耗时秒, 峰值内存字节, 文件大小字节)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(results, path)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(results, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, os.path.getsize(path)
+
+def load_results(modules):
+    import ideapod_space
+    import ideapod_catering
+    import ideapod_group
+    analyzers = {
+        'space': ideapod_space.analyze,
+        'catering': ideapod_catering.analyze,
+        'group': ideapod_group.analyze
+    }
+    results = {}
+    with sqlite3.connect('db/ideapod.db') as conn:
+        for name in modules:
+            print(f"正在计算 {name} 分析结果...")
+            result = analyzers[name](conn)
+            if 'error' in result:
+                print(f"{name} 分析出错: {result['error']}")
+                continue
+            results[name] = result
+    return results
+
+def main():
+    modules = sys.argv[1:] or ['space', 'catering', 'group']
+    results = load_results(modules)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"\n{'模块':<10}{'方法':<10}{'耗时(ms)':>12}{'峰值内存(KB)':>16}{'文件大小(KB)':>16}")
+        for name, result in results.items():
+            for label, func in [('legacy', legacy_save), ('columnar', ideapod_json.save_results)]:
+                path = os.path.join(tmp, f'{name}_{label}.json')
+                seconds, peak, size = measure(func, result, path)
+                print(f"{name:<10}{label:<10}{seconds * 1000:>12.1f}{peak / 1024:>16.1f}{size / 1024:>16.1f}")
+
+if __name__ == "__main__":
+    main()